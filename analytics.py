@@ -0,0 +1,249 @@
+"""
+Local columnar snapshot of the label sheet, and label-quality statistics on it.
+
+The snapshot holds one row per sheet data row as NumPy arrays:
+
+    codes      uint16 (rows x choice columns)  0 = blank, 1..k = schema choice, k+1 = other
+    vid        int32   index into vid_table (video_id strings)
+    rater      int32   index into rater_table (rater_id strings; "" when the column is absent)
+    uncertain  bool    label_confidence == "uncertain", or "uncertain" in notes
+
+and is saved as .labeler/snapshots/<sheet>_<schema hash>.npz. sync() fetches
+only the rows below the last one already in the snapshot, in chunks of
+SNAPSHOT_CHUNK_ROWS; rebuild() starts over (use it after rows were edited in
+place, e.g. by upsert, or after a bulk import that rewrote rows).
+
+Everything below the snapshot is vectorized: distributions are bincounts,
+agreement is computed on the latest label of each (video, rater) pair (on
+every row when the schema has no rater_id column).
+"""
+import os, json, zipfile, threading
+
+import numpy as np
+
+from app_paths import data_dir
+from local_sheet import col_to_letters
+
+SNAPSHOT_CHUNK_ROWS = int(os.getenv("SNAPSHOT_CHUNK_ROWS", "10000"))
+SNAPSHOT_VERSION = 1
+SKIP_COLUMNS = {"video_id", "timestamp_utc", "rater_id", "notes", "label_confidence"}
+
+class LabelSnapshot:
+    def __init__(self, path, schema):
+        self.path = str(path)
+        self.columns = list(schema["columns"])
+        self.label_columns = [c for c in self.columns if schema["choices"].get(c) and c not in SKIP_COLUMNS]
+        self.choices = {c: [""] + list(schema["choices"][c]) for c in self.label_columns}
+        option_index = schema.get("option_index") or {}
+        self.option_index = {c: option_index.get(c) or {v: i for i, v in enumerate(self.choices[c]) if i}
+                             for c in self.label_columns}
+        self.lock = threading.Lock()
+        self._summary = None
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.codes = np.zeros((0, len(self.label_columns)), dtype=np.uint16)
+        self.vid = np.zeros(0, dtype=np.int32)
+        self.rater = np.zeros(0, dtype=np.int32)
+        self.uncertain = np.zeros(0, dtype=bool)
+        self.vid_table, self.rater_table = [], []
+        self._vid_ids, self._rater_ids = {}, {}
+        self.next_row = 2  # first sheet row not in the snapshot
+        self._summary = None
+
+    def __len__(self):
+        return len(self.vid)
+
+    # --- persistence --------------------------------------------------------
+    def _load(self):
+        try:
+            with np.load(self.path, allow_pickle=False) as z:
+                meta = json.loads(str(z["meta"]))
+                if meta.get("version") != SNAPSHOT_VERSION or meta.get("label_columns") != self.label_columns:
+                    return
+                self.codes, self.vid, self.rater, self.uncertain = z["codes"], z["vid"], z["rater"], z["uncertain"]
+                self.vid_table, self.rater_table = z["vid_table"].tolist(), z["rater_table"].tolist()
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):  # missing or torn: start empty
+            self._reset()
+            return
+        self.next_row = meta["next_row"]
+        self._vid_ids = {v: i for i, v in enumerate(self.vid_table)}
+        self._rater_ids = {r: i for i, r in enumerate(self.rater_table)}
+
+    def _save(self):
+        meta = {"version": SNAPSHOT_VERSION, "label_columns": self.label_columns, "next_row": self.next_row}
+        tmp = f"{self.path}.{os.getpid()}.tmp.npz"  # np.savez adds .npz to any other name
+        np.savez(tmp, codes=self.codes, vid=self.vid, rater=self.rater, uncertain=self.uncertain,
+                 vid_table=np.array(self.vid_table, dtype=str), rater_table=np.array(self.rater_table, dtype=str),
+                 meta=np.array(json.dumps(meta)))
+        os.replace(tmp, self.path)
+
+    # --- ingest -------------------------------------------------------------
+    def _intern(self, values, table, ids):
+        uniq, inv = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        mapped = np.empty(len(uniq), dtype=np.int32)
+        for i, v in enumerate(uniq.tolist()):
+            if v not in ids:
+                ids[v] = len(table)
+                table.append(v)
+            mapped[i] = ids[v]
+        return mapped[inv]
+
+    def _column(self, rows, name):
+        if name not in self.columns:
+            return None
+        j = self.columns.index(name)
+        return [r[j] if j < len(r) else "" for r in rows]
+
+    def _append(self, rows):
+        n = len(rows)
+        codes = np.zeros((n, len(self.label_columns)), dtype=np.uint16)
+        for k, col in enumerate(self.label_columns):
+            uniq, inv = np.unique(np.asarray(self._column(rows, col), dtype=str), return_inverse=True)
+            other = len(self.choices[col])
+            lut = np.array([0 if not u else self.option_index[col].get(u, other) for u in uniq], dtype=np.uint16)
+            codes[:, k] = lut[inv]
+        vid = self._intern(self._column(rows, "video_id") or [""] * n, self.vid_table, self._vid_ids)
+        rater = self._intern(self._column(rows, "rater_id") or [""] * n, self.rater_table, self._rater_ids)
+        uncertain = np.zeros(n, dtype=bool)
+        conf = self._column(rows, "label_confidence")
+        if conf is not None:
+            uncertain |= np.asarray(conf, dtype=str) == "uncertain"
+        notes = self._column(rows, "notes")
+        if notes is not None:
+            uncertain |= np.char.find(np.asarray(notes, dtype=str), "uncertain") >= 0
+        self.codes = np.concatenate([self.codes, codes])
+        self.vid = np.concatenate([self.vid, vid])
+        self.rater = np.concatenate([self.rater, rater])
+        self.uncertain = np.concatenate([self.uncertain, uncertain])
+
+    def sync(self, ws):
+        """Append the sheet rows below the snapshot; returns how many were added."""
+        last_col = col_to_letters(len(self.columns))
+        added = 0
+        with self.lock:
+            while True:
+                start = self.next_row
+                stop = start + SNAPSHOT_CHUNK_ROWS - 1
+                rows = ws.get(f"A{start}:{last_col}{stop}")
+                rows = [list(r) for r in rows]
+                if rows:
+                    self._append(rows)
+                    self.next_row += len(rows)
+                    added += len(rows)
+                if len(rows) < SNAPSHOT_CHUNK_ROWS:
+                    break
+            if added:
+                self._summary = None
+                self._save()
+        return added
+
+    def rebuild(self, ws):
+        with self.lock:
+            self._reset()
+        return self.sync(ws)
+
+    # --- statistics ---------------------------------------------------------
+    def summary(self):
+        """Distributions, uncertain rate and Fleiss' kappa per column (memoized until the next sync)."""
+        with self.lock:
+            if self._summary is not None:
+                return self._summary
+            # Without a rater_id column every row counts as a separate rating
+            latest = latest_rows(self.vid, self.rater) if "rater_id" in self.columns else np.arange(len(self))
+            out = {"rows": len(self), "videos": len(np.unique(self.vid)), "raters": self.rater_counts(),
+                   "uncertain_rate": float(self.uncertain.mean()) if len(self) else 0.0, "columns": {}}
+            for k, col in enumerate(self.label_columns):
+                labels = self.choices[col][1:] + ["(other)"]
+                counts = np.bincount(self.codes[:, k], minlength=len(labels) + 1)[:len(labels) + 1]
+                kappa, items = fleiss_kappa(self.codes[latest, k], self.vid[latest], len(labels) + 1)
+                out["columns"][col] = {
+                    "labels": labels, "counts": counts[1:].tolist(), "blank": int(counts[0]),
+                    "fleiss_kappa": kappa, "fleiss_items": items,
+                }
+            self._summary = out
+            return out
+
+    def rater_counts(self):
+        counts = np.bincount(self.rater, minlength=len(self.rater_table))
+        return {self.rater_table[i]: int(n) for i, n in enumerate(counts) if n and self.rater_table[i]}
+
+    def cohen(self, column, rater_a, rater_b):
+        """Cohen's kappa between two raters on one column: (kappa, clips rated by both)."""
+        if rater_a not in self._rater_ids or rater_b not in self._rater_ids:
+            return None, 0
+        k = self.label_columns.index(column)
+        with self.lock:
+            latest = latest_rows(self.vid, self.rater)
+            return cohen_kappa(self.codes[latest, k], self.vid[latest], self.rater[latest],
+                               self._rater_ids[rater_a], self._rater_ids[rater_b], len(self.choices[column]) + 1)
+
+# -----------------------------------------------------------------------------
+# Vectorized statistics
+# -----------------------------------------------------------------------------
+def latest_rows(vid, rater):
+    """Indices of the last row of every (video, rater) pair, in row order."""
+    if not len(vid):
+        return np.zeros(0, dtype=np.int64)
+    key = vid.astype(np.int64) * (int(rater.max()) + 1) + rater
+    _, first_from_end = np.unique(key[::-1], return_index=True)
+    return np.sort(len(key) - 1 - first_from_end)
+
+def fleiss_kappa(codes, vid, n_categories):
+    """
+    Fleiss' kappa over clips with at least two non-blank ratings (ratings per
+    clip may vary). Returns (kappa or None, number of clips used).
+    """
+    rated = codes > 0
+    if not rated.any():
+        return None, 0
+    items, item = np.unique(vid[rated], return_inverse=True)
+    counts = np.bincount(item * n_categories + codes[rated].astype(np.int64),
+                         minlength=len(items) * n_categories).reshape(len(items), n_categories)
+    n = counts.sum(axis=1)
+    keep = n >= 2
+    if not keep.any():
+        return None, 0
+    counts, n = counts[keep], n[keep]
+    p_i = ((counts ** 2).sum(axis=1) - n) / (n * (n - 1))
+    p_j = counts.sum(axis=0) / n.sum()
+    p_e = float((p_j ** 2).sum())
+    if p_e >= 1.0:
+        return 1.0, int(keep.sum())
+    return float((p_i.mean() - p_e) / (1 - p_e)), int(keep.sum())
+
+def cohen_kappa(codes, vid, rater, a, b, n_categories):
+    """Cohen's kappa between raters a and b over the clips both labeled (non-blank)."""
+    n_vid = int(vid.max()) + 1 if len(vid) else 0
+    la = np.zeros(n_vid, dtype=np.int64)
+    lb = np.zeros(n_vid, dtype=np.int64)
+    sa, sb = rater == a, rater == b
+    la[vid[sa]] = codes[sa]
+    lb[vid[sb]] = codes[sb]
+    both = (la > 0) & (lb > 0)
+    n = int(both.sum())
+    if not n:
+        return None, 0
+    confusion = np.bincount(la[both] * n_categories + lb[both],
+                            minlength=n_categories * n_categories).reshape(n_categories, n_categories)
+    p_o = np.trace(confusion) / n
+    p_e = float((confusion.sum(axis=1) * confusion.sum(axis=0)).sum()) / (n * n)
+    if p_e >= 1.0:
+        return 1.0, n
+    return float((p_o - p_e) / (1 - p_e)), n
+
+# -----------------------------------------------------------------------------
+# Process-wide snapshots
+# -----------------------------------------------------------------------------
+_SNAPSHOTS = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+
+def get_snapshot(ws, schema):
+    """Shared snapshot of a worksheet for a schema (loaded from disk if present)."""
+    key = f"{ws.spreadsheet_id}_{ws.id}_{schema.get('hash', 'noschema')}"
+    with _SNAPSHOTS_LOCK:
+        snap = _SNAPSHOTS.get(key)
+        if snap is None:
+            snap = _SNAPSHOTS[key] = LabelSnapshot(data_dir("snapshots") / f"{key}.npz", schema)
+    return snap
@@ -1,33 +1,31 @@
-import os, io, json, tempfile
+import os, uuid
 from typing import List, Dict
 import streamlit as st
-from dotenv import load_dotenv
 
-from schema_loader import load_schema_from_excels
-from excel_writer import build_row
-
-# -----------------------------
-# Auth: Cloud (st.secrets) or Local (.env)
-# -----------------------------
-def _setup_auth_env():
-    load_dotenv()
-    # Prefer Streamlit secrets (Cloud)
-    try:
-        if "service_account" in st.secrets:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".json") as tmp:
-                tmp.write(json.dumps(dict(st.secrets["service_account"])).encode())
-                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = tmp.name
-    except Exception:
-        pass
-
-_setup_auth_env()
+# First Streamlit command, before anything that might touch st.secrets
+st.set_page_config(page_title="Driver Emotion Labeler — Google Sheets", layout="wide")
 
-# Lazy import after auth env set
-from gsheets_client import get_worksheet_and_ensure_headers
+# Cheap imports: pandas, gspread and google-auth load lazily on first use,
+# and app_paths loads .env once per process.
+from schema_loader import load_compiled_schema
+from excel_writer import build_row
+from write_queue import get_append_queue
+from video_spool import get_video_spool
+from prefetch import PREFETCH_AHEAD, get_prefetcher
+from label_index import get_label_index
+from label_upsert import find_record, save_label, upsert_possible
+from work_queue import get_work_queue
+from form_drafts import FormDrafts
+from clip_source import get_clip_source, parse_filters, under_clip_root
+from mp4_tools import MP4_PREPARE_LIMIT, describe, get_clip_preparer
+from gsheets_client import SHEETS_BACKEND, get_worksheet_and_ensure_headers, get_row_counter, invalidate_pool
+import tracing
 
-st.set_page_config(page_title="Driver Emotion Labeler — Google Sheets", layout="wide")
 st.title("Driver Emotion Labeler — Google Sheets")
 
+if "session_id" not in st.session_state: st.session_state.session_id = uuid.uuid4().hex
+tracing.begin_rerun(st.session_state, st.session_state.session_id)
+
 # -------------------------------------------------------------------
 # Helpers
 # -------------------------------------------------------------------
@@ -68,13 +66,468 @@ def _normalize_drive_link(url: str) -> str:
         return f"https://drive.google.com/uc?export=download&id={file_id}"
     return url
 
-def _bytes_from_uploads(uploads) -> List[Dict[str, bytes]]:
-    return [{"name": f.name, "data": f.getvalue()} for f in uploads]
+def _clip_video_id(clip) -> str:
+    """Default video_id for a playlist entry: the manifest's id, the URL, or the file name without .mp4."""
+    if clip.get("video_id"):
+        return clip["video_id"]
+    if "url" in clip:
+        return clip["url"]
+    name = clip["name"]
+    return name[:-4] if name.lower().endswith(".mp4") else name
+
+def _clip_ids(files):
+    """video_ids of the playlist in order; manifest sources read them back a page at a time."""
+    return files.video_ids() if hasattr(files, "video_ids") else map(_clip_video_id, files)
+
+def _clip_position(files, video_id):
+    """Playlist position of a clip; manifest sources look it up in their video_id index."""
+    if hasattr(files, "index_of"):
+        return files.index_of(video_id)
+    return [_clip_video_id(f) for f in files].index(video_id)
+
+def _resume_order(files, labeled, mode):
+    """Playlist for resuming: drop or move to the end the clips already in `labeled`."""
+    if mode == RESUME_MODES[2]:
+        return files, 0
+    def where(pred):  # manifest sources filter lazily into a new view
+        return files.where(pred) if hasattr(files, "where") else [f for f in files if pred(f)]
+    todo = where(lambda f: _clip_video_id(f) not in labeled)
+    done = len(files) - len(todo)
+    if mode == RESUME_MODES[1]:
+        todo = todo + where(lambda f: _clip_video_id(f) in labeled)
+    return todo, done
+
+def _advance_review(history):
+    """Step forward through already-finished clips; past the last one, return to the leased clip."""
+    pos = st.session_state.get("review_pos")
+    st.session_state.review_pos = pos + 1 if pos is not None and pos + 1 < len(history) else None
+
+def _load_form_state(drafts, columns, clip_id, prev, rater_id):
+    """Point the fixed-key form widgets at `clip_id`: its draft, else its stored row, else defaults."""
+    live = {f"form_sb_{c}" for c in columns}
+    for k in [k for k in st.session_state if str(k).startswith("form_sb_") and k not in live]:
+        del st.session_state[k]  # columns no longer in the schema
+    draft = drafts.load(clip_id)
+    if draft:
+        values, video_id, uncertain = draft
+    else:
+        values = {c: prev.get(c, "") or (rater_id if c == "rater_id" else "") for c in columns}
+        values["video_id"] = video_id = clip_id
+        uncertain = prev.get("label_confidence") == "uncertain" or "uncertain" in prev.get("notes", "")
+    for col in columns:
+        if col != "timestamp_utc":
+            st.session_state[f"form_sb_{col}"] = values.get(col, "")
+    st.session_state.form_vidid = video_id
+    st.session_state.form_unc = uncertain
+    st.session_state.form_clip = clip_id
+
+VIDEO_SOURCES = ["Upload files", "Paste URLs (one per line)", "Server folder or manifest"]
+def _local_clip_path(clip):
+    """Path of a playlist entry's file on this machine (spooled upload, server clip, cached URL), or None."""
+    if "digest" in clip:
+        return get_video_spool().path(clip["digest"])
+    if "path" in clip:
+        return clip["path"] if under_clip_root(clip["path"]) and os.path.exists(clip["path"]) else None
+    if "url" in clip:
+        return get_prefetcher().cached_path(clip["url"])
+    return None
+
+RESUME_MODES = ["Skip them", "Move them to the end", "Keep order (just flag them)"]
+
+def _spool_uploads(uploads) -> List[Dict[str, str]]:
+    """Stream uploads to the on-disk spool; keep only small handles in session state."""
+    spool = get_video_spool()
+    files = []
+    for f in uploads:
+        entry = spool.put_stream(f)
+        files.append({"name": f.name, "digest": entry["digest"], "size": entry["size"]})
+    return files
+
+def _release_uploads(uploads):
+    """Drop Streamlit's in-memory copies of spooled uploads, which would otherwise live as long as the session."""
+    try:
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        session_id = get_script_run_ctx().session_id
+        for f in uploads:
+            Runtime.instance().uploaded_file_mgr.remove_file(session_id, f.file_id)
+    except Exception:
+        pass
+
+def _debug_panel():
+    """Sidebar timings: the previous rerun, and p50/p95 over this session's recent reruns."""
+    records = [r for r in tracing.recent() if r["session"] == st.session_state.session_id]
+    with st.sidebar.expander("🐞 Debug: timings", expanded=False):
+        if not records:
+            st.caption("Timings appear from the second rerun on.")
+            return
+        last = records[-1]
+        st.markdown(f"**Last {last['kind']}:** {last['wall_ms']:.0f} ms")
+        st.table({name: {"calls": n, "ms": round(ms, 1), "KB": round(b / 1024, 1)}
+                  for name, (n, ms, b) in {**last["spans"], **{f"api.{k}": v for k, v in last["api"].items()}}.items()})
+        summary = tracing.summarize(records)
+        for label, n, wall in (("reruns", summary["reruns"], summary["wall_ms"]),
+                               ("fragment reruns", summary["fragments"], summary["fragment_wall_ms"])):
+            if n:
+                st.markdown(f"**Session, {n} {label}:** p50 {wall['p50']:.0f} ms · p95 {wall['p95']:.0f} ms")
+        st.table({name: {"calls": m["calls"], "p50 ms": m["p50_ms"], "p95 ms": m["p95_ms"]}
+                  for name, m in {**summary["spans"], **{f"api.{k}": v for k, v in summary["api"].items()}}.items()})
+
+if tracing.ENABLED:
+    _debug_panel()
+
+def _session_schema():
+    """Compiled schema for this session, cached in session state so we don’t re-hash on every rerun."""
+    if "schema" not in st.session_state:
+        # Uploaded bytes or repo files; compiled once per workbook content and shared by all sessions
+        bufs = st.session_state.get("schema_bufs", {})
+        with tracing.span("schema_load"):
+            st.session_state.schema = load_compiled_schema(
+                bufs.get("features") or "Features.xlsx",
+                bufs.get("example") or "Example_of_Video_Labelling.xlsx",
+            )
+    return st.session_state.schema
+
+def _connect(settings, schema):
+    os.environ["SPREADSHEET_ID"] = settings["SPREADSHEET_ID"]
+    os.environ["WORKSHEET_NAME"] = settings["WORKSHEET_NAME"]
+    with tracing.span("connect"):
+        return get_worksheet_and_ensure_headers(schema["columns"])
+
+# -----------------------------------------------------------------------------
+# Label tab: fragments and callbacks
+# -----------------------------------------------------------------------------
+# The clip view (video, form, navigation) and the status bar rerun on their own.
+# Buttons change session state in on_click callbacks instead of calling
+# st.rerun(), so going to the next clip re-executes only the clip view, not the
+# Setup tab, the schema check or the connection. (The video has to change with
+# the clip, so it shares a fragment with the form and the navigation.)
+_fragment = (getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+             or (lambda func=None, run_every=None: func or (lambda f: f)))
+
+# Seconds between status-bar refreshes (pending/flushed counts); 0 turns it off.
+STATUS_REFRESH_SECONDS = float(os.getenv("STATUS_REFRESH_SECONDS", "10")) or None
+
+def _fragment_rerun() -> bool:
+    """True while Streamlit is rerunning only a fragment (not the whole script)."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        return bool(getattr(get_script_run_ctx(), "fragment_ids_this_run", None))
+    except Exception:
+        return False
+
+def _begin_fragment():
+    if tracing.ENABLED and _fragment_rerun():
+        tracing.begin_rerun(st.session_state, st.session_state.session_id, kind="fragment")
+
+def _on_flushed(row_counter, label_index):
+    """Sync-engine hook: count the appended rows and give their labels a sheet row in the index."""
+    def hook(batch, sheet_rows, response):
+        row_counter.note_append(len(batch), response)
+        label_index.note_appended([r for _, r in batch], sheet_rows)
+    return hook
+
+def _refresh_count(ctx):
+    ctx["append_queue"].flush(timeout=10)
+    try:
+        ctx["row_counter"].refresh()
+    except Exception as e:
+        st.session_state.flash = ("warning", f"Could not refresh the saved-row count: {e}")
+
+def _retry_parked(ctx):
+    ctx["append_queue"].retry_parked()
+
+@_fragment(run_every=STATUS_REFRESH_SECONDS)
+def _status_bar(ctx):
+    _begin_fragment()
+    c_status, c_refresh = st.columns([5, 1])
+    with c_refresh:
+        st.button("↻ Refresh count", use_container_width=True, on_click=_refresh_count, args=(ctx,))
+    with c_status, tracing.span("row_count"):
+        q = ctx["append_queue"].stats()
+        saved = ctx["row_counter"].value()
+        st.write(
+            f"**Saved rows:** {'—' if saved is None else saved} | "
+            f"**Pending:** {q['pending']} ⏳ | **Flushed:** {q['flushed']} ✅"
+        )
+        if q["last_error"]:
+            st.warning(f"Sheets write retrying ({q['retries']} so far): {q['last_error']}")
+    if q["parked"]:
+        c_parked, c_retry = st.columns([5, 1])
+        c_parked.error(f"**{q['parked']} label(s) on hold:** Google Sheets rejected them, so they are kept "
+                       f"locally and not retried. Last error: {q['parked_error']}")
+        c_retry.button("Retry on-hold labels", use_container_width=True, on_click=_retry_parked, args=(ctx,))
+
+def _step(delta):
+    st.session_state.idx = min(max(st.session_state.idx + delta, 0), len(st.session_state.files) - 1)
+
+def _lease_back():
+    history = st.session_state.lease_history
+    pos = st.session_state.get("review_pos")
+    st.session_state.review_pos = len(history) - 1 if pos is None else pos - 1
+
+def _lease_skip(ctx):
+    if st.session_state.get("review_pos") is None:
+        ctx["work"].release(ctx["rater_id"], st.session_state.lease)
+        st.session_state.setdefault("skipped", []).append(st.session_state.lease)
+        st.session_state.lease = None
+    else:
+        _advance_review(st.session_state.lease_history)
+
+def _submit(ctx):
+    """Form callback: queue the label, then move on to the next clip."""
+    ss = st.session_state
+    schema = ctx["schema"]
+    video_id = ss.get("form_vidid", "")
+    if not video_id:
+        ss.flash = ("error", "Please set a video_id before submitting.")
+        return
+    try:
+        form_vals = {c: ss.get(f"form_sb_{c}", "") for c in schema["columns"] if c != "timestamp_utc"}
+        form_vals["video_id"] = video_id
+        uncertain = ss.get("form_unc", False)
+        ss.drafts.save(ss.form_clip, form_vals, video_id, uncertain)
+        if uncertain:
+            if "label_confidence" in schema["columns"]:
+                form_vals["label_confidence"] = "uncertain"
+            elif "notes" in schema["columns"]:
+                existing = form_vals.get("notes", "")
+                if "uncertain" not in existing:
+                    form_vals["notes"] = (existing + "; " if existing else "") + "uncertain"
+
+        row = build_row(schema["columns"], form_vals)
+        was_labeled = video_id in ctx["label_index"]
+        with tracing.span("submit"):
+            outcome = save_label(ctx["append_queue"], ctx["ws"], ctx["label_index"], schema["columns"], row, video_id,
+                                 session_id=ss.session_id, upsert=ctx["upsert"])
+    except Exception as e:
+        ss.flash = ("error", f"Could not queue label: {e}")
+        return
+    if form_vals.get("rater_id"):
+        ss.last_rater = form_vals["rater_id"]
+    if outcome == "updated":
+        ss.flash = ("info", f"Updated the existing row for `{video_id}`.")
+    elif was_labeled:
+        ss.flash = ("warning", f"`{video_id}` was already labeled; another row was added for it.")
+    else:
+        ss.flash = ("success", "Saved ✅ (queued for Google Sheets)")
+
+    if ctx["work"] is not None:
+        if ss.get("review_pos") is None:
+            ctx["work"].complete(ctx["rater_id"], ss.lease)
+            ss.lease_history.append(ss.lease)
+            ss.lease = None
+        else:
+            _advance_review(ss.lease_history)
+    else:
+        _step(1)
+
+@_fragment
+def _clip_view(ctx):
+    _begin_fragment()
+    schema, label_index, work, rater_id = ctx["schema"], ctx["label_index"], ctx["work"], ctx["rater_id"]
+    files = st.session_state.files
+    total = len(files)
+
+    flash = st.session_state.pop("flash", None)
+    if flash:
+        getattr(st, flash[0])(flash[1])
+
+    if work is not None:
+        history = st.session_state.setdefault("lease_history", [])
+        lease = st.session_state.get("lease")
+        if lease and not work.heartbeat(rater_id, lease):
+            st.warning("Your lease on the last clip expired, so it may have gone to another rater.")
+            lease = None
+        if not lease:
+            lease = st.session_state.lease = work.acquire(rater_id, exclude=st.session_state.get("skipped", []))
+        review_pos = st.session_state.get("review_pos")
+        current_item = history[review_pos] if review_pos is not None else lease
+        progress = work.progress()
+        st.caption(f"Shared playlist: {progress['done']}/{progress['total']} clips done · "
+                   f"{progress['leased']} being labeled right now")
+        if current_item is None:
+            st.success("Nothing left for you on this playlist. 🎉")
+            return
+        st.session_state.idx = _clip_position(files, current_item)
+
+    # Clamp idx
+    if st.session_state.idx < 0: st.session_state.idx = 0
+    if st.session_state.idx > total - 1: st.session_state.idx = total - 1
+
+    current_i = st.session_state.idx
+    cur = files[current_i]
+    st.subheader(f"Now labeling: {cur.get('name','(video)')}  ·  clip {current_i+1}/{total}")
+
+    with tracing.span("video") as video_span:
+        window = files[current_i:current_i + 1 + PREFETCH_AHEAD]
+        if "url" in cur:
+            get_prefetcher().prefetch([f["url"] for f in window if "url" in f])
+        # Inspect / faststart-remux the clips around this one in the background
+        preparer = get_clip_preparer()
+        preparer.submit([p for p in map(_local_clip_path, window) if p])
+        local_path = _local_clip_path(cur)
+        if local_path:
+            st.video(preparer.playable_path(local_path), format="video/mp4", start_time=0)
+        elif "url" in cur:
+            st.video(cur["url"])
+        elif "path" in cur and not under_clip_root(cur["path"]):
+            st.warning(f"Clip is outside the CLIP_ROOT folders: `{cur['path']}`")
+        elif "path" in cur:
+            st.warning(f"Clip not found on the server: `{cur['path']}`")
+        else:
+            st.warning("This clip was evicted from the local video spool. Re-upload it in **Setup** to watch it.")
+        if "url" in cur:
+            st.caption("Playing from local cache" if local_path else "Streaming from source (caching in background)")
+        if tracing.ENABLED and "digest" in cur:
+            video_span.bytes = cur.get("size", 0)
+        details = describe(preparer.meta(local_path)) if local_path else ""
+        if cur.get("meta"):
+            details = " · ".join([f"{k}: {v}" for k, v in cur["meta"].items()] + ([details] if details else []))
+        if details:
+            st.caption(details)
+
+    default_id = _clip_video_id(cur)
+    stored = None
+    if default_id in label_index:
+        rows = [r for r in label_index.rows_for(default_id) if r]
+        where = f" (sheet row {', '.join(map(str, rows))})" if rows else " (not yet synced)"
+        if ctx["upsert"]:
+            with tracing.span("find_record"):
+                stored = find_record(ctx["append_queue"].spool, ctx["ws"], label_index, schema["columns"],
+                                     default_id, st.session_state.get("last_rater") or rater_id)
+        hint = " Submitting will update it." if stored else ""
+        st.warning(f"⚠️ `{default_id}` is already labeled{where}.{hint}")
+    prev = dict(zip(schema["columns"], stored["row"])) if stored else {}
+
+    # Form widgets keep fixed keys; what was entered for each clip lives in the
+    # compact draft store and is loaded back into the widgets on clip change.
+    drafts = st.session_state.get("drafts")
+    if drafts is None or drafts.columns != schema["columns"]:
+        drafts = st.session_state.drafts = FormDrafts(schema["columns"], schema["choices"], schema.get("option_index"))
+    # (Streamlit also drops widget state after a rerun that stopped before rendering the form.)
+    if st.session_state.get("form_clip") != default_id or "form_vidid" not in st.session_state:
+        _load_form_state(drafts, schema["columns"], default_id, prev, rater_id)
+
+    # -----------------------------
+    # Labels (inside a form to avoid reruns while selecting)
+    # -----------------------------
+    with tracing.span("form"), st.form("label_form", clear_on_submit=False):
+        st.subheader("Labels")
+        video_id = st.text_input("video_id", key="form_vidid")
+
+        for col in schema["columns"]:
+            if col == "timestamp_utc":
+                continue
+            opts = [""] + schema["choices"].get(col, [])
+            current = st.session_state.get(f"form_sb_{col}", "")
+            if col == "video_id" and video_id and video_id not in opts:
+                opts.insert(1, video_id)
+            if current not in opts:
+                opts.append(current)
+            st.selectbox(col, options=opts, key=f"form_sb_{col}")
+
+        st.checkbox("Mark as uncertain", key="form_unc")
+        st.form_submit_button("Submit & Next", on_click=_submit, args=(ctx,))
+
+    # Navigation (outside form)
+    c1, c2 = st.columns(2)
+    if work is not None:
+        # Previous walks back through the clips this rater finished; Next skips the leased clip
+        with c1:
+            st.button("⟵ Previous", use_container_width=True, disabled=(not history or review_pos == 0),
+                      on_click=_lease_back)
+        with c2:
+            st.button("Next (without saving)", use_container_width=True, on_click=_lease_skip, args=(ctx,))
+    else:
+        with c1:
+            st.button("⟵ Previous", use_container_width=True, disabled=(current_i == 0),
+                      on_click=_step, args=(-1,))
+        with c2:
+            st.button("Next (without saving)", use_container_width=True, disabled=(current_i == total - 1),
+                      on_click=_step, args=(1,))
+
+# -----------------------------------------------------------------------------
+# Analytics tab
+# -----------------------------------------------------------------------------
+# Works on the local snapshot (analytics.py): nothing is fetched from the sheet
+# until Sync or Rebuild is pressed, and nothing is computed until the dashboard
+# is opened, so the tab costs nothing on reruns of the rest of the app.
+def _snapshot(ws, schema):
+    from analytics import get_snapshot  # numpy is only imported once analytics is used
+    return get_snapshot(ws, schema)
+
+def _sync_snapshot(rebuild=False):
+    st.session_state.analytics_open = True
+    try:
+        schema = _session_schema()
+        ws = _connect(st.session_state.settings, schema)
+        snap = _snapshot(ws, schema)
+        with tracing.span("snapshot_sync"):
+            n = snap.rebuild(ws) if rebuild else snap.sync(ws)
+        st.session_state.analytics_flash = ("success", f"Snapshot: {n} row(s) fetched.")
+    except Exception as e:
+        st.session_state.analytics_flash = ("error", f"Sync failed: {e}")
+
+@_fragment
+def _analytics_view():
+    _begin_fragment()
+    settings = st.session_state.get("settings", {})
+    if not settings.get("SPREADSHEET_ID"):
+        st.info("Save your Spreadsheet ID in **Setup** first.")
+        return
+    c_sync, c_rebuild, _ = st.columns([1, 1, 3])
+    c_sync.button("↻ Sync new rows", use_container_width=True, on_click=_sync_snapshot)
+    c_rebuild.button("Rebuild from sheet", use_container_width=True, on_click=_sync_snapshot, args=(True,),
+                     help="Re-read every row, e.g. after labels were edited in place.")
+    flash = st.session_state.pop("analytics_flash", None)
+    if flash:
+        getattr(st, flash[0])(flash[1])
+    if not st.session_state.get("analytics_open"):
+        st.button("Open dashboard", on_click=lambda: st.session_state.update(analytics_open=True))
+        return
+    try:
+        schema = _session_schema()
+        snap = _snapshot(_connect(settings, schema), schema)
+    except Exception as e:
+        st.error(f"Could not open the sheet: {e}")
+        return
+    if not len(snap):
+        st.info("The snapshot is empty. Press **Sync new rows** to fetch the sheet.")
+        return
+    with tracing.span("analytics"):
+        summary = snap.summary()
+    st.write(f"**Rows:** {summary['rows']} | **Clips:** {summary['videos']} | "
+             f"**Raters:** {len(summary['raters'])} | **Uncertain:** {summary['uncertain_rate']:.1%}")
+    if not snap.label_columns:
+        st.info("The schema has no columns with fixed choices to summarize.")
+        return
+    col = st.selectbox("Column", snap.label_columns, key="analytics_col")
+    stats = summary["columns"][col]
+    c_chart, c_agree = st.columns([3, 2])
+    with c_chart:
+        st.bar_chart({"count": dict(zip(stats["labels"], stats["counts"]))})
+        st.caption(f"{stats['blank']} blank")
+    with c_agree:
+        kappa = stats["fleiss_kappa"]
+        st.metric("Fleiss' kappa", "—" if kappa is None else f"{kappa:.3f}",
+                  help=f"Over {stats['fleiss_items']} clip(s) with two or more raters; latest label per rater.")
+        raters = sorted(summary["raters"], key=summary["raters"].get, reverse=True)
+        if len(raters) >= 2:
+            r1 = st.selectbox("Rater A", raters, index=0, key="analytics_r1")
+            r2 = st.selectbox("Rater B", raters, index=1, key="analytics_r2")
+            k2, n2 = snap.cohen(col, r1, r2)
+            st.metric("Cohen's kappa", "—" if k2 is None else f"{k2:.3f}", help=f"{n2} clip(s) labeled by both.")
+    with st.expander("All columns"):
+        st.table([{"column": c, "Fleiss' kappa": "—" if s["fleiss_kappa"] is None else f"{s['fleiss_kappa']:.3f}",
+                   "clips": s["fleiss_items"], "blank": s["blank"],
+                   "top choice": s["labels"][max(range(len(s["counts"])), key=s["counts"].__getitem__)]}
+                  for c, s in summary["columns"].items()])
 
 # -----------------------------------------------------------------------------
-# Tabs: Setup / Label
+# Tabs: Setup / Label / Analytics
 # -----------------------------------------------------------------------------
-tab_setup, tab_label = st.tabs(["🧰 Setup", "🎬 Label"])
+tab_setup, tab_label, tab_analytics = st.tabs(["🧰 Setup", "🎬 Label", "📊 Analytics"])
 
 # --------------------------------------------------------------------------------
 # 🧰 SETUP TAB
@@ -110,30 +563,82 @@ with tab_setup:
         st.markdown("**Video source**")
         source = st.radio(
             "Choose a source",
-            options=["Upload files", "Paste URLs (one per line)"],
+            options=VIDEO_SOURCES,
             index=0,
             horizontal=True,
         )
 
         url_text = ""
         uploads = None
-        if source == "Upload files":
+        if source == VIDEO_SOURCES[0]:
             uploads = st.file_uploader(
                 "Upload one or more .mp4 files (they stay local/client-side)",
-                type=["mp4"], accept_multiple_files=True, key="video_up"
+                type=["mp4"], accept_multiple_files=True,
+                key=f"video_up_{st.session_state.get('video_up_n', 0)}",  # new key = empty uploader, see below
             )
-        else:
+        elif source == VIDEO_SOURCES[1]:
             url_text = st.text_area(
                 "Video URLs (HTTP/HTTPS). For Google Drive links, ensure 'Anyone with the link' and paste the share links (one per line).",
                 placeholder="https://drive.google.com/file/d/FILE_ID/view?usp=sharing\nhttps://example.com/video2.mp4\n...",
                 height=120,
             )
+        else:
+            clip_location = st.text_input(
+                "Folder or manifest on this server",
+                value=st.session_state.settings.get("CLIP_SOURCE", os.getenv("CLIP_SOURCE", "")),
+                help="A folder of .mp4 files, or a CSV/JSONL manifest with video_id, path or url, and optional metadata columns.",
+            )
+            clip_filter = st.text_input(
+                "Only clips matching (optional)",
+                value=st.session_state.settings.get("CLIP_FILTER", ""),
+                placeholder="camera=front, weather=rain|snow",
+            )
+
+        upsert = st.checkbox(
+            "Re-submitting a clip updates its existing row (instead of adding a new one)",
+            value=st.session_state.settings.get("UPSERT", True),
+            help="On shared playlists with more than one rater per clip this needs a rater_id column in the "
+                 "schema; without one every submit adds a row.",
+        )
+
+        st.markdown("---")
+        st.markdown("**Raters**")
+        rater_id = st.text_input(
+            "Rater ID",
+            value=st.session_state.settings.get("RATER_ID", os.getenv("RATER_ID", "")),
+            help="Pre-fills the rater_id column and identifies you on shared playlists.",
+        )
+        leases = st.checkbox(
+            "Shared playlist: hand out clips one at a time so several raters can work on it together",
+            value=st.session_state.settings.get("LEASES", False),
+        )
+        raters_per_clip = st.number_input(
+            "Raters per clip (shared playlists; >1 for agreement studies)",
+            min_value=1, max_value=20,
+            value=st.session_state.settings.get("RATERS_PER_CLIP", 1),
+        )
+
+        resume_mode = st.radio(
+            "Clips already labeled in the sheet",
+            options=RESUME_MODES,
+            index=RESUME_MODES.index(st.session_state.get("resume_mode", RESUME_MODES[0])),
+            horizontal=True,
+            disabled=st.session_state.settings.get("LEASES", False),
+            help="Not used on shared playlists: every rater loads the whole playlist, and clips "
+                 "that have all their ratings are no longer handed out.",
+        )
 
         submitted = st.form_submit_button("Save setup")
         if submitted:
             # Persist settings
             st.session_state.settings["SPREADSHEET_ID"] = SPREADSHEET_ID.strip()
             st.session_state.settings["WORKSHEET_NAME"] = WORKSHEET_NAME.strip()
+            st.session_state.settings["UPSERT"] = upsert
+            st.session_state.settings["RATER_ID"] = rater_id.strip()
+            st.session_state.settings["LEASES"] = leases
+            st.session_state.settings["RATERS_PER_CLIP"] = int(raters_per_clip)
+            for k in ("lease", "lease_history", "review_pos", "skipped", "work_queue"):
+                st.session_state.pop(k, None)
 
             # Save schema into session as bytes (or note file paths if not uploaded)
             if "schema_bufs" not in st.session_state:
@@ -141,26 +646,56 @@ with tab_setup:
 
             st.session_state.schema_bufs["features"] = features_file.getvalue() if features_file else None
             st.session_state.schema_bufs["example"] = example_file.getvalue() if example_file else None
+            st.session_state.pop("schema", None)  # recompile (or fetch from cache) on the Label tab
 
             # Build the video list (bytes or URLs)
             if "files" not in st.session_state: st.session_state.files = []
-            if "use_urls" not in st.session_state: st.session_state.use_urls = False
             if "idx" not in st.session_state: st.session_state.idx = 0
 
-            if source == "Upload files":
-                st.session_state.use_urls = False
-                st.session_state.files = _bytes_from_uploads(uploads) if uploads else []
-            else:
-                st.session_state.use_urls = True
+            if source == VIDEO_SOURCES[0]:
+                st.session_state.files = _spool_uploads(uploads) if uploads else []
+                if uploads:
+                    # The spool has the clips now: let go of the uploaded bytes and the widget holding them
+                    _release_uploads(uploads)
+                    st.session_state.video_up_n = st.session_state.get("video_up_n", 0) + 1
+                spool = get_video_spool()
+                if sum(f["size"] for f in st.session_state.files) > spool.quota:
+                    st.warning("These uploads exceed the video spool quota (VIDEO_SPOOL_QUOTA_MB); "
+                               "the oldest clips may need to be uploaded again.")
+            elif source == VIDEO_SOURCES[1]:
                 urls = [u.strip() for u in (url_text or "").splitlines() if u.strip()]
                 # normalize Drive links to streamable
                 urls = [_normalize_drive_link(u) for u in urls]
                 st.session_state.files = [{"name": f"URL {i+1}", "url": u} for i, u in enumerate(urls)]
+            else:
+                st.session_state.settings["CLIP_SOURCE"] = clip_location.strip()
+                st.session_state.settings["CLIP_FILTER"] = clip_filter.strip()
+                try:
+                    # Shared, offset-indexed view of the manifest: entries are read back a page at a time
+                    st.session_state.files = get_clip_source(clip_location.strip(), parse_filters(clip_filter), rescan=True)
+                    st.info(f"{len(st.session_state.files)} clip(s) found.")
+                except (OSError, ValueError) as e:
+                    st.session_state.files = []
+                    st.error(f"Could not read the clip folder or manifest: {e}")
+
+            # Inspect and faststart-remux the start of the playlist in the background
+            files = st.session_state.files
+            get_clip_preparer().submit(
+                p for p in map(_local_clip_path, files[:MP4_PREPARE_LIMIT]) if p
+            )
 
             st.session_state.idx = 0
+            st.session_state.resume_mode = resume_mode
+            st.session_state.needs_resume = True  # reorder against the sheet once connected
             st.success("Setup saved. Switch to the **Label** tab to start.")
             st.query_params.update(tab="label")
 
+# --------------------------------------------------------------------------------
+# 📊 ANALYTICS TAB (filled before the Label tab, whose guardrails end the script with st.stop())
+# --------------------------------------------------------------------------------
+with tab_analytics:
+    _analytics_view()
+
 # --------------------------------------------------------------------------------
 # 🎬 LABEL TAB
 # --------------------------------------------------------------------------------
@@ -171,148 +706,67 @@ with tab_label:
         st.stop()
 
     # Load schema (from uploaded bytes or from default files on disk)
-    # Cache in session so we don’t re-read on every rerun
-    if "schema" not in st.session_state:
-        try:
-            if st.session_state.get("schema_bufs", {}).get("features") or st.session_state.get("schema_bufs", {}).get("example"):
-                # Read from uploaded buffers
-                import pandas as pd
-                from io import BytesIO
-                features_buf = st.session_state.schema_bufs.get("features")
-                example_buf = st.session_state.schema_bufs.get("example")
-                # For schema_loader, we need temp files or we can adapt loader; simplest: write temp files
-                tmp_dir = tempfile.mkdtemp()
-                f_path = os.path.join(tmp_dir, "Features.xlsx")
-                e_path = os.path.join(tmp_dir, "Example_of_Video_Labelling.xlsx")
-                if features_buf:
-                    with open(f_path, "wb") as f:
-                        f.write(features_buf)
-                if example_buf:
-                    with open(e_path, "wb") as f:
-                        f.write(example_buf)
-                schema = load_schema_from_excels(
-                    f_path if features_buf else "Features.xlsx",
-                    e_path if example_buf else "Example_of_Video_Labelling.xlsx"
-                )
-            else:
-                # Fall back to repo files
-                schema = load_schema_from_excels("Features.xlsx", "Example_of_Video_Labelling.xlsx")
-
-            # Ensure `video_id` first (safety)
-            if "video_id" in schema["columns"]:
-                schema["columns"] = ["video_id"] + [c for c in schema["columns"] if c != "video_id"]
-            st.session_state.schema = schema
-        except Exception as e:
-            st.error(f"Failed to load schema: {e}")
-            st.stop()
-
-    schema = st.session_state.schema
+    try:
+        schema = _session_schema()
+    except Exception as e:
+        st.error(f"Failed to load schema: {e}")
+        st.stop()
 
     # Connect to Google Sheets using stored IDs
     try:
-        os.environ["SPREADSHEET_ID"] = st.session_state.settings["SPREADSHEET_ID"]
-        os.environ["WORKSHEET_NAME"] = st.session_state.settings["WORKSHEET_NAME"]
-        ws = get_worksheet_and_ensure_headers(schema["columns"])
-        st.success(f"Connected to Google Sheet • Worksheet: {st.session_state.settings['WORKSHEET_NAME']}")
+        ws = _connect(st.session_state.settings, schema)
+        where = "local sheet (offline)" if SHEETS_BACKEND == "local" else "Google Sheet"
+        st.success(f"Connected to {where} • Worksheet: {st.session_state.settings['WORKSHEET_NAME']}")
     except Exception as e:
+        invalidate_pool(st.session_state.settings["SPREADSHEET_ID"], st.session_state.settings["WORKSHEET_NAME"])
         st.error(f"Google Sheets setup failed: {e}")
         st.stop()
 
     # Ensure files and idx exist
     if "files" not in st.session_state: st.session_state.files = []
     if "idx" not in st.session_state: st.session_state.idx = 0
-    if "use_urls" not in st.session_state: st.session_state.use_urls = False
+
+    with tracing.span("index"):
+        row_counter = get_row_counter(ws)
+        append_queue = get_append_queue(ws)
+        label_index = get_label_index(ws, schema["columns"], pending_rows=[r for _, r in append_queue.spool.pending()])
+        append_queue.on_flushed = _on_flushed(row_counter, label_index)
+        row_counter.seed(label_index.sheet_rows)
+    lease_mode = st.session_state.settings.get("LEASES", False)
+    rater_id = st.session_state.settings.get("RATER_ID", "")
+    # A shared playlist must be the same for every rater (it names the queue), so it is never filtered
+    if st.session_state.pop("needs_resume", False) and st.session_state.files and not lease_mode:
+        st.session_state.files, n_done = _resume_order(
+            st.session_state.files, label_index, st.session_state.get("resume_mode", RESUME_MODES[0])
+        )
+        st.session_state.idx = 0
+        if n_done:
+            st.info(f"{n_done} clip(s) already labeled in the sheet — {st.session_state.resume_mode.lower()}.")
 
     total = len(st.session_state.files)
     if total == 0:
         st.info("No videos loaded. Go back to **Setup** and add uploads or URLs.")
         st.stop()
 
-    # Clamp idx
-    if st.session_state.idx < 0: st.session_state.idx = 0
-    if st.session_state.idx > total - 1: st.session_state.idx = total - 1
-
-    current_i = st.session_state.idx
-    saved_rows = max(len(ws.get_all_values()) - 1, 0)
-    st.write(f"**Clip:** {current_i+1}/{total} | **Saved rows:** {saved_rows}")
-
-    # Current clip
-    cur = st.session_state.files[current_i]
-    st.subheader(f"Now labeling: {cur.get('name','(video)')}")
-
-    if st.session_state.use_urls:
-        st.video(cur["url"])
-        default_id = cur["url"]
-    else:
-        st.video(cur["data"], format="video/mp4", start_time=0)
-        default_id = cur["name"][:-4] if cur["name"].lower().endswith(".mp4") else cur["name"]
-
-    # -----------------------------
-    # Labels (inside a form to avoid reruns while selecting)
-    # -----------------------------
-    with st.form(f"label_form_{current_i}", clear_on_submit=False):
-        st.subheader("Labels")
-        video_id = st.text_input("video_id", value=default_id, key=f"vidid_{current_i}")
-
-        form_vals = {}
-        for col in schema["columns"]:
-            if col == "timestamp_utc":
-                continue
-            opts = [""] + schema["choices"].get(col, [])
-            if col == "video_id":
-                default = video_id or ""
-                if default and default not in opts:
-                    opts.insert(1, default)
-                form_vals[col] = st.selectbox(
-                    col,
-                    options=opts,
-                    index=opts.index(default) if default in opts else 0,
-                    key=f"sb_{col}_{current_i}"
-                )
-            else:
-                form_vals[col] = st.selectbox(
-                    col,
-                    options=opts,
-                    index=0,
-                    key=f"sb_{col}_{current_i}"
-                )
-
-        uncertain = st.checkbox("Mark as uncertain", key=f"unc_{current_i}")
-        submitted = st.form_submit_button("Submit & Next")
-
-    # Handle submit
-    if submitted:
-        if not video_id:
-            st.error("Please set a video_id before submitting.")
-        else:
-            try:
-                form_vals["video_id"] = video_id
-                if uncertain:
-                    if "label_confidence" in schema["columns"]:
-                        form_vals["label_confidence"] = "uncertain"
-                    elif "notes" in schema["columns"]:
-                        existing = form_vals.get("notes", "")
-                        form_vals["notes"] = (existing + "; " if existing else "") + "uncertain"
-
-                row = build_row(schema["columns"], form_vals)
-                ws.append_row(row, value_input_option="USER_ENTERED")
-                st.success("Saved to Google Sheets ✅")
-
-                if st.session_state.idx < len(st.session_state.files) - 1:
-                    st.session_state.idx += 1
-                st.rerun()
-            except Exception as e:
-                st.error(f"Append failed: {e}")
-
-    # Navigation (outside form)
-    c1, c2 = st.columns(2)
-    with c1:
-        if st.button("⟵ Previous", use_container_width=True, disabled=(current_i == 0)):
-            if st.session_state.idx > 0:
-                st.session_state.idx -= 1
-            st.rerun()
-    with c2:
-        if st.button("Next (without saving)", use_container_width=True, disabled=(current_i == total - 1)):
-            if st.session_state.idx < len(st.session_state.files) - 1:
-                st.session_state.idx += 1
-            st.rerun()
\ No newline at end of file
+    # Shared playlist: the work queue decides which clip this rater sees
+    work = None
+    if lease_mode:
+        if not rater_id:
+            st.warning("Shared playlists need a **Rater ID**. Set it in **Setup**.")
+            st.stop()
+        if "work_queue" not in st.session_state:
+            ids = list(_clip_ids(st.session_state.files))
+            st.session_state.work_queue = get_work_queue(
+                ids, st.session_state.settings.get("RATERS_PER_CLIP", 1),
+                completed=lambda: {v: len(label_index.rows_for(v)) for v in ids if v in label_index},
+            )
+        work = st.session_state.work_queue
+
+    ctx = {
+        "ws": ws, "schema": schema, "row_counter": row_counter, "append_queue": append_queue,
+        "label_index": label_index, "work": work, "rater_id": rater_id,
+        "upsert": st.session_state.settings.get("UPSERT", True) and upsert_possible(
+            schema["columns"], st.session_state.settings.get("RATERS_PER_CLIP", 1) if lease_mode else 1),
+    }
+    _status_bar(ctx)
+    _clip_view(ctx)
@@ -0,0 +1,24 @@
+import os
+from pathlib import Path
+
+_ENV_LOADED = False
+
+def load_env():
+    """Load .env into os.environ once per process (later calls are no-ops)."""
+    global _ENV_LOADED
+    if not _ENV_LOADED:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _ENV_LOADED = True
+
+# Modules read their settings from the environment at import time
+load_env()
+
+def data_dir(*parts):
+    """
+    Local working directory for spools, caches and databases.
+    Defaults to ./.labeler; override with LABELER_DATA_DIR.
+    """
+    p = Path(os.getenv("LABELER_DATA_DIR", ".labeler")).joinpath(*parts)
+    p.mkdir(parents=True, exist_ok=True)
+    return p
@@ -0,0 +1,307 @@
+"""
+Per-interaction cost of the Label tab.
+
+Drives app.py with streamlit's AppTest against an in-process fake sheet
+(local_sheet.LocalWorksheet behind a counting proxy), and for each interaction
+records Sheets API calls by method, bytes sent/received (JSON size of the
+arguments/results), wall time and peak Python allocation:
+
+    connect   first render of the Label tab (schema, connection, row count, index)
+    render    a plain rerun of the same clip
+    count     "Refresh count"
+    submit    "Submit & Next" (synchronous part)
+    flush     the background write that follows a submit
+    navigate_full  "Next (without saving)" then "Previous", each as a full rerun
+    navigate  the same two clicks as the browser runs them: only the clip-view fragment
+
+AppTest itself reruns the whole script on every click; FragmentRuns makes it
+rerun just the fragment a clicked button lives in, like the browser does, so
+navigate vs navigate_full shows what fragment-scoped reruns save. Every
+interaction also reports how many full and fragment runs it took.
+
+Sweeps sheet size x schema width x playlist size; every combination runs in
+a fresh interpreter so process-wide caches start cold.
+
+    python benchmarks/interaction_bench.py --rows 0 1000 10000 --columns 10 40 --playlist 10 1000 --out bench.json
+    python benchmarks/interaction_bench.py ... --compare old_bench.json
+
+Wall times include tracemalloc overhead; pass --no-mem for clean timings.
+"""
+import os, sys, json, time, argparse, tempfile, itertools, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPREADSHEET_ID, WORKSHEET = "bench", "labels_log"
+
+# -----------------------------------------------------------------------------
+# Counting proxy around the fake gspread objects
+# -----------------------------------------------------------------------------
+def _size(obj):
+    try:
+        return len(json.dumps(obj, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+class ApiMeter:
+    def __init__(self):
+        self.calls = {}
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def snapshot(self):
+        return dict(self.calls), self.bytes_out, self.bytes_in
+
+    def since(self, snap):
+        calls, out, inn = snap
+        diff = {k: v - calls.get(k, 0) for k, v in self.calls.items() if v - calls.get(k, 0)}
+        return {"api_calls": diff, "api_calls_total": sum(diff.values()),
+                "bytes_out": self.bytes_out - out, "bytes_in": self.bytes_in - inn}
+
+class Counting:
+    """Wraps a LocalClient/LocalSpreadsheet/LocalWorksheet; every method call is metered."""
+
+    _WRAP_RESULTS = {"open_by_key", "worksheet", "add_worksheet", "worksheets"}
+
+    def __init__(self, target, meter):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_meter", meter)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        meter = self._meter
+
+        def call(*args, **kwargs):
+            meter.calls[name] = meter.calls.get(name, 0) + 1
+            meter.bytes_out += _size([args, kwargs])
+            result = attr(*args, **kwargs)
+            if name in self._WRAP_RESULTS:
+                if isinstance(result, list):
+                    return [Counting(r, meter) for r in result]
+                return Counting(result, meter)
+            meter.bytes_in += _size(result)
+            return result
+
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+# -----------------------------------------------------------------------------
+# Fragment-scoped reruns under AppTest
+# -----------------------------------------------------------------------------
+class FragmentRuns:
+    """
+    Patches AppTest so a click can rerun only the fragment holding the button
+    (as the browser does), and counts full and fragment script runs.
+    """
+
+    def __init__(self):
+        from streamlit.runtime.fragment import MemoryFragmentStorage
+        from streamlit.testing.v1 import app_test, local_script_runner
+
+        harness = self
+        self.runner = None
+        self.fragment = None  # fragment id to rerun instead of the script, for the next run
+        self.full_runs = self.fragment_runs = 0
+        storage = MemoryFragmentStorage()  # AppTest starts every run with an empty one
+
+        class Runner(local_script_runner.LocalScriptRunner):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self._fragment_storage = storage
+                harness.runner = self
+
+            def run(self, *args, **kwargs):
+                if harness.fragment:
+                    harness.fragment_runs += 1
+                else:
+                    harness.full_runs += 1
+                return super().run(*args, **kwargs)
+
+        rerun_data = local_script_runner.RerunData
+
+        def make_rerun_data(**kwargs):
+            if harness.fragment:
+                kwargs["fragment_id_queue"] = [harness.fragment]
+            return rerun_data(**kwargs)
+
+        app_test.LocalScriptRunner = Runner
+        local_script_runner.RerunData = make_rerun_data
+
+    def counts(self):
+        return self.full_runs, self.fragment_runs
+
+    def fragment_of(self, widget_id):
+        """Fragment id of the element with `widget_id` in the last run's output, or None."""
+        for msg in self.runner.forward_msgs() if self.runner else ():
+            if msg.HasField("delta") and msg.delta.HasField("new_element"):
+                element = msg.delta.new_element
+                if getattr(getattr(element, element.WhichOneof("type")), "id", None) == widget_id:
+                    return msg.delta.fragment_id or None
+        return None
+
+    def click(self, button):
+        """Click `button` and rerun what the browser would: its fragment, else the whole script."""
+        self.fragment = self.fragment_of(button.id)
+        try:
+            button.click().run()
+        finally:
+            self.fragment = None
+
+# -----------------------------------------------------------------------------
+# One benchmark configuration (runs in a child interpreter)
+# -----------------------------------------------------------------------------
+def _synthetic_schema(n_columns, n_choices=8):
+    cols = ["video_id", "timestamp_utc", "rater_id"] + [f"feature_{i}" for i in range(n_columns - 3)]
+    choices = {c: ([] if c in ("video_id", "timestamp_utc") else [f"{c}_v{j}" for j in range(n_choices)])
+               for c in cols}
+    return {"columns": cols, "choices": choices,
+            "option_index": {c: {v: i + 1 for i, v in enumerate(vs)} for c, vs in choices.items()},
+            "hash": f"synthetic-{n_columns}"}
+
+def _child(cfg, measure_mem):
+    import tracemalloc
+    from streamlit.testing.v1 import AppTest
+
+    import gsheets_client, prefetch
+    from local_sheet import LocalClient
+    from video_spool import VideoSpool
+
+    schema = _synthetic_schema(cfg["columns"])
+    meter = ApiMeter()
+    runs = FragmentRuns()
+
+    # Pre-populate the fake sheet, then hand the app a metered client
+    client = LocalClient()
+    ws = client.open_by_key(SPREADSHEET_ID).add_worksheet(WORKSHEET, rows=max(1000, cfg["rows"] + 1), cols=len(schema["columns"]))
+    ws._values = [list(schema["columns"])] + [
+        [f"old_{r}", "2024-01-01T00:00:00+00:00", "r1"] + [f"{c}_v{r % 8}" for c in schema["columns"][3:]]
+        for r in range(cfg["rows"])
+    ]
+    pc = gsheets_client._LocalPooledClient()
+    pc.client = Counting(client, meter)
+    gsheets_client._CLIENTS["local"] = pc
+
+    # No network: every prefetch "fails" immediately and the URL is passed through
+    def no_fetch(url, dest, offset):
+        raise OSError("prefetch disabled in benchmark")
+    prefetch._PREFETCHER = prefetch.Prefetcher(VideoSpool(tempfile.mkdtemp(), 1 << 20), fetcher=no_fetch)
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+    at.session_state["settings"] = {"SPREADSHEET_ID": SPREADSHEET_ID, "WORKSHEET_NAME": WORKSHEET, "UPSERT": True}
+    at.session_state["schema"] = schema
+    at.session_state["files"] = [{"name": f"URL {i+1}", "url": f"https://bench.invalid/clip_{i}.mp4"}
+                                 for i in range(cfg["playlist"])]
+    at.session_state["idx"] = 0
+
+    def button(label):
+        return next(b for b in at.get("button") if label in str(b.label))
+
+    def measure(name, action):
+        snap, runs_before = meter.snapshot(), runs.counts()
+        if measure_mem:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        action()
+        wall = (time.perf_counter() - t0) * 1000
+        peak = tracemalloc.get_traced_memory()[1] if measure_mem else 0
+        if measure_mem:
+            tracemalloc.stop()
+        errors = [e.value for e in at.exception]
+        full, fragment = (a - b for a, b in zip(runs.counts(), runs_before))
+        out[name] = {**meter.since(snap), "wall_ms": round(wall, 2), "peak_alloc_kb": round(peak / 1024, 1),
+                     "script_runs": full, "fragment_runs": fragment}
+        if errors:
+            out[name]["errors"] = errors
+
+    def flush():
+        import write_queue
+        for q in write_queue._QUEUES.values():
+            q.flush(timeout=30)
+
+    out = {}
+    measure("connect", at.run)
+    measure("render", at.run)
+    measure("count", lambda: button("Refresh count").click().run())
+    measure("submit", lambda: button("Submit").click().run())
+    measure("flush", flush)
+    measure("navigate_full", lambda: (button("Next (without saving)").click().run(), button("Previous").click().run()))
+    # Last: a fragment run leaves AppTest with only the fragment's elements
+    measure("navigate", lambda: (runs.click(button("Next (without saving)")), runs.click(button("Previous"))))
+
+    import resource
+    print(json.dumps({"config": cfg, "interactions": out,
+                      "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+# -----------------------------------------------------------------------------
+# Driver
+# -----------------------------------------------------------------------------
+def run_config(cfg, measure_mem):
+    env = dict(os.environ, SHEETS_BACKEND="local", LABELER_DATA_DIR=tempfile.mkdtemp(prefix="interaction_bench_"),
+               APPEND_MAX_DELAY="3600", SHEETS_WRITES_PER_MINUTE="100000",
+               PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", json.dumps(cfg)]
+    if not measure_mem:
+        cmd.append("--no-mem")
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"config {cfg} failed:\n{proc.stderr[-4000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def _key(result):
+    c = result["config"]
+    return (c["rows"], c["columns"], c["playlist"])
+
+def print_table(results, baseline=None):
+    base = {_key(r): r for r in (baseline or {}).get("results", [])}
+    print(f"{'rows':>7} {'cols':>4} {'clips':>6}  {'interaction':<13} {'runs':>5} {'calls':>5} {'KB in':>9} "
+          f"{'KB out':>8} {'ms':>8} {'peak KB':>8}")
+    for r in results:
+        c = r["config"]
+        for name, m in r["interactions"].items():
+            run_kinds = f"{m.get('script_runs', 0)}s{m.get('fragment_runs', 0)}f" if "script_runs" in m else "-"
+            line = (f"{c['rows']:>7} {c['columns']:>4} {c['playlist']:>6}  {name:<13} {run_kinds:>5} {m['api_calls_total']:>5} "
+                    f"{m['bytes_in'] / 1024:>9.1f} {m['bytes_out'] / 1024:>8.1f} {m['wall_ms']:>8.1f} {m['peak_alloc_kb']:>8.0f}")
+            old = base.get(_key(r), {}).get("interactions", {}).get(name)
+            if old:
+                line += (f"   Δcalls {m['api_calls_total'] - old['api_calls_total']:+d}"
+                         f"  Δms {m['wall_ms'] - old['wall_ms']:+.1f}")
+            print(line)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark Label-tab interactions against a fake sheet.")
+    ap.add_argument("--rows", type=int, nargs="+", default=[0, 1000, 10000], help="data rows already in the sheet")
+    ap.add_argument("--columns", type=int, nargs="+", default=[10, 40], help="schema width")
+    ap.add_argument("--playlist", type=int, nargs="+", default=[10, 1000], help="clips in the playlist")
+    ap.add_argument("--no-mem", action="store_true", help="skip tracemalloc (cleaner wall times)")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", help="earlier results JSON to diff against")
+    args = ap.parse_args(argv)
+
+    results = []
+    for rows, cols, clips in itertools.product(args.rows, args.columns, args.playlist):
+        cfg = {"rows": rows, "columns": max(cols, 4), "playlist": max(clips, 2)}
+        print(f"running {cfg} ...", file=sys.stderr)
+        results.append(run_config(cfg, not args.no_mem))
+
+    report = {"meta": {"python": sys.version.split()[0], "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "git": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                             capture_output=True, text=True).stdout.strip()},
+              "results": results}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        i = sys.argv.index("--child")
+        _child(json.loads(sys.argv[i + 1]), "--no-mem" not in sys.argv)
+    else:
+        sys.exit(main())
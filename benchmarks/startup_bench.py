@@ -0,0 +1,109 @@
+"""
+Cold-start benchmark for the Streamlit entry point.
+
+Runs app.py in a fresh interpreter under `python -X importtime`, driven by
+streamlit's AppTest (a scripted first run, then one rerun), and reports:
+  - wall time of the cold run (interpreter start to first page rendered) and of a rerun
+  - the slowest imports by cumulative time
+
+Exits with status 1 if the cold run exceeds the budget, so it can gate CI.
+
+    python benchmarks/startup_bench.py [--budget-ms 2500] [--rerun-budget-ms 300] [--fresh] [--top 15] [--json out.json]
+
+The budget defaults to STARTUP_BUDGET_MS (env) or 2500 ms. The child runs
+against the local sheet backend in a throwaway data dir, so no network is used.
+By default an unmeasured warm-up run fills the on-disk caches first (what a
+restart of a deployed app sees); --fresh measures a first-ever start instead.
+The AppTest harness (streamlit.testing, which also pulls in streamlit) is left
+out of the import report: under `streamlit run` those are loaded before app.py.
+"""
+import os, sys, json, time, argparse, tempfile, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HARNESS_MODULES = ("streamlit.testing",)
+
+def _child():
+    """Executed in the measured interpreter: one cold run and one rerun of app.py."""
+    from streamlit.testing.v1 import AppTest
+
+    t0 = time.perf_counter()
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+    at.run()
+    t1 = time.perf_counter()
+    at.run()
+    t2 = time.perf_counter()
+    errors = [e.value for e in at.exception]
+    print(json.dumps({"first_run_ms": (t1 - t0) * 1000, "rerun_ms": (t2 - t1) * 1000, "errors": errors}))
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from `-X importtime` output."""
+    out = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        out.append((name.strip(), int(self_us), int(cum_us), depth))
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "2500")))
+    ap.add_argument("--rerun-budget-ms", type=float, default=None)
+    ap.add_argument("--fresh", action="store_true", help="start from an empty data dir (no schema cache)")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--json", help="also write the report to this file")
+    args = ap.parse_args(argv)
+
+    env = dict(os.environ, SHEETS_BACKEND="local", LABELER_DATA_DIR=tempfile.mkdtemp(prefix="startup_bench_"),
+               PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    cmd = [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child"]
+    if not args.fresh:
+        subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True)
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+    total_ms = (time.perf_counter() - t0) * 1000
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        return 2
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    imports = [i for i in parse_importtime(proc.stderr) if not i[0].startswith(HARNESS_MODULES)]
+
+    top_level = sorted((i for i in imports if i[3] == 0), key=lambda i: -i[2])[: args.top]
+    report = {
+        "process_ms": round(total_ms, 1),
+        "first_run_ms": round(result["first_run_ms"], 1),
+        "rerun_ms": round(result["rerun_ms"], 1),
+        "import_ms_total": round(sum(i[2] for i in imports if i[3] == 0) / 1000, 1),
+        "top_imports_ms": {name: round(cum / 1000, 1) for name, _, cum, _ in top_level},
+        "budget_ms": args.budget_ms,
+        "errors": result["errors"],
+    }
+
+    print(f"process (interpreter + first run): {report['process_ms']:.0f} ms")
+    print(f"first run of app.py:               {report['first_run_ms']:.0f} ms")
+    print(f"rerun of app.py:                   {report['rerun_ms']:.0f} ms")
+    print(f"top-level imports (cumulative):    {report['import_ms_total']:.0f} ms")
+    for name, ms in report["top_imports_ms"].items():
+        print(f"  {ms:8.1f} ms  {name}")
+    if report["errors"]:
+        print("app raised:", *report["errors"], sep="\n  ")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = report["process_ms"] > args.budget_ms
+    if args.rerun_budget_ms is not None and report["rerun_ms"] > args.rerun_budget_ms:
+        failed = True
+    print(("FAIL" if failed else "OK") + f": budget {args.budget_ms:.0f} ms")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        _child()
+    else:
+        sys.exit(main())
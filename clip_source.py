@@ -0,0 +1,248 @@
+"""
+Server-side clip sources for archives too large to upload or paste.
+
+A manifest is a CSV (with a header row) or JSONL file, one clip per line:
+
+    video_id,path,camera,weather          {"video_id": "c1", "url": "https://...", "camera": "front"}
+    c1,clips/c1.mp4,front,rain
+
+`video_id` (or `id`) names the clip; `path` (relative to the manifest) or `url`
+locates it; every other field is metadata that can be filtered on. Folders,
+manifests and clip paths must be inside one of the CLIP_ROOT folders. A
+directory is walked in sorted order into a generated JSONL manifest under
+.labeler/manifests/, so both cases share one implementation.
+
+A ClipSource only keeps an array of byte offsets (8 bytes per clip) plus the
+page of parsed entries around the clip being looked at; entries are read
+back from the file on demand. It supports len(), indexing, slicing and
+iteration like the in-memory playlist, plus select()/where() to filter and
++ to concatenate views, and index_of() to find a clip by video_id. Order is
+the file order and never changes.
+"""
+import os, csv, json, hashlib, threading
+from array import array
+
+from app_paths import data_dir
+
+PAGE_SIZE = 200
+VIDEO_EXTENSIONS = (".mp4", ".m4v", ".mov", ".webm")
+# Folders the app may read clips and manifests from (os.pathsep-separated); none when unset
+CLIP_ROOTS = [os.path.realpath(os.path.expanduser(p.strip()))
+              for p in os.getenv("CLIP_ROOT", "").split(os.pathsep) if p.strip()]
+
+def under_clip_root(path):
+    """True when `path`, with symlinks resolved, is inside one of the CLIP_ROOT folders."""
+    real = os.path.realpath(path)
+    return any(os.path.commonpath([real, root]) == root for root in CLIP_ROOTS)
+
+def _check_root(location):
+    if not CLIP_ROOTS:
+        raise PermissionError("Server folders and manifests are disabled; set CLIP_ROOT to the folders to allow")
+    if not under_clip_root(location):
+        raise PermissionError(f"{location} is outside the CLIP_ROOT folders")
+
+class ClipSource:
+    def __init__(self, manifest, offsets=None, page_size=PAGE_SIZE):
+        self.manifest = os.path.abspath(manifest)
+        self.base_dir = os.path.dirname(self.manifest)
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._page = (None, [])  # (first index, entries)
+        self._by_id = {"lock": threading.Lock(), "offsets": None}  # shared with every view, see index_of()
+        with open(self.manifest, "rb") as f:
+            first = f.readline()
+            self._csv = not first.lstrip().startswith(b"{")
+            self._header = next(csv.reader([first.decode("utf-8-sig")])) if self._csv else None
+            if offsets is None:
+                offsets = array("Q", [] if self._csv else [0])
+                pos = len(first)
+                for line in f:
+                    if line.strip():
+                        offsets.append(pos)
+                    pos += len(line)
+        self._offsets = offsets
+
+    # --- views --------------------------------------------------------------
+    def _view(self, offsets):
+        view = ClipSource.__new__(ClipSource)
+        view.__dict__.update(self.__dict__)
+        view._lock = threading.Lock()
+        view._page = (None, [])
+        view._offsets = offsets
+        return view
+
+    def where(self, pred):
+        """New view with the entries for which pred(entry) is true, in the same order."""
+        return self._view(array("Q", (off for off, e in zip(self._offsets, self) if pred(e))))
+
+    def select(self, **filters):
+        """New view filtered on metadata: select(camera="front", weather=["rain", "snow"])."""
+        wanted = {k: {str(x) for x in v} if isinstance(v, (list, tuple, set)) else {str(v)}
+                  for k, v in filters.items()}
+        return self.where(lambda e: all(str(e["meta"].get(k, e.get(k, ""))) in vs for k, vs in wanted.items()))
+
+    def __add__(self, other):
+        if not isinstance(other, ClipSource) or other.manifest != self.manifest:
+            return NotImplemented
+        return self._view(self._offsets + other._offsets)
+
+    # --- access -------------------------------------------------------------
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        for start in range(0, len(self), self.page_size):
+            yield from self.page(start // self.page_size)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start = i - i % self.page_size
+        with self._lock:
+            first, entries = self._page
+            if first != start:
+                entries = self._read(start, min(start + self.page_size, len(self)))
+                self._page = (start, entries)
+        return entries[i - start]
+
+    def index_of(self, video_id):
+        """
+        Position of a clip in this view. The manifest's video_id -> byte offset
+        index is built on first use and shared by all views of the file.
+        Raises ValueError when the clip is not in the view.
+        """
+        offsets = self._by_id
+        with offsets["lock"]:
+            if offsets["offsets"] is None:
+                offsets["offsets"] = self._index_ids()
+        off = offsets["offsets"].get(video_id)
+        if off is None:
+            raise ValueError(f"{video_id!r} is not in this clip source")
+        return self._offsets.index(off)
+
+    def video_ids(self):
+        """The view's video_ids in order, read a page at a time."""
+        return (e["video_id"] for e in self)
+
+    def _index_ids(self):
+        ids = {}
+        with open(self.manifest, "rb") as f:
+            pos = len(f.readline()) if self._csv else 0
+            f.seek(pos)
+            for line in f:
+                if line.strip():
+                    ids.setdefault(self._parse(line.decode("utf-8"))["video_id"], pos)
+                pos += len(line)
+        return ids
+
+    def page(self, number, size=None):
+        """Entries of page `number` (0-based) of `size` clips."""
+        size = size or self.page_size
+        start = number * size
+        return self._read(start, min(start + size, len(self)))
+
+    def _read(self, start, stop):
+        out = []
+        with open(self.manifest, "rb") as f:
+            for off in self._offsets[start:stop]:
+                f.seek(off)
+                out.append(self._parse(f.readline().decode("utf-8")))
+        return out
+
+    def _parse(self, line):
+        if self._csv:
+            rec = dict(zip(self._header, next(csv.reader([line]))))
+        else:
+            rec = json.loads(line)
+        rec = {str(k).strip(): v for k, v in rec.items()}
+        video_id = str(rec.pop("video_id", "") or rec.pop("id", "")).strip()
+        entry = {}
+        url = str(rec.pop("url", "") or "").strip()
+        path = str(rec.pop("path", "") or "").strip()
+        if url:
+            entry["url"] = url
+        elif path:
+            entry["path"] = path if os.path.isabs(path) else os.path.join(self.base_dir, path)
+        locator = url or path
+        entry["video_id"] = video_id or os.path.splitext(os.path.basename(locator))[0]
+        entry["name"] = str(rec.pop("name", "") or os.path.basename(locator) or entry["video_id"])
+        entry["meta"] = {k: v for k, v in rec.items() if v not in (None, "")}
+        return entry
+
+# -----------------------------------------------------------------------------
+# Directories
+# -----------------------------------------------------------------------------
+def _walk_clips(root):
+    """Clip files under root in a stable order (directories and names sorted), lazily."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(VIDEO_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+def _manifest_path(root):
+    return str(data_dir("manifests") / f"{hashlib.sha256(os.path.abspath(root).encode()).hexdigest()[:16]}.jsonl")
+
+def directory_manifest(root):
+    """Write (or rewrite) the generated JSONL manifest for a directory and return its path."""
+    root = os.path.abspath(root)
+    _check_root(root)
+    out = _manifest_path(root)
+    tmp = f"{out}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for path in _walk_clips(root):
+            rel = os.path.relpath(path, root)
+            folder = os.path.dirname(rel)
+            f.write(json.dumps({"video_id": os.path.splitext(rel)[0].replace(os.sep, "/"), "path": path,
+                                "name": os.path.basename(path), "folder": folder.replace(os.sep, "/")}) + "\n")
+    os.replace(tmp, out)
+    return out
+
+# -----------------------------------------------------------------------------
+# Process-wide sources
+# -----------------------------------------------------------------------------
+_SOURCES = {}
+_SOURCES_LOCK = threading.Lock()
+
+def parse_filters(text):
+    """'camera=front, weather=rain|snow' -> {"camera": "front", "weather": ["rain", "snow"]}."""
+    filters = {}
+    for part in (text or "").split(","):
+        if "=" in part:
+            key, value = (s.strip() for s in part.split("=", 1))
+            filters[key] = value.split("|") if "|" in value else value
+    return filters
+
+def get_clip_source(location, filters=None, rescan=False):
+    """
+    Shared ClipSource for a manifest file or a directory, optionally filtered.
+    Manifests are re-indexed when the file changes; directories when rescan=True.
+    Raises PermissionError for locations outside CLIP_ROOT.
+    """
+    location = os.path.abspath(os.path.expanduser(location))
+    _check_root(location)
+    if os.path.isdir(location):
+        manifest = _manifest_path(location)
+        if rescan or not os.path.exists(manifest):
+            directory_manifest(location)
+    elif os.path.isfile(location):
+        manifest = location
+    else:
+        raise FileNotFoundError(f"No such manifest or directory: {location}")
+    st_ = os.stat(manifest)
+    key = (manifest, st_.st_mtime_ns, st_.st_size, json.dumps(filters or {}, sort_keys=True))
+    with _SOURCES_LOCK:
+        src = _SOURCES.get(key)
+    if src is None:
+        src = ClipSource(manifest)
+        if filters:
+            src = src.select(**filters)
+        with _SOURCES_LOCK:
+            for stale in [k for k in _SOURCES if k[0] == manifest and k[1:3] != key[1:3]]:
+                del _SOURCES[stale]  # the file changed since
+            src = _SOURCES.setdefault(key, src)
+    return src
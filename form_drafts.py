@@ -0,0 +1,74 @@
+"""
+Per-clip label drafts for the Label tab, one small integer array per clip.
+
+The form's widgets use fixed keys; when the rater moves to another clip the
+widget values are reloaded from here. Each clip costs one array('I') of
+len(columns) + 2 slots (every column, the video_id text box, the uncertain
+flag), however many clips are visited.
+
+Slot encoding, per column:
+    0                  blank
+    1 .. n             position in the compiled schema's [""] + choices
+    n+1 ..             a value outside the choices (free text, rater IDs),
+                       interned once in a table shared by all clips
+"""
+from array import array
+
+class FormDrafts:
+    def __init__(self, columns, choices, option_index=None):
+        self.columns = list(columns)
+        self._options = [[""] + list(choices.get(c, [])) for c in self.columns]
+        if option_index is None:
+            option_index = {c: {v: i for i, v in enumerate(opts) if i}
+                            for c, opts in zip(self.columns, self._options)}
+        self._index = [option_index.get(c, {}) for c in self.columns]
+        self._strings = []
+        self._string_ids = {}
+        self._drafts = {}
+
+    def __len__(self):
+        return len(self._drafts)
+
+    def __contains__(self, key):
+        return key in self._drafts
+
+    def _intern(self, value):
+        sid = self._string_ids.get(value)
+        if sid is None:
+            sid = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return sid
+
+    def _encode(self, i, value):
+        if not value:
+            return 0
+        if i is not None:
+            code = self._index[i].get(value)
+            if code is not None:
+                return code
+        n = len(self._options[i]) if i is not None else 1
+        return n + self._intern(value)
+
+    def _decode(self, i, code):
+        if not code:
+            return ""
+        n = len(self._options[i]) if i is not None else 1
+        return self._options[i][code] if code < n else self._strings[code - n]
+
+    def save(self, key, values, video_id="", uncertain=False):
+        """Store the form values (column -> string) entered for clip `key`."""
+        rec = array("I", (self._encode(i, values.get(c, "")) for i, c in enumerate(self.columns)))
+        rec.append(self._encode(None, video_id))
+        rec.append(1 if uncertain else 0)
+        self._drafts[key] = rec
+
+    def load(self, key):
+        """(values, video_id, uncertain) for clip `key`, or None if nothing was saved for it."""
+        rec = self._drafts.get(key)
+        if rec is None:
+            return None
+        values = {c: self._decode(i, rec[i]) for i, c in enumerate(self.columns)}
+        return values, self._decode(None, rec[-2]), bool(rec[-1])
+
+    def drop(self, key):
+        self._drafts.pop(key, None)
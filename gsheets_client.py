@@ -1,7 +1,15 @@
-import os
-import gspread
-from google.oauth2.service_account import Credentials
-from dotenv import load_dotenv
+import os, json, time, hashlib, logging, threading
+from datetime import datetime, timedelta, timezone
+
+import local_sheet
+import tracing
+from app_paths import data_dir
+from sheet_partitions import open_partitioned
+from header_reconcile import forget as forget_headers, headers_hash, reconcile_headers
+from write_queue import appended_rows
+
+# gspread and google-auth are imported inside the functions that need them:
+# they cost noticeable startup time and the local backend never uses them.
 
 # Try to import streamlit to access secrets when running on Streamlit Cloud
 try:
@@ -10,19 +18,38 @@ try:
 except Exception:
     HAS_ST = False
 
-# Load .env for local runs
-load_dotenv()
-
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
-def _make_creds():
+# Refresh the OAuth token this long before it expires, so a rerun never
+# has to wait on a token round trip in the middle of a user action.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# "google" (default) or "local" for the in-process stand-in in local_sheet.py
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "google").strip().lower()
+
+# Seconds between re-syncs of the saved-row count with the sheet.
+ROW_COUNT_TTL = float(os.getenv("ROW_COUNT_TTL", "300"))
+
+log = logging.getLogger("labeler.sheets")
+
+def _has_secret(key):
     """
-    Prefer Streamlit secrets (Cloud). Fallback to local JSON via .env (GOOGLE_APPLICATION_CREDENTIALS).
+    True if Streamlit secrets define `key`. Checks for a secrets.toml first:
+    `key in st.secrets` raises (and prints an error into the page) without one.
+    """
+    try:
+        return HAS_ST and st.secrets.load_if_toml_exists() and key in st.secrets
+    except Exception:
+        return False
+
+def _creds_source():
+    """
+    Return ("info", dict) for Streamlit secrets or ("file", path) for a local JSON key.
     """
     # 1) Streamlit Cloud: service account in secrets
-    if HAS_ST and "gcp_service_account" in st.secrets:
-        sa_info = dict(st.secrets["gcp_service_account"])  # TOML -> dict
-        return Credentials.from_service_account_info(sa_info, scopes=SCOPES)
+    for section in ("gcp_service_account", "service_account"):
+        if _has_secret(section):
+            return "info", dict(st.secrets[section])  # TOML -> dict
 
     # 2) Local: service_account.json path from .env (or default name)
     creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "service_account.json")
@@ -31,9 +58,32 @@ def _make_creds():
             "Service account not found. On Streamlit Cloud, set [gcp_service_account] in Secrets. "
             "Locally, put service_account.json next to app.py and set GOOGLE_APPLICATION_CREDENTIALS in .env."
         )
-    return Credentials.from_service_account_file(creds_path, scopes=SCOPES)
+    return "file", creds_path
+
+def _creds_fingerprint(kind, source):
+    """Stable key for a credentials source (changes if the key file is replaced)."""
+    if kind == "info":
+        payload = json.dumps(source, sort_keys=True)
+    else:
+        st_ = os.stat(source)
+        payload = f"{os.path.abspath(source)}:{st_.st_mtime_ns}:{st_.st_size}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _make_creds(kind=None, source=None):
+    """
+    Prefer Streamlit secrets (Cloud). Fallback to local JSON via .env (GOOGLE_APPLICATION_CREDENTIALS).
+    """
+    from google.oauth2.service_account import Credentials
+
+    if kind is None:
+        kind, source = _creds_source()
+    if kind == "info":
+        return Credentials.from_service_account_info(source, scopes=SCOPES)
+    return Credentials.from_service_account_file(source, scopes=SCOPES)
 
 def get_client():
+    import gspread
+
     creds = _make_creds()
     return gspread.authorize(creds)
 
@@ -66,55 +116,208 @@ def ensure_capacity(ws, min_rows=1000, min_cols=26):
         # Some accounts/sheets may deny resize; ignore silently
         pass
 
-def migrate_headers_if_needed(ws):
-    """
-    One-time migration:
-    - Remove 'Video_Name' column entirely
-    - Rename 'Video ID' -> 'video_id'
-    """
-    headers = ws.row_values(1)
-    updated = False
-    if "Video_Name" in headers:
-        idx = headers.index("Video_Name") + 1
-        ws.delete_columns(idx)
-        headers.pop(idx - 1)
-        updated = True
-    if "Video ID" in headers:
-        col_idx = headers.index("Video ID") + 1
-        ws.update_cell(1, col_idx, "video_id")
-        headers[col_idx - 1] = "video_id"
-        updated = True
-    return updated, headers
+# -----------------------------------------------------------------------------
+# Process-wide connection pool
+# -----------------------------------------------------------------------------
+# Streamlit re-executes app.py on every interaction, but imported modules stay
+# in sys.modules, so anything kept here is shared by every rerun and session in
+# the process. Clients are pooled per credentials, worksheets per
+# (credentials, spreadsheet ID, worksheet name).
+
+class _PooledClient:
+    def __init__(self, creds):
+        import gspread
+
+        self.creds = creds
+        self.client = gspread.authorize(creds)
+        self.lock = threading.Lock()
+
+    def keep_warm(self):
+        """Refresh the token ahead of expiry instead of on the next failing request."""
+        with self.lock:
+            expiry = self.creds.expiry
+            if expiry is not None and expiry.tzinfo is None:
+                expiry = expiry.replace(tzinfo=timezone.utc)  # google-auth stores naive UTC
+            if self.creds.token and expiry and expiry - datetime.now(timezone.utc) > TOKEN_REFRESH_MARGIN:
+                return
+            from google.auth.transport.requests import Request
+            try:
+                self.creds.refresh(Request())
+            except Exception as e:  # offline: the next request refreshes (or fails) on its own
+                log.warning("Proactive token refresh failed: %s", e)
+
+class _PooledWorksheet:
+    def __init__(self, ws):
+        self.ws = ws
+        self.lock = threading.Lock()
+        self.header_hash = None
+
+_POOL_LOCK = threading.Lock()
+_CLIENTS = {}      # creds fingerprint -> _PooledClient
+_WORKSHEETS = {}   # (creds fingerprint, spreadsheet_id, worksheet_name) -> _PooledWorksheet
+
+class _LocalPooledClient:
+    def __init__(self):
+        self.client = local_sheet.LocalClient(str(data_dir("local_sheets")))
+
+    def keep_warm(self):
+        pass
+
+def _pooled_client():
+    if SHEETS_BACKEND == "local":
+        with _POOL_LOCK:
+            pc = _CLIENTS.get("local")
+            if pc is None:
+                pc = _CLIENTS["local"] = _LocalPooledClient()
+        return "local", pc
+    kind, source = _creds_source()
+    fp = _creds_fingerprint(kind, source)
+    with _POOL_LOCK:
+        pc = _CLIENTS.get(fp)
+        if pc is None:
+            pc = _CLIENTS[fp] = _PooledClient(_make_creds(kind, source))
+    pc.keep_warm()
+    return fp, pc
+
+def _open_worksheet(client, spreadsheet_id, worksheet_name, n_cols):
+    """The label table: the named worksheet (created if missing) plus its rollover partitions."""
+    return open_partitioned(client.open_by_key(spreadsheet_id), worksheet_name, n_cols)
+
+def _ensure_headers(ws, headers):
+    # Capacity first (later partitions are created at full size and sealed ones trimmed)
+    if len(ws.partitions) == 1:
+        ensure_capacity(ws.base, min_rows=1000, min_cols=max(26, len(headers)))
+
+    # Then move/insert columns so every partition's header row matches the
+    # schema with its data still aligned (one read + one batchUpdate, once per schema)
+    reconcile_headers(ws.spreadsheet, ws.partitions, headers)
+    ws.headers = list(headers)
 
 def get_worksheet_and_ensure_headers(headers):
     """
     Open the target worksheet (create if missing), ensure capacity and exact header row.
+    Returns a sheet_partitions.PartitionedWorksheet: the worksheet and any
+    rollover partitions, addressed as one table.
+
+    Connections are pooled for the whole process and the header check is
+    memoized by schema hash (in memory here, on disk in header_reconcile), so a
+    steady-state call makes no API requests.
     """
     spreadsheet_id, worksheet_name = _get_sheet_ids()
-    gc = get_client()
-    sh = gc.open_by_key(spreadsheet_id)
+    fp, pc = _pooled_client()
+    key = (fp, spreadsheet_id, worksheet_name)
 
-    try:
-        ws = sh.worksheet(worksheet_name)
-    except gspread.exceptions.WorksheetNotFound:
-        ws = sh.add_worksheet(title=worksheet_name, rows=max(1000, 2), cols=max(26, len(headers)))
+    with _POOL_LOCK:
+        pw = _WORKSHEETS.get(key)
+    if pw is None:
+        ws = _open_worksheet(tracing.traced(pc.client), spreadsheet_id, worksheet_name, len(headers))
+        with _POOL_LOCK:
+            pw = _WORKSHEETS.setdefault(key, _PooledWorksheet(ws))
 
-    # Capacity first
-    ensure_capacity(ws, min_rows=1000, min_cols=max(26, len(headers)))
+    h = headers_hash(headers)
+    if pw.header_hash != h:
+        with pw.lock:
+            if pw.header_hash != h:
+                _ensure_headers(pw.ws, headers)
+                pw.header_hash = h
+    return pw.ws
 
-    # Migrate old headers if needed, then ensure current headers
-    try:
-        migrate_headers_if_needed(ws)
-    except Exception:
-        # If we can't migrate (permissions), continue with normal header ensure
-        pass
+def invalidate_pool(spreadsheet_id=None, worksheet_name=None):
+    """
+    Drop pooled worksheets (all, or those matching the given IDs) so the next
+    call reconnects and re-checks headers. Use after an API error.
+    """
+    with _POOL_LOCK:
+        for key in list(_WORKSHEETS):
+            _, sid, wname = key
+            if spreadsheet_id not in (None, sid):
+                continue
+            if worksheet_name not in (None, wname):
+                continue
+            pw = _WORKSHEETS.pop(key)
+            _COUNTERS.pop((pw.ws.spreadsheet_id, pw.ws.id), None)
+            forget_headers(pw.ws.partitions)
+        if spreadsheet_id is None and worksheet_name is None:
+            _CLIENTS.clear()
+
+# -----------------------------------------------------------------------------
+# Saved-row counter
+# -----------------------------------------------------------------------------
+class RowCounter:
+    """
+    Number of data rows (excluding the header) in a worksheet.
+
+    Seeded from a single-column fetch, then advanced locally after each append.
+    It only goes back to the sheet when the TTL expires or refresh() is called,
+    so reading it costs nothing no matter how large the sheet grows.
+    """
+
+    def __init__(self, ws, ttl=ROW_COUNT_TTL):
+        self.ws = ws
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._count = None
+        self._synced_at = 0.0
+
+    def refresh(self):
+        """Re-sync with the sheet (one column of values)."""
+        if hasattr(self.ws, "data_rows"):
+            count = self.ws.data_rows()  # partitioned: sealed partitions are counted from the manifest
+        else:
+            count = max(len(self.ws.col_values(1)) - 1, 0)
+        with self.lock:
+            self._count = count
+            self._synced_at = time.monotonic()
+        return count
+
+    def seed(self, count):
+        """Adopt a count obtained elsewhere (e.g. by the label index's column fetch)."""
+        with self.lock:
+            if self._count is None:
+                self._count = count
+                self._synced_at = time.monotonic()
+
+    def value(self):
+        """
+        The count, re-synced once the TTL expired. When the sheet can't be
+        reached it returns the last known count (None if there is none) and
+        tries again after another TTL, so an offline rerun still renders.
+        """
+        with self.lock:
+            fresh = self._count is not None and time.monotonic() - self._synced_at < self.ttl
+            if fresh:
+                return self._count
+        try:
+            return self.refresh()
+        except Exception as e:
+            log.warning("Row count refresh failed, keeping the last count: %s", e)
+            with self.lock:
+                self._synced_at = time.monotonic()
+                return self._count
+
+    def note_append(self, n_rows, response=None):
+        """Account for rows we just appended, trusting the API's updatedRange when present."""
+        span = appended_rows(response)
+        last_row = span[1] if span else None
+        with self.lock:
+            if self._count is None:
+                return
+            if last_row is not None:
+                self._count = max(self._count, last_row - 1)
+            else:
+                self._count += n_rows
 
-    current_headers = ws.row_values(1)
-    if current_headers != headers:
-        ws.update(range_name="A1", values=[headers])
+_COUNTERS = {}  # (spreadsheet_id, worksheet id) -> RowCounter
 
-    return ws
+def get_row_counter(ws):
+    """Process-wide RowCounter for a worksheet, shared by every session."""
+    key = (ws.spreadsheet_id, ws.id)
+    with _POOL_LOCK:
+        rc = _COUNTERS.get(key)
+        if rc is None or rc.ws is not ws:
+            rc = _COUNTERS[key] = RowCounter(ws)
+    return rc
 
 def append_row_safe(ws, row):
     """Append a row with user-entered formatting."""
-    ws.append_row(row, value_input_option="USER_ENTERED")
\ No newline at end of file
+    return ws.append_row(row, value_input_option="USER_ENTERED")
@@ -0,0 +1,194 @@
+"""
+Header reconciliation: bring a worksheet's header row in line with the schema
+without shifting headers over existing data.
+
+plan_headers() compares the header row in the sheet with the schema columns
+and works out the fewest column operations that make them match:
+
+    rename   a legacy header of a schema column ("Video ID" -> "video_id")
+    delete   a legacy column the app dropped (Video_Name)
+    move     existing columns into schema order; only the columns outside the
+             longest run already in order are moved
+    insert   an empty column for each new schema column (at the end of the
+             row when nothing follows it, so the grid only grows)
+
+Columns the schema no longer has are never deleted: they keep their data and
+header and end up after the schema columns. Because whole columns move, every
+row stays aligned with its header.
+
+reconcile_headers() reads row 1 of every worksheet with one request and sends
+the plans of all of them as one spreadsheet batchUpdate, which Sheets applies
+atomically. Worksheets already reconciled to a schema are remembered in
+.labeler/schema_cache/reconciled_headers.json, so the check runs once per
+schema change, not once per connect or process start.
+"""
+import os, json, hashlib, threading
+
+from app_paths import data_dir
+
+RENAMES = {"Video ID": "video_id"}   # legacy header -> schema column
+DROPPED = {"Video_Name"}             # legacy columns removed from the sheet
+
+_CACHE_LOCK = threading.Lock()
+
+def headers_hash(headers):
+    return hashlib.sha256(json.dumps(list(headers)).encode()).hexdigest()[:16]
+
+def _longest_increasing(values):
+    """Indices of one longest strictly increasing subsequence of `values`."""
+    tails, tail_idx, prev = [], [], [None] * len(values)
+    for i, v in enumerate(values):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tails[mid] < v:
+                lo = mid + 1
+            else:
+                hi = mid
+        prev[i] = tail_idx[lo - 1] if lo else None
+        if lo == len(tails):
+            tails.append(v)
+            tail_idx.append(i)
+        else:
+            tails[lo], tail_idx[lo] = v, i
+    out, i = [], tail_idx[-1] if tail_idx else None
+    while i is not None:
+        out.append(i)
+        i = prev[i]
+    return out[::-1]
+
+def plan_headers(current, target):
+    """
+    Steps from header row `current` to the schema columns `target`, in the
+    order they must be applied (0-based column indices as of that step):
+    ("rename", i, old, new), ("delete", i), ("move", i, dest), ("insert", i, name).
+    Returns (steps, final header row); the final row is target plus any
+    columns the schema no longer has.
+    """
+    target = [str(c) for c in target]
+    current = [str(h) for h in current]
+    steps, names = [], list(current)
+    for i, h in enumerate(current):
+        new = RENAMES.get(h)
+        if new in target and new not in names:
+            steps.append(("rename", i, h, new))
+            names[i] = new
+
+    # Tokens: existing columns by their original index, new ones as ("new", name)
+    for i in reversed(range(len(names))):
+        if names[i] in DROPPED and names[i] not in target:
+            steps.append(("delete", i))
+    state = [i for i, h in enumerate(names) if not (h in DROPPED and h not in target)]
+    owner = {}
+    for i in state:
+        owner.setdefault(names[i], i)
+    extras = [i for i in state if names[i] not in target or owner[names[i]] != i]
+    final = [owner[c] if c in owner else ("new", c) for c in target] + extras
+
+    # Moves: keep the longest run already in order, put every other column right after its predecessor
+    order = [t for t in final if not isinstance(t, tuple)]
+    rank = {t: k for k, t in enumerate(order)}
+    ranks = [rank[t] for t in state]
+    in_order = {ranks[i] for i in _longest_increasing(ranks)}
+    for r in range(len(order)):
+        if r in in_order:
+            continue
+        t, s = order[r], state.index(order[r])
+        dest = 0 if r == 0 else state.index(order[r - 1]) + 1
+        if dest in (s, s + 1):
+            continue
+        steps.append(("move", s, dest))
+        state.pop(s)
+        state.insert(dest - 1 if dest > s else dest, t)
+
+    # Inserts, left to right; past the last existing column there is nothing to shift
+    for k, t in enumerate(final):
+        if isinstance(t, tuple):
+            if k < len(state):
+                steps.append(("insert", k, t[1]))
+            state.insert(k, t)
+    return steps, target + [names[i] for i in extras]
+
+def header_requests(sheet_id, steps, headers, col_count):
+    """batchUpdate requests for one worksheet's plan, ending with the header row write."""
+    def dim(start, end):
+        return {"sheetId": sheet_id, "dimension": "COLUMNS", "startIndex": start, "endIndex": end}
+
+    requests, width = [], col_count
+    for step in steps:
+        if step[0] == "delete":
+            requests.append({"deleteDimension": {"range": dim(step[1], step[1] + 1)}})
+            width -= 1
+        elif step[0] == "move":
+            requests.append({"moveDimension": {"source": dim(step[1], step[1] + 1), "destinationIndex": step[2]}})
+        elif step[0] == "insert":
+            requests.append({"insertDimension": {"range": dim(step[1], step[1] + 1), "inheritFromBefore": False}})
+            width += 1
+    if len(headers) > width:
+        requests.append({"appendDimension": {"sheetId": sheet_id, "dimension": "COLUMNS",
+                                             "length": len(headers) - width}})
+    requests.append({"updateCells": {
+        "range": {"sheetId": sheet_id, "startRowIndex": 0, "endRowIndex": 1,
+                  "startColumnIndex": 0, "endColumnIndex": len(headers)},
+        "rows": [{"values": [{"userEnteredValue": {"stringValue": h}} for h in headers]}],
+        "fields": "userEnteredValue",
+    }})
+    return requests
+
+# -----------------------------------------------------------------------------
+# Reconciled-schema cache (<data dir>/schema_cache/reconciled_headers.json)
+# -----------------------------------------------------------------------------
+def _cache_path():
+    return data_dir("schema_cache") / "reconciled_headers.json"
+
+def _load_cache():
+    try:
+        return json.loads(_cache_path().read_text())
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(cache):
+    path = _cache_path()
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(cache))
+    tmp.replace(path)
+
+def _key(ws):
+    return f"{ws.spreadsheet_id}:{ws.id}"
+
+def forget(worksheets=None):
+    """Drop the reconciled marks (of the given worksheets, or all) so the next connect checks again."""
+    with _CACHE_LOCK:
+        cache = _load_cache()
+        for key in ([_key(ws) for ws in worksheets] if worksheets is not None else list(cache)):
+            cache.pop(key, None)
+        _save_cache(cache)
+
+def reconcile_headers(spreadsheet, worksheets, headers):
+    """
+    Make the header row of every worksheet match `headers` (one read, at most
+    one batchUpdate). Returns {worksheet title: steps} for the worksheets that
+    were checked; empty when all of them were already reconciled.
+    """
+    h = headers_hash(headers)
+    with _CACHE_LOCK:
+        cache = _load_cache()
+    todo = [ws for ws in worksheets if cache.get(_key(ws)) != h]
+    if not todo:
+        return {}
+    ranges = ["'{}'!1:1".format(ws.title.replace("'", "''")) for ws in todo]
+    got = spreadsheet.values_batch_get(ranges).get("valueRanges", [])
+    requests, plans = [], {}
+    for ws, vr in zip(todo, got):
+        current = (vr.get("values") or [[]])[0]
+        steps, final = plan_headers(current, headers)
+        plans[ws.title] = steps
+        if steps or [str(v) for v in current] != final:
+            requests += header_requests(ws.id, steps, final, ws.col_count)
+    if requests:
+        spreadsheet.batch_update({"requests": requests})
+    with _CACHE_LOCK:
+        cache = _load_cache()
+        cache.update({_key(ws): h for ws in todo})
+        _save_cache(cache)
+    return plans
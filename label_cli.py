@@ -0,0 +1,319 @@
+"""
+Headless bulk import / export of labels.
+
+    python label_cli.py import labels.csv            # or .xlsx
+    python label_cli.py export labels_backup.csv     # or .xlsx
+
+Import streams the file, validates each row against the compiled schema
+(known columns, dropdown values from Features.xlsx / the example workbook,
+non-empty video_id), and writes valid rows with large append_rows calls,
+throttled by a token bucket sized to the Sheets write quota. Transient errors
+are retried like the app's write queue; a chunk whose append failed that way
+is only sent again if the sheet's row count shows it didn't land (so nobody
+else should append to the sheet during an import). Rejected rows go to
+<input>.rejects.csv with the reason. Progress is checkpointed after every
+chunk, so re-running the same command resumes where it stopped.
+
+Export streams every data row of the worksheet in row ranges to CSV/XLSX
+without ever holding the whole sheet in memory; blank rows are skipped.
+
+The target sheet comes from --spreadsheet-id/--worksheet or the usual
+SPREADSHEET_ID / WORKSHEET_NAME settings (.env); SHEETS_BACKEND=local works too.
+"""
+import os, sys, csv, json, time, argparse
+
+from app_paths import load_env
+from excel_writer import build_row
+from local_sheet import col_to_letters
+from schema_loader import load_compiled_schema
+from write_queue import TokenBucket, WRITES_PER_MINUTE, is_transient, retry_delay
+
+READS_PER_MINUTE = float(os.getenv("SHEETS_READS_PER_MINUTE", "50"))
+MAX_ATTEMPTS = 8
+
+# -----------------------------------------------------------------------------
+# Streaming readers / writers
+# -----------------------------------------------------------------------------
+def _normalize_header(h):
+    h = "" if h is None else str(h).strip()
+    return "video_id" if h == "Video ID" else h
+
+def iter_label_rows(path):
+    """Yield dicts (header -> string value) from a CSV or XLSX file, one row at a time."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            headers = [_normalize_header(h) for h in next(rows, ())]
+            for values in rows:
+                yield {h: "" if v is None else str(v).strip() for h, v in zip(headers, values) if h}
+        finally:
+            wb.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            headers = [_normalize_header(h) for h in next(reader, [])]
+            for values in reader:
+                yield {h: (v or "").strip() for h, v in zip(headers, values) if h}
+
+class _TableWriter:
+    """Write rows to .csv or .xlsx (openpyxl write-only mode), streaming."""
+
+    def __init__(self, path):
+        self.path = path
+        self.xlsx = path.lower().endswith(".xlsx")
+        if self.xlsx:
+            from openpyxl import Workbook
+
+            self.wb = Workbook(write_only=True)
+            self.ws = self.wb.create_sheet("labels")
+        else:
+            self.f = open(path, "w", newline="", encoding="utf-8")
+            self.w = csv.writer(self.f)
+
+    def write(self, row):
+        if self.xlsx:
+            self.ws.append(row)
+        else:
+            self.w.writerow(row)
+
+    def close(self):
+        if self.xlsx:
+            self.wb.save(self.path)
+        else:
+            self.f.close()
+
+# -----------------------------------------------------------------------------
+# Validation
+# -----------------------------------------------------------------------------
+def validate(schema, values):
+    """Return a list of problems with one input row (empty if it is valid)."""
+    problems = []
+    if not values.get("video_id"):
+        problems.append("missing video_id")
+    for col, v in values.items():
+        if col not in schema["option_index"]:
+            continue
+        if v and schema["choices"][col] and v not in schema["option_index"][col]:
+            problems.append(f"{col}={v!r} is not an allowed value")
+    return problems
+
+# -----------------------------------------------------------------------------
+# Checkpoint
+# -----------------------------------------------------------------------------
+def _input_signature(path):
+    st_ = os.stat(path)
+    return {"input": os.path.abspath(path), "size": st_.st_size, "mtime": st_.st_mtime}
+
+def load_checkpoint(path, signature):
+    try:
+        with open(path) as f:
+            cp = json.load(f)
+    except (OSError, ValueError):
+        return {"rows_done": 0, "rows_written": 0, "rows_rejected": 0}
+    if any(cp.get(k) != v for k, v in signature.items()):
+        raise SystemExit(f"Checkpoint {path} belongs to a different or modified input; delete it to start over.")
+    return cp
+
+def save_checkpoint(path, signature, progress):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({**signature, **progress}, f)
+    os.replace(tmp, path)
+
+# -----------------------------------------------------------------------------
+# Sheet access
+# -----------------------------------------------------------------------------
+def _call(bucket, fn, *args, **kwargs):
+    """One rate-limited API call, retried with backoff on transient errors (anything else is raised at once)."""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        bucket.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS or not is_transient(e):
+                raise
+            delay = retry_delay(e, attempt, bucket)
+            print(f"  {type(e).__name__}: {e} -- retrying in {delay:.1f}s", file=sys.stderr)
+            time.sleep(delay)
+
+def _landed(bucket, ws, append):
+    """True if the sheet has grown by the rows of a recorded append ({"sheet_rows", "rows"})."""
+    return _call(bucket, ws.data_rows) >= append["sheet_rows"] + append["rows"]
+
+def _append_once(bucket, ws, chunk, append):
+    """
+    append_rows is not idempotent: a call that timed out or got a 5xx may still
+    have been committed. Before each retry the sheet's data row count is
+    compared with the one recorded before the chunk (`append`), and the chunk
+    is only sent again if it didn't land.
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        bucket.acquire()
+        try:
+            return ws.append_rows(chunk, value_input_option="USER_ENTERED")
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS or not is_transient(e):
+                raise
+            delay = retry_delay(e, attempt, bucket)
+            print(f"  {type(e).__name__}: {e} -- checking the sheet, retrying in {delay:.1f}s", file=sys.stderr)
+            time.sleep(delay)
+            if _landed(bucket, ws, append):
+                print("  The chunk reached the sheet after all; not sending it again.", file=sys.stderr)
+                return None
+
+def _connect(args, columns):
+    if args.spreadsheet_id:
+        os.environ["SPREADSHEET_ID"] = args.spreadsheet_id
+    if args.worksheet:
+        os.environ["WORKSHEET_NAME"] = args.worksheet
+    from gsheets_client import get_worksheet_and_ensure_headers
+
+    return get_worksheet_and_ensure_headers(columns)
+
+# -----------------------------------------------------------------------------
+# Commands
+# -----------------------------------------------------------------------------
+def cmd_import(args):
+    schema = load_compiled_schema(args.features, args.example)
+    columns = schema["columns"]
+    ws = _connect(args, columns)
+    bucket = TokenBucket(args.writes_per_minute)
+
+    signature = _input_signature(args.input)
+    checkpoint = args.checkpoint or args.input + ".checkpoint.json"
+    progress = load_checkpoint(checkpoint, signature)
+    append = progress.pop("append", None)
+    if append:  # interrupted while a chunk was being sent
+        if _landed(bucket, ws, append):
+            print("The last chunk reached the sheet before the interruption.")
+            progress.update(append["then"])
+        save_checkpoint(checkpoint, signature, progress)
+    skip = progress["rows_done"]
+    if skip:
+        print(f"Resuming after {skip} input rows ({progress['rows_written']} already written).")
+
+    existing = None
+    if args.skip_existing:
+        from label_index import get_label_index
+
+        existing = get_label_index(ws, columns)
+
+    rejects_path = args.input + ".rejects.csv"
+    rejects = open(rejects_path, "a" if skip else "w", newline="", encoding="utf-8")
+    rejects_w = csv.writer(rejects)
+    if not skip:
+        rejects_w.writerow(["input_row", "reason"] + columns)
+
+    chunk, chunk_rows = [], 0
+    started, written_before = time.monotonic(), progress["rows_written"]
+    saved = dict(progress)  # as last written to the checkpoint
+
+    def flush():
+        nonlocal chunk, chunk_rows, saved
+        if not chunk_rows:
+            return
+        rejects.flush()
+        then = {**progress, "rows_done": progress["rows_done"] + chunk_rows,
+                "rows_written": progress["rows_written"] + len(chunk)}
+        if chunk:
+            # Record the row count before sending, so a retry or a resumed run can tell whether the chunk landed
+            append = {"sheet_rows": _call(bucket, ws.data_rows), "rows": len(chunk), "then": then}
+            save_checkpoint(checkpoint, signature, {**saved, "append": append})
+            _append_once(bucket, ws, chunk, append)
+        progress.update(then)
+        save_checkpoint(checkpoint, signature, progress)
+        saved = dict(progress)
+        rate = (progress["rows_written"] - written_before) / max(time.monotonic() - started, 1e-6)
+        print(f"  {progress['rows_done']} rows read, {progress['rows_written']} written, "
+              f"{progress['rows_rejected']} rejected ({rate:.0f} rows/s)")
+        chunk, chunk_rows = [], 0
+
+    try:
+        for n, values in enumerate(iter_label_rows(args.input), start=1):
+            if n <= skip:
+                continue
+            chunk_rows += 1
+            problems = validate(schema, values)
+            if not problems and existing is not None and values["video_id"] in existing:
+                problems = ["video_id already in the sheet"]
+            if problems:
+                progress["rows_rejected"] += 1
+                rejects_w.writerow([n + 1, "; ".join(problems)] + [values.get(c, "") for c in columns])
+            else:
+                row = build_row(columns, values)
+                if "timestamp_utc" in columns and values.get("timestamp_utc"):
+                    row[columns.index("timestamp_utc")] = values["timestamp_utc"]
+                chunk.append(row)
+                if existing is not None:
+                    existing.add(values["video_id"])
+            if chunk_rows >= args.chunk_size:
+                flush()
+        flush()
+    finally:
+        rejects.close()
+
+    print(f"Done: {progress['rows_written']} rows written, {progress['rows_rejected']} rejected"
+          + (f" (see {rejects_path})" if progress["rows_rejected"] else "") + ".")
+    os.remove(checkpoint)
+    return 0
+
+def cmd_export(args):
+    schema = load_compiled_schema(args.features, args.example)
+    ws = _connect(args, schema["columns"])
+    bucket = TokenBucket(args.reads_per_minute)
+
+    headers = _call(bucket, ws.row_values, 1)
+    last_col = col_to_letters(max(len(headers), 1))
+    # Page over every data row: blocks of blank rows (cleared by hand, or by a
+    # partition rehome) come back short or empty but don't end the table
+    last_row = _call(bucket, ws.data_rows) + 1
+    out = _TableWriter(args.output)
+    written = 0
+    try:
+        out.write(headers)
+        for start in range(2, last_row + 1, args.chunk_size):
+            end = min(start + args.chunk_size - 1, last_row)
+            block = _call(bucket, ws.get, f"A{start}:{last_col}{end}")
+            for row in block:
+                if not any(row):
+                    continue
+                out.write(list(row) + [""] * (len(headers) - len(row)))
+                written += 1
+            print(f"  {written} rows exported")
+    finally:
+        out.close()
+    blank = last_row - 1 - written
+    print(f"Done: {written} rows -> {args.output}" + (f" ({blank} blank rows skipped)" if blank > 0 else ""))
+    return 0
+
+def main(argv=None):
+    load_env()
+    ap = argparse.ArgumentParser(description="Bulk import/export labels to/from the Google Sheet.")
+    ap.add_argument("--spreadsheet-id", help="defaults to SPREADSHEET_ID")
+    ap.add_argument("--worksheet", help="defaults to WORKSHEET_NAME")
+    ap.add_argument("--features", default="Features.xlsx")
+    ap.add_argument("--example", default="Example_of_Video_Labelling.xlsx")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import", help="append labels from a CSV/XLSX file")
+    imp.add_argument("input")
+    imp.add_argument("--chunk-size", type=int, default=2000, help="rows per append_rows call")
+    imp.add_argument("--writes-per-minute", type=float, default=WRITES_PER_MINUTE)
+    imp.add_argument("--checkpoint", help="defaults to <input>.checkpoint.json")
+    imp.add_argument("--skip-existing", action="store_true", help="reject rows whose video_id is already in the sheet")
+    imp.set_defaults(func=cmd_import)
+
+    exp = sub.add_parser("export", help="write the worksheet to a CSV/XLSX file")
+    exp.add_argument("output")
+    exp.add_argument("--chunk-size", type=int, default=5000, help="rows per read")
+    exp.add_argument("--reads-per-minute", type=float, default=READS_PER_MINUTE)
+    exp.set_defaults(func=cmd_export)
+
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
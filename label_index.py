@@ -0,0 +1,110 @@
+"""
+Already-labeled index: video_id -> sheet row numbers for one worksheet.
+
+Built from a single fetch of the video_id column (plus rater_id when the
+schema has one), held in memory as dicts and shared by every session in the
+process, then kept current as rows are submitted. Lookups are O(1) however
+long the sheet or the playlist is. Labels submitted in this process are
+added as PENDING and get their sheet row once the sync engine has appended
+them (note_appended).
+"""
+import threading
+
+from local_sheet import col_to_letters
+
+PENDING = 0  # row number used for labels submitted but not yet in the sheet
+
+def _flat(value_range, n):
+    """Single-column ValueRange -> list of n strings (blank rows come back as [])."""
+    out = [r[0] if r else "" for r in value_range]
+    return out + [""] * (n - len(out))
+
+class LabelIndex:
+    def __init__(self, ws, id_col=1, rater_col=None):
+        self.ws = ws
+        self.id_col = id_col
+        self.rater_col = rater_col
+        self.lock = threading.Lock()
+        self._rows = {}    # video_id -> [sheet rows]
+        self._by_key = {}  # (video_id, rater_id or None) -> latest sheet row
+        self.sheet_rows = 0  # data rows seen in the last load
+
+    def load(self):
+        """(Re)build from the sheet with one fetch; returns the number of data rows."""
+        cols = [self.id_col] + ([self.rater_col] if self.rater_col else [])
+        ranges = [f"{col_to_letters(c)}:{col_to_letters(c)}" for c in cols]
+        fetched = self.ws.batch_get(ranges)
+        n = max(len(v) for v in fetched)
+        ids = _flat(fetched[0], n)
+        raters = _flat(fetched[1], n) if self.rater_col else [None] * n
+        rows, by_key = {}, {}
+        for r in range(2, n + 1):
+            vid = ids[r - 1]
+            if vid:
+                rows.setdefault(vid, []).append(r)
+                by_key[(vid, raters[r - 1] or None)] = r
+        with self.lock:
+            # Keep labels submitted locally that the sheet does not show yet
+            for vid, rs in self._rows.items():
+                if PENDING in rs and vid not in rows:
+                    rows[vid] = [PENDING]
+            self._rows = rows
+            self._by_key = by_key
+            self.sheet_rows = max(n - 1, 0)
+        return self.sheet_rows
+
+    def __contains__(self, video_id):
+        return video_id in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def rows_for(self, video_id):
+        """Sheet rows holding `video_id` (PENDING for unsynced ones), oldest first."""
+        return list(self._rows.get(video_id, ()))
+
+    def row_for(self, video_id, rater_id=None):
+        """Latest sheet row for this clip (and rater, when the sheet has a rater_id column), or None."""
+        return self._by_key.get((video_id, (rater_id or None) if self.rater_col else None))
+
+    def add(self, video_id, sheet_row=PENDING, rater_id=None):
+        if not video_id:
+            return
+        with self.lock:
+            rows = self._rows.setdefault(video_id, [])
+            if sheet_row != PENDING and PENDING in rows:
+                rows.remove(PENDING)
+            if sheet_row not in rows:
+                rows.append(sheet_row)
+            if sheet_row != PENDING:
+                self._by_key[(video_id, (rater_id or None) if self.rater_col else None)] = sheet_row
+
+    def note_appended(self, rows, sheet_rows):
+        """Record where the sync engine's appended rows landed, replacing their PENDING marks."""
+        for row, sheet_row in zip(rows, sheet_rows):
+            if sheet_row and len(row) >= self.id_col:
+                rater = row[self.rater_col - 1] if self.rater_col and len(row) >= self.rater_col else None
+                self.add(row[self.id_col - 1], sheet_row, rater_id=rater)
+
+_INDEXES = {}  # (spreadsheet_id, worksheet id) -> LabelIndex
+_INDEXES_LOCK = threading.Lock()
+
+def get_label_index(ws, headers, pending_rows=()):
+    """
+    Process-wide LabelIndex for a worksheet, loaded on first use. `pending_rows`
+    (rows still waiting in the local store) are counted as labeled too.
+    """
+    key = (ws.spreadsheet_id, ws.id)
+    with _INDEXES_LOCK:
+        idx = _INDEXES.get(key)
+        fresh = idx is None or idx.ws is not ws
+        if fresh:
+            id_col = headers.index("video_id") + 1 if "video_id" in headers else 1
+            rater_col = headers.index("rater_id") + 1 if "rater_id" in headers else None
+            idx = _INDEXES[key] = LabelIndex(ws, id_col, rater_col)
+    if fresh:
+        idx.load()
+        for row in pending_rows:
+            if len(row) >= idx.id_col:
+                idx.add(row[idx.id_col - 1])
+    return idx
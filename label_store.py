@@ -0,0 +1,270 @@
+"""
+Offline-first local label store.
+
+Every submitted row is written to a SQLite database (WAL mode) first, which
+makes it the primary copy of the labels: labeling keeps full speed with a bad
+or missing network. The AppendQueue in write_queue acts as the sync engine on
+top of it. It appends the rows the sheet hasn't confirmed yet in batches, and
+pushes edits of rows already in the sheet as cell updates, so nothing it has
+confirmed is ever read back.
+
+Several processes may share the store (two server workers, or a restart while
+the old process is still flushing). A sync engine claims a batch in one
+transaction before appending it, so no two send the same rows; a claim older
+than SYNC_CLAIM_TTL seconds (its owner died) can be taken over.
+"""
+import os, json, time, sqlite3, threading
+from contextlib import contextmanager
+
+from app_paths import data_dir
+
+CLAIM_TTL = float(os.getenv("SYNC_CLAIM_TTL", "300"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    seq            INTEGER PRIMARY KEY AUTOINCREMENT,
+    sheet_key      TEXT NOT NULL,
+    session_id     TEXT,
+    video_id       TEXT,
+    row            TEXT NOT NULL,     -- JSON list, in schema column order
+    version        INTEGER NOT NULL DEFAULT 1,
+    synced_version INTEGER NOT NULL DEFAULT 0,
+    synced_row     TEXT,              -- JSON of the row as last confirmed by the sheet
+    sheet_row      INTEGER,           -- 1-based row number in the sheet, once known
+    parked         TEXT,              -- error that put the row on hold, until retry_parked()
+    claimed_by     TEXT,              -- sync engine appending the row right now
+    claimed_at     REAL,
+    updated_at     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS labels_sheet_video ON labels (sheet_key, video_id);
+"""
+
+class LabelStore:
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _tx(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    # -- local writes ------------------------------------------------------
+    def add(self, sheet_key, rows, video_id=None, session_id=None):
+        """Store new rows; returns their sequence numbers."""
+        now = time.time()
+        with self._tx() as db:
+            return [
+                db.execute(
+                    "INSERT INTO labels (sheet_key, session_id, video_id, row, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (sheet_key, session_id, video_id, json.dumps(row), now),
+                ).lastrowid
+                for row in rows
+            ]
+
+    def update(self, seq, row):
+        """Replace a stored row; the sync engine pushes only the cells that differ."""
+        with self._tx() as db:
+            db.execute(
+                "UPDATE labels SET row = ?, version = version + 1, updated_at = ? WHERE seq = ?",
+                (json.dumps(row), time.time(), seq),
+            )
+
+    def adopt(self, sheet_key, sheet_row, row, video_id=None, session_id=None):
+        """Track a row that already exists in the sheet (e.g. written by an earlier install)."""
+        with self._tx() as db:
+            return db.execute(
+                "INSERT INTO labels (sheet_key, session_id, video_id, row, synced_version, synced_row, sheet_row, updated_at) "
+                "VALUES (?, ?, ?, ?, 1, ?, ?, ?)",
+                (sheet_key, session_id, video_id, json.dumps(row), json.dumps(row), sheet_row, time.time()),
+            ).lastrowid
+
+    # -- reads -------------------------------------------------------------
+    def get(self, seq):
+        with self.lock:
+            r = self.conn.execute("SELECT * FROM labels WHERE seq = ?", (seq,)).fetchone()
+        return _as_dict(r)
+
+    def records_for(self, sheet_key, video_id):
+        """All stored rows for a video_id, newest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM labels WHERE sheet_key = ? AND video_id = ? ORDER BY seq DESC",
+                (sheet_key, video_id),
+            ).fetchall()
+        return [_as_dict(r) for r in rows]
+
+    # -- sync engine side --------------------------------------------------
+    def pending(self, sheet_key, limit=None):
+        """Rows the sheet hasn't confirmed yet, oldest first, as (seq, row)."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT seq, row FROM labels WHERE sheet_key = ? AND synced_row IS NULL AND parked IS NULL "
+                "ORDER BY seq LIMIT ?",
+                (sheet_key, limit or -1),
+            ).fetchall()
+        return [(r["seq"], json.loads(r["row"])) for r in rows]
+
+    def claim(self, sheet_key, owner, limit=None, ttl=CLAIM_TTL):
+        """
+        Pending rows for sync engine `owner` to append, as (seq, row): those
+        nobody claimed, its own, and claims older than `ttl` seconds. Claims
+        them (again) in the same transaction, so another engine skips them.
+        """
+        now = time.time()
+        with self._tx() as db:
+            rows = db.execute(
+                "SELECT seq, row FROM labels WHERE sheet_key = ? AND synced_row IS NULL AND parked IS NULL "
+                "AND (claimed_by IS NULL OR claimed_by = ? OR claimed_at < ?) ORDER BY seq LIMIT ?",
+                (sheet_key, owner, now - ttl, limit or -1),
+            ).fetchall()
+            db.executemany("UPDATE labels SET claimed_by = ?, claimed_at = ? WHERE seq = ?",
+                           [(owner, now, r["seq"]) for r in rows])
+        return [(r["seq"], json.loads(r["row"])) for r in rows]
+
+    def changed(self, sheet_key, limit=None):
+        """Rows already in the sheet whose local copy is newer, as (seq, sheet_row, row, synced_row)."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT seq, sheet_row, row, synced_row FROM labels "
+                "WHERE sheet_key = ? AND sheet_row IS NOT NULL AND version > synced_version AND parked IS NULL "
+                "ORDER BY seq LIMIT ?",
+                (sheet_key, limit or -1),
+            ).fetchall()
+        return [(r["seq"], r["sheet_row"], json.loads(r["row"]), json.loads(r["synced_row"] or "[]")) for r in rows]
+
+    def count_unsynced(self, sheet_key):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM labels WHERE sheet_key = ? AND parked IS NULL AND "
+                "(synced_row IS NULL OR (sheet_row IS NOT NULL AND version > synced_version))",
+                (sheet_key,),
+            ).fetchone()[0]
+
+    def ack(self, sheet_key, batch, sheet_rows):
+        """
+        Mark appended rows as confirmed.
+        `sheet_rows` has the sheet row of each row in `batch`, or None where
+        the response didn't say and the row could not be found by its key
+        (USER_ENTERED may have reformatted it). Such a row is confirmed all the
+        same, since the sheet has it, and gets its row later via locate().
+        """
+        if not batch:
+            return
+        with self._tx() as db:
+            for (seq, row), sheet_row in zip(batch, sheet_rows):
+                sent = json.dumps(row)
+                db.execute(
+                    "UPDATE labels SET sheet_row = ?, synced_row = ?, claimed_by = NULL, "
+                    "synced_version = CASE WHEN row = ? THEN version ELSE synced_version END WHERE seq = ?",
+                    (sheet_row or None, sent, sent, seq),
+                )
+
+    def locate(self, seq, sheet_row):
+        """Give a confirmed row whose place in the sheet was unknown its sheet row."""
+        with self._tx() as db:
+            db.execute("UPDATE labels SET sheet_row = ? WHERE seq = ? AND sheet_row IS NULL", (sheet_row, seq))
+
+    def park(self, seqs, error):
+        """Put rows the sheet rejected on hold: the sync engine skips them until retry_parked()."""
+        with self._tx() as db:
+            db.executemany("UPDATE labels SET parked = ? WHERE seq = ?", [(error, seq) for seq in seqs])
+
+    def parked(self, sheet_key):
+        """(number of rows on hold, the latest error)."""
+        with self.lock:
+            n = self.conn.execute(
+                "SELECT COUNT(*) FROM labels WHERE sheet_key = ? AND parked IS NOT NULL", (sheet_key,)
+            ).fetchone()[0]
+            r = self.conn.execute(
+                "SELECT parked FROM labels WHERE sheet_key = ? AND parked IS NOT NULL ORDER BY seq DESC LIMIT 1",
+                (sheet_key,),
+            ).fetchone()
+        return n, r["parked"] if r else None
+
+    def retry_parked(self, sheet_key):
+        """Hand held rows back to the sync engine."""
+        with self._tx() as db:
+            db.execute("UPDATE labels SET parked = NULL, claimed_by = NULL "
+                       "WHERE sheet_key = ? AND parked IS NOT NULL", (sheet_key,))
+
+    def ack_changed(self, batch):
+        """Mark pushed edits as confirmed; batch is [(seq, row_sent)]."""
+        with self._tx() as db:
+            for seq, row in batch:
+                sent = json.dumps(row)
+                db.execute(
+                    "UPDATE labels SET synced_row = ?, "
+                    "synced_version = CASE WHEN row = ? THEN version ELSE synced_version END WHERE seq = ?",
+                    (sent, sent, seq),
+                )
+
+def _as_dict(r):
+    if r is None:
+        return None
+    d = dict(r)
+    d["row"] = json.loads(d["row"])
+    d["synced_row"] = json.loads(d["synced_row"]) if d["synced_row"] else None
+    return d
+
+class StoreSpool:
+    """The AppendQueue's spool: one sheet's rows in a LabelStore."""
+
+    def __init__(self, store, sheet_key):
+        self.store = store
+        self.sheet_key = sheet_key
+
+    def add(self, rows, video_id=None, session_id=None):
+        return self.store.add(self.sheet_key, rows, video_id=video_id, session_id=session_id)
+
+    def pending(self, limit=None):
+        return self.store.pending(self.sheet_key, limit)
+
+    def claim(self, owner, limit=None):
+        return self.store.claim(self.sheet_key, owner, limit)
+
+    def ack(self, batch, sheet_rows):
+        self.store.ack(self.sheet_key, batch, sheet_rows)
+
+    def changed(self, limit=None):
+        return self.store.changed(self.sheet_key, limit)
+
+    def ack_changed(self, batch):
+        self.store.ack_changed(batch)
+
+    def park(self, seqs, error):
+        self.store.park(seqs, error)
+
+    def parked(self):
+        return self.store.parked(self.sheet_key)
+
+    def retry_parked(self):
+        self.store.retry_parked(self.sheet_key)
+
+    def __len__(self):
+        return self.store.count_unsynced(self.sheet_key)
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+def get_label_store():
+    """Process-wide LabelStore at <data dir>/labels.sqlite3."""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = LabelStore(data_dir() / "labels.sqlite3")
+    return _STORE
+
+def sheet_key(ws):
+    return f"{ws.spreadsheet_id}:{ws.id}"
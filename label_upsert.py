@@ -0,0 +1,59 @@
+"""
+Upsert of label rows: one row per clip (and rater, when the schema has a
+rater_id column) instead of a new row on every submit.
+
+A correction to a row the local store already knows is a store update; the
+sync engine then writes only the changed cells with one ranged batch_update
+(or, if the row has not reached the sheet yet, just appends the new content).
+Rows that exist only in the sheet are fetched once with row_values and adopted
+into the store, so later edits and form pre-fills need no sheet reads at all.
+A row appended without learning where it landed gets its row from the label
+index once that knows it; until then a correction is added as a new row.
+"""
+
+def _rater(columns, row):
+    return row[columns.index("rater_id")] if "rater_id" in columns and len(row) > columns.index("rater_id") else None
+
+def upsert_possible(columns, raters_per_clip=1):
+    """
+    Upsert tells rows apart by clip and rater. Without a rater_id column it can
+    only do that while each clip has one rater; with several, every submit
+    must add its own row, or one rater would overwrite another's labels.
+    """
+    return "rater_id" in columns or raters_per_clip <= 1
+
+def unlocated(rec):
+    """True for a row the sheet confirmed without saying where it landed (see LabelStore.ack)."""
+    return rec["sheet_row"] is None and rec["synced_row"] is not None
+
+def find_record(spool, ws, index, columns, video_id, rater_id=None):
+    """Stored record {"seq", "row", ...} for this clip (and rater), or None."""
+    store, key = spool.store, spool.sheet_key
+    for rec in store.records_for(key, video_id):
+        if "rater_id" not in columns or (_rater(columns, rec["row"]) or None) == (rater_id or None):
+            if unlocated(rec):
+                sheet_row = index.row_for(video_id, rater_id)  # known once the index has reloaded
+                if sheet_row:
+                    store.locate(rec["seq"], sheet_row)
+                    rec["sheet_row"] = sheet_row
+            return rec
+    sheet_row = index.row_for(video_id, rater_id)
+    if not sheet_row:
+        return None
+    existing = ws.row_values(sheet_row)
+    existing = (existing + [""] * len(columns))[: len(columns)]
+    seq = store.adopt(key, sheet_row, existing, video_id=video_id)
+    return store.get(seq)
+
+def save_label(queue, ws, index, columns, row, video_id, session_id=None, upsert=True):
+    """Add or update the row for `video_id`; returns "added" or "updated"."""
+    spool = queue.spool
+    rater_id = _rater(columns, row)
+    rec = find_record(spool, ws, index, columns, video_id, rater_id) if upsert else None
+    if rec is None or unlocated(rec):  # a cell update needs the row's place in the sheet
+        queue.submit(row, video_id=video_id, session_id=session_id)
+        index.add(video_id)
+        return "added"
+    spool.store.update(rec["seq"], row)
+    queue.notify()
+    return "updated"
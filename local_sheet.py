@@ -0,0 +1,324 @@
+"""
+In-process stand-in for the slice of gspread the app uses.
+
+LocalClient / LocalSpreadsheet / LocalWorksheet mirror the gspread method names
+and return shapes (`append_rows` returns an `updates.updatedRange`, reads drop
+trailing empty cells, ...), so the app, CLI and benchmarks run unchanged with
+no Google access. Set SHEETS_BACKEND=local to use it; spreadsheets are then kept
+as JSON files under the data dir. Pass path=None for a purely in-memory sheet.
+"""
+import os, re, json, threading
+
+class WorksheetNotFound(KeyError):
+    pass
+
+_A1_CELL = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+def col_to_letters(col):
+    """1 -> 'A', 27 -> 'AA'."""
+    letters = ""
+    while col > 0:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def letters_to_col(letters):
+    col = 0
+    for ch in letters.upper():
+        col = col * 26 + ord(ch) - 64
+    return col
+
+def rowcol_to_a1(row, col):
+    return f"{col_to_letters(col)}{row}"
+
+def parse_a1_range(a1):
+    """
+    'Sheet!B2:D5' -> (2, 2, 5, 4); open ends ('A:A', 'A2:K') come back as None.
+    Returns (first_row, first_col, last_row, last_col), 1-based and inclusive.
+    """
+    a1 = a1.split("!")[-1].replace("$", "")
+    start, _, end = a1.partition(":")
+    end = end or start
+    bounds = []
+    for part in (start, end):
+        m = _A1_CELL.match(part)
+        if not m:
+            raise ValueError(f"Bad A1 range: {a1!r}")
+        letters, digits = m.groups()
+        bounds.append((int(digits) if digits else None, letters_to_col(letters) if letters else None))
+    (r1, c1), (r2, c2) = bounds
+    return r1 or 1, c1 or 1, r2, c2
+
+def _trim(row):
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+class LocalWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title, rows=1000, cols=26, values=None):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self._values = [list(r) for r in (values or [])]
+
+    @property
+    def spreadsheet_id(self):
+        return self.spreadsheet.id
+
+    # -- helpers -----------------------------------------------------------
+    def _cell(self, r, c):
+        if r <= len(self._values) and c <= len(self._values[r - 1]):
+            return self._values[r - 1][c - 1]
+        return ""
+
+    def _set(self, r, c, value):
+        while len(self._values) < r:
+            self._values.append([])
+        row = self._values[r - 1]
+        while len(row) < c:
+            row.append("")
+        row[c - 1] = "" if value is None else str(value)
+        self.row_count = max(self.row_count, r)
+        self.col_count = max(self.col_count, c)
+
+    def _last_row(self):
+        n = len(self._values)
+        while n and not any(self._values[n - 1]):
+            n -= 1
+        return n
+
+    def _write_block(self, r0, c0, values):
+        with self.spreadsheet.lock:
+            for i, row in enumerate(values):
+                for j, v in enumerate(row):
+                    self._set(r0 + i, c0 + j, v)
+            self.spreadsheet.save()
+
+    # -- reads -------------------------------------------------------------
+    def row_values(self, row):
+        with self.spreadsheet.lock:
+            return _trim(self._values[row - 1]) if row <= len(self._values) else []
+
+    def col_values(self, col):
+        with self.spreadsheet.lock:
+            return _trim(self._cell(r, col) for r in range(1, self._last_row() + 1))
+
+    def get_all_values(self):
+        with self.spreadsheet.lock:
+            rows = [_trim(r) for r in self._values[:self._last_row()]]
+        width = max((len(r) for r in rows), default=0)
+        return [r + [""] * (width - len(r)) for r in rows]
+
+    def get(self, range_name=None, **kwargs):
+        if range_name is None:
+            return self.get_all_values()
+        r1, c1, r2, c2 = parse_a1_range(range_name)
+        with self.spreadsheet.lock:
+            last = self._last_row()
+            r2 = min(r2 or last, last)
+            c2 = c2 or max((len(r) for r in self._values), default=0)
+            out = [_trim(self._cell(r, c) for c in range(c1, c2 + 1)) for r in range(r1, r2 + 1)]
+        while out and not out[-1]:
+            out.pop()
+        return out
+
+    def batch_get(self, ranges, **kwargs):
+        return [self.get(r) for r in ranges]
+
+    # -- writes ------------------------------------------------------------
+    def update(self, values=None, range_name=None, **kwargs):
+        # gspread 6 accepts (values, range_name) positionally or by keyword
+        if isinstance(values, str) and not isinstance(range_name, str):
+            values, range_name = range_name, values
+        r1, c1, _, _ = parse_a1_range(range_name or "A1")
+        self._write_block(r1, c1, values or [])
+        return {"updatedRange": f"{self.title}!{range_name}"}
+
+    def update_cell(self, row, col, value):
+        self._write_block(row, col, [[value]])
+
+    def batch_update(self, data, **kwargs):
+        for item in data:
+            r1, c1, _, _ = parse_a1_range(item["range"])
+            self._write_block(r1, c1, item["values"])
+        return {"totalUpdatedCells": sum(len(r) for d in data for r in d["values"])}
+
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        with self.spreadsheet.lock:
+            first = self._last_row() + 1
+            for i, row in enumerate(values):
+                for j, v in enumerate(row):
+                    self._set(first + i, j + 1, v)
+            self.spreadsheet.save()
+        width = max((len(r) for r in values), default=1)
+        last = first + len(values) - 1
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:{col_to_letters(width)}{last}",
+                            "updatedRows": len(values)}}
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        return self.append_rows([values], value_input_option=value_input_option)
+
+    def add_rows(self, rows):
+        with self.spreadsheet.lock:
+            self.row_count += rows
+            self.spreadsheet.save()
+
+    def add_cols(self, cols):
+        with self.spreadsheet.lock:
+            self.col_count += cols
+            self.spreadsheet.save()
+
+    def resize(self, rows=None, cols=None):
+        with self.spreadsheet.lock:
+            if rows is not None:
+                del self._values[rows:]
+                self.row_count = rows
+            if cols is not None:
+                for row in self._values:
+                    del row[cols:]
+                self.col_count = cols
+            self.spreadsheet.save()
+
+    def delete_columns(self, start_index, end_index=None):
+        end_index = end_index or start_index
+        with self.spreadsheet.lock:
+            for row in self._values:
+                del row[start_index - 1:end_index]
+            self.col_count -= end_index - start_index + 1
+            self.spreadsheet.save()
+
+class LocalSpreadsheet:
+    def __init__(self, spreadsheet_id, path=None):
+        self.id = spreadsheet_id
+        self.path = path
+        self.lock = threading.RLock()
+        self._sheets = []
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            for w in data["worksheets"]:
+                self._sheets.append(LocalWorksheet(self, w["id"], w["title"], w["rows"], w["cols"], w["values"]))
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = {"worksheets": [
+                {"id": w.id, "title": w.title, "rows": w.row_count, "cols": w.col_count, "values": w._values}
+                for w in self._sheets
+            ]}
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+
+    def worksheets(self):
+        return list(self._sheets)
+
+    def worksheet(self, title):
+        for w in self._sheets:
+            if w.title == title:
+                return w
+        raise WorksheetNotFound(title)
+
+    def values_batch_get(self, ranges, params=None):
+        """Spreadsheet-level read of 'Title'!A1 ranges, in the API's {"valueRanges": [...]} shape."""
+        out = []
+        for rng in ranges:
+            title, _, a1 = rng.rpartition("!")
+            values = self.worksheet(title.strip("'").replace("''", "'")).get(a1)
+            out.append({"range": rng, **({"values": values} if values else {})})
+        return {"spreadsheetId": self.id, "valueRanges": out}
+
+    def batch_update(self, body):
+        """
+        Structural requests used by the app (insert/move/delete/appendDimension on
+        columns, updateCells). All-or-nothing, like the API.
+        """
+        with self.lock:
+            saved = {w.id: ([list(r) for r in w._values], w.row_count, w.col_count) for w in self._sheets}
+            try:
+                replies = [self._apply(req) for req in body.get("requests", [])]
+            except Exception:
+                for w in self._sheets:
+                    w._values, w.row_count, w.col_count = saved.get(w.id, (w._values, w.row_count, w.col_count))
+                raise
+            self.save()
+        return {"spreadsheetId": self.id, "replies": replies}
+
+    def _sheet(self, sheet_id):
+        for w in self._sheets:
+            if w.id == sheet_id:
+                return w
+        raise WorksheetNotFound(sheet_id)
+
+    def _apply(self, req):
+        (kind, spec), = req.items()
+        if kind == "updateCells":
+            rng = spec["range"]
+            w = self._sheet(rng["sheetId"])
+            for i, row in enumerate(spec.get("rows", [])):
+                for j, cell in enumerate(row.get("values", [])):
+                    value = next(iter(cell.get("userEnteredValue", {"stringValue": ""}).values()))
+                    w._set(rng.get("startRowIndex", 0) + i + 1, rng.get("startColumnIndex", 0) + j + 1, value)
+            return {}
+        if kind == "appendDimension":
+            w = self._sheet(spec["sheetId"])
+            if spec["dimension"] == "ROWS":
+                w.row_count += spec["length"]
+            else:
+                w.col_count += spec["length"]
+            return {}
+        rng = spec["source"] if kind == "moveDimension" else spec["range"]
+        if rng.get("dimension") != "COLUMNS":
+            raise NotImplementedError(f"{kind} on {rng.get('dimension')}")
+        w = self._sheet(rng["sheetId"])
+        start, end = rng["startIndex"], rng["endIndex"]
+        if kind == "insertDimension":
+            for row in w._values:
+                if len(row) > start:
+                    row[start:start] = [""] * (end - start)
+            w.col_count += end - start
+        elif kind == "deleteDimension":
+            for row in w._values:
+                del row[start:end]
+            w.col_count -= end - start
+        elif kind == "moveDimension":
+            dest = spec["destinationIndex"]  # as counted before the source is removed
+            for row in w._values:
+                row.extend([""] * (max(end, dest) - len(row)))
+                block = row[start:end]
+                del row[start:end]
+                at = dest - (end - start) if dest > start else dest
+                row[at:at] = block
+                while row and row[-1] == "":
+                    row.pop()
+        else:
+            raise NotImplementedError(kind)
+        return {}
+
+    def add_worksheet(self, title, rows, cols, **kwargs):
+        with self.lock:
+            ws = LocalWorksheet(self, max([w.id for w in self._sheets], default=-1) + 1, title, rows, cols)
+            self._sheets.append(ws)
+            self.save()
+        return ws
+
+class LocalClient:
+    """Drop-in for a gspread Client: open_by_key returns a LocalSpreadsheet."""
+
+    def __init__(self, root=None):
+        self.root = root
+        self._open = {}
+        self.lock = threading.Lock()
+
+    def open_by_key(self, key):
+        with self.lock:
+            sh = self._open.get(key)
+            if sh is None:
+                path = os.path.join(self.root, f"{key}.json") if self.root else None
+                sh = self._open[key] = LocalSpreadsheet(key, path)
+        return sh
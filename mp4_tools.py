@@ -0,0 +1,410 @@
+"""
+MP4 inspection and "faststart" remuxing in pure Python (no decoding, no ffmpeg).
+
+inspect() walks the ISO-BMFF box tree and reads duration, resolution, codecs
+and where the `moov` (index) box sits relative to `mdat` (media data). When
+moov comes last, a browser has to download the whole file before it can start
+playing; faststart() rewrites the file with moov in front and every chunk
+offset (stco/co64) shifted to match, upgrading stco to co64 if an offset no
+longer fits in 32 bits. Media bytes are copied as-is.
+
+ClipPreparer runs both in MP4_WORKERS worker processes (this file run as a
+script, so they never import the app) over the playlist (its first
+MP4_PREPARE_LIMIT clips) when setup is saved, and over the clips around the
+current one while labeling. Metadata is cached in .labeler/mp4_meta/ and remuxed copies in
+.labeler/faststart/ (LRU, FASTSTART_QUOTA_MB); the original files are never
+modified.
+"""
+import os, sys, json, queue, struct, hashlib, tempfile, threading, subprocess
+
+from app_paths import data_dir
+from video_spool import CHUNK, VideoSpool
+
+MP4_WORKERS = int(os.getenv("MP4_WORKERS", "2"))
+MP4_PREPARE_LIMIT = int(os.getenv("MP4_PREPARE_LIMIT", "1000"))  # clips queued on setup save
+FASTSTART_QUOTA_MB = float(os.getenv("FASTSTART_QUOTA_MB", "4096"))
+MP4_META_VERSION = 1
+
+# Boxes whose payload is just more boxes (on the path to the chunk offset tables)
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf", b"mvex"}
+
+# -----------------------------------------------------------------------------
+# Box parsing
+# -----------------------------------------------------------------------------
+def top_level_boxes(f):
+    """[(type, offset, size)] of the top-level boxes of an open file."""
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    boxes, off = [], 0
+    while off + 8 <= end:
+        f.seek(off)
+        size, typ = struct.unpack(">I4s", f.read(8))
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+        elif size == 0:
+            size = end - off
+        if size < 8 or off + size > end:
+            raise ValueError(f"Truncated or invalid MP4 box {typ!r} at offset {off}")
+        boxes.append((typ, off, size))
+        off += size
+    if not boxes or boxes[0][0] not in (b"ftyp", b"styp", b"free", b"skip", b"wide", b"moov", b"mdat"):
+        raise ValueError("Not an MP4 file")
+    return boxes
+
+def parse_boxes(buf):
+    """Box tree of a byte string: [[type, children-list or payload bytes], ...]."""
+    nodes, off = [], 0
+    while off + 8 <= len(buf):
+        size, typ = struct.unpack_from(">I4s", buf, off)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", buf, off + 8)[0]
+            header = 16
+        elif size == 0:
+            size = len(buf) - off
+        if size < header or off + size > len(buf):
+            raise ValueError(f"Invalid MP4 box {typ!r}")
+        payload = buf[off + header:off + size]
+        nodes.append([typ, parse_boxes(payload) if typ in CONTAINERS else payload])
+        off += size
+    return nodes
+
+def build_boxes(nodes):
+    out = []
+    for typ, body in nodes:
+        payload = build_boxes(body) if isinstance(body, list) else body
+        if len(payload) + 8 > 0xFFFFFFFF:
+            out.append(struct.pack(">I4sQ", 1, typ, len(payload) + 16))
+        else:
+            out.append(struct.pack(">I4s", len(payload) + 8, typ))
+        out.append(payload)
+    return b"".join(out)
+
+def _find(nodes, *path):
+    """Every box reached by following `path` of box types."""
+    found = [n for n in nodes if n[0] == path[0]]
+    if len(path) == 1:
+        return found
+    return [m for n in found if isinstance(n[1], list) for m in _find(n[1], *path[1:])]
+
+# -----------------------------------------------------------------------------
+# Inspection
+# -----------------------------------------------------------------------------
+def _mvhd(payload):
+    if payload[0] == 1:
+        timescale, duration = struct.unpack_from(">IQ", payload, 20)
+    else:
+        timescale, duration = struct.unpack_from(">II", payload, 12)
+    return timescale, duration
+
+def _tkhd_size(payload):
+    off = 4 + (32 if payload[0] == 1 else 20) + 52
+    w, h = struct.unpack_from(">II", payload, off)
+    return w >> 16, h >> 16
+
+def _track_info(trak):
+    hdlr = _find(trak[1], b"mdia", b"hdlr")
+    kind = hdlr[0][1][8:12].decode("latin-1") if hdlr else ""
+    stsd = _find(trak[1], b"mdia", b"minf", b"stbl", b"stsd")
+    codec, width, height = "", 0, 0
+    if stsd and len(stsd[0][1]) >= 16:
+        entry = stsd[0][1][8:]
+        codec = entry[4:8].decode("latin-1")
+        if kind == "vide" and len(entry) >= 36:
+            width, height = struct.unpack_from(">HH", entry, 32)
+    tkhd = _find(trak[1], b"tkhd")
+    if kind == "vide" and tkhd and not width:
+        width, height = _tkhd_size(tkhd[0][1])
+    return kind, codec, width, height
+
+def inspect(path):
+    """
+    Header facts about an MP4 file:
+    {duration, width, height, codec, audio_codec, faststart, fragmented, size}.
+    Raises ValueError for files that aren't MP4.
+    """
+    with open(path, "rb") as f:
+        boxes = top_level_boxes(f)
+        types = [t for t, _, _ in boxes]
+        if b"moov" not in types:
+            raise ValueError("MP4 has no moov box")
+        _, moov_off, moov_size = boxes[types.index(b"moov")]
+        f.seek(moov_off)
+        moov = parse_boxes(f.read(moov_size))[0]
+    info = {"duration": None, "width": None, "height": None, "codec": None, "audio_codec": None,
+            "faststart": b"mdat" not in types or moov_off < boxes[types.index(b"mdat")][1],
+            "fragmented": b"moof" in types, "size": os.path.getsize(path)}
+    mvhd = _find(moov[1], b"mvhd")
+    if mvhd:
+        timescale, duration = _mvhd(mvhd[0][1])
+        if timescale:
+            info["duration"] = round(duration / timescale, 3)
+    for trak in _find(moov[1], b"trak"):
+        kind, codec, width, height = _track_info(trak)
+        if kind == "vide" and not info["codec"]:
+            info.update(codec=codec, width=width, height=height)
+        elif kind == "soun" and not info["audio_codec"]:
+            info["audio_codec"] = codec
+    return info
+
+# -----------------------------------------------------------------------------
+# Faststart remux
+# -----------------------------------------------------------------------------
+def _shift_chunk_offsets(moov, shift_for):
+    """Rewrite every stco/co64 table through shift_for(offset); stco becomes co64 on overflow."""
+    for stbl in _find(moov[1], b"trak", b"mdia", b"minf", b"stbl"):
+        for box in stbl[1]:
+            if box[0] not in (b"stco", b"co64"):
+                continue
+            body = box[1]
+            count = struct.unpack_from(">I", body, 4)[0]
+            wide = box[0] == b"co64"
+            offsets = struct.unpack_from(f">{count}{'Q' if wide else 'I'}", body, 8)
+            shifted = [shift_for(o) for o in offsets]
+            if not wide and shifted and max(shifted) > 0xFFFFFFFF:
+                wide = True
+                box[0] = b"co64"
+            box[1] = body[:8] + struct.pack(f">{count}{'Q' if wide else 'I'}", *shifted)
+
+def faststart(src, dst):
+    """
+    Write `src` to `dst` with moov ahead of the media data. Returns False (and
+    writes nothing) if the file is already faststart or fragmented.
+    """
+    with open(src, "rb") as f:
+        boxes = top_level_boxes(f)
+        types = [t for t, _, _ in boxes]
+        if b"moov" not in types or b"mdat" not in types or b"moof" in types:
+            return False
+        moov_i, first_mdat_i = types.index(b"moov"), types.index(b"mdat")
+        if moov_i < first_mdat_i:
+            return False
+        _, moov_off, moov_size = boxes[moov_i]
+        f.seek(moov_off)
+        raw = f.read(moov_size)
+
+    insert_at = boxes[first_mdat_i][1]
+    # Media moves forward by the new moov's size; anything that was after the
+    # old moov also loses the old moov's bytes. The new size depends on whether
+    # stco tables had to grow to co64, so settle it by iterating.
+    new_size = moov_size
+    for _ in range(3):
+        moov = parse_boxes(raw)[0]
+        delta = new_size
+
+        def shift_for(o, delta=delta):
+            if o < insert_at:
+                return o
+            return o + delta if o < moov_off else o + delta - moov_size
+
+        _shift_chunk_offsets(moov, shift_for)
+        data = build_boxes([moov])
+        if len(data) == new_size:
+            break
+        new_size = len(data)
+    else:
+        raise ValueError("Could not settle the moov size")
+
+    with open(src, "rb") as f, open(dst, "wb") as out:
+        for typ, off, size in boxes:
+            if off == insert_at:
+                out.write(data)
+            if typ == b"moov":
+                continue
+            f.seek(off)
+            remaining = size
+            while remaining:
+                chunk = f.read(min(CHUNK, remaining))
+                if not chunk:
+                    raise ValueError("MP4 changed while remuxing")
+                out.write(chunk)
+                remaining -= len(chunk)
+    return True
+
+# -----------------------------------------------------------------------------
+# Worker processes over the playlist
+# -----------------------------------------------------------------------------
+def clip_key(path):
+    st_ = os.stat(path)
+    return hashlib.sha256(f"{os.path.abspath(path)}:{st_.st_mtime_ns}:{st_.st_size}".encode()).hexdigest()[:32]
+
+def prepare_clip(path, tmp_dir):
+    """Worker: inspect `path` and, if moov is at the end, remux a faststart copy into tmp_dir."""
+    try:
+        info = inspect(path)
+    except (OSError, ValueError, struct.error) as e:
+        return {"error": str(e)}
+    info["remuxed_tmp"] = None
+    if not info["faststart"] and not info["fragmented"]:
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+        os.close(fd)
+        try:
+            if faststart(path, tmp):
+                info["remuxed_tmp"] = tmp
+        except (OSError, ValueError, struct.error) as e:
+            info["remux_error"] = str(e)
+        finally:
+            if not info["remuxed_tmp"] and os.path.exists(tmp):
+                os.remove(tmp)
+    return info
+
+def _worker_loop():
+    """
+    Worker process, started by ClipPreparer as `python mp4_tools.py`: one JSON
+    job per stdin line, one prepare_clip() result per stdout line. Being its
+    own entry script, it never imports the app.
+    """
+    out, sys.stdout = sys.stdout, sys.stderr  # keep stray prints off the result pipe
+    for line in sys.stdin:
+        job = json.loads(line)
+        try:
+            info = prepare_clip(job["path"], job["tmp_dir"])
+        except Exception as e:
+            info = {"error": str(e)}
+        out.write(json.dumps(info) + "\n")
+        out.flush()
+
+class ClipPreparer:
+    """
+    Inspects and faststart-remuxes local clips in worker processes, in the
+    background. meta() and playable_path() never wait on a job.
+    """
+
+    def __init__(self, meta_dir, remux_cache, workers=MP4_WORKERS):
+        self.meta_dir = str(meta_dir)
+        self.remux = remux_cache
+        self.workers = workers
+        self.lock = threading.Lock()
+        self._queue = queue.Queue()  # (key, path) of clips to prepare
+        self._threads = []
+        self._jobs = set()           # keys queued or running
+        self._meta = {}              # key -> metadata dict
+
+    def _serve(self):
+        """One feeder thread: sends queued clips to its own worker process, replacing it if it dies."""
+        proc = None
+        while True:
+            key, path = self._queue.get()
+            try:
+                if proc is None:
+                    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            text=True, encoding="utf-8")
+                proc.stdin.write(json.dumps({"path": path, "tmp_dir": self.remux.root}) + "\n")
+                proc.stdin.flush()
+                line = proc.stdout.readline()
+                if not line:
+                    raise OSError("MP4 worker exited")
+                info = json.loads(line)
+            except (OSError, ValueError):
+                # The worker died: reap it, start a fresh one next time, and retry this clip then
+                if proc is not None:
+                    proc.kill()
+                    proc.wait()
+                proc = None
+                with self.lock:
+                    self._jobs.discard(key)
+                continue
+            self._done(key, info)
+
+    def _meta_file(self, key):
+        return os.path.join(self.meta_dir, f"{key}.json")
+
+    def _load(self, key):
+        meta = self._meta.get(key)
+        if meta is None:
+            try:
+                with open(self._meta_file(key), encoding="utf-8") as f:
+                    meta = json.load(f)
+                if meta.get("version") != MP4_META_VERSION:
+                    return None
+            except (OSError, ValueError):
+                return None
+            self._meta[key] = meta
+        return meta
+
+    def _done(self, key, info):
+        tmp = info.pop("remuxed_tmp", None)
+        info["remuxed"] = bool(tmp)
+        if tmp:
+            try:
+                self.remux.add_file(tmp, key)
+            except OSError:
+                info["remuxed"] = False
+        info["version"] = MP4_META_VERSION
+        try:
+            with open(self._meta_file(key) + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(info, f)
+            os.replace(self._meta_file(key) + ".tmp", self._meta_file(key))
+        except OSError:
+            pass
+        with self.lock:
+            self._meta[key] = info
+            self._jobs.discard(key)
+
+    def submit(self, paths):
+        """Queue clips that haven't been prepared yet (already cached or running ones are skipped)."""
+        for path in paths:
+            try:
+                key = clip_key(path)
+            except OSError:
+                continue
+            with self.lock:
+                if key in self._jobs or self._load(key) is not None:
+                    continue
+                self._jobs.add(key)
+                if not self._threads:  # worker processes start with the first clip
+                    self._threads = [threading.Thread(target=self._serve, daemon=True, name=f"mp4-worker-{i}")
+                                     for i in range(self.workers)]
+                    for t in self._threads:
+                        t.start()
+            self._queue.put((key, path))
+
+    def meta(self, path):
+        """Cached metadata for a clip, or None while it's still being inspected."""
+        try:
+            key = clip_key(path)
+        except OSError:
+            return None
+        with self.lock:
+            return self._load(key)
+
+    def playable_path(self, path):
+        """The faststart copy of a clip if one was made (and not evicted), else the clip itself."""
+        meta = self.meta(path)
+        if meta and meta.get("remuxed"):
+            return self.remux.path(clip_key(path)) or path
+        return path
+
+_PREPARER = None
+_PREPARER_LOCK = threading.Lock()
+
+def get_clip_preparer():
+    """Process-wide ClipPreparer (shared by every session)."""
+    global _PREPARER
+    with _PREPARER_LOCK:
+        if _PREPARER is None:
+            _PREPARER = ClipPreparer(data_dir("mp4_meta"),
+                                     VideoSpool(data_dir("faststart"), FASTSTART_QUOTA_MB * 1024 * 1024))
+    return _PREPARER
+
+def describe(meta):
+    """One-line summary for the UI."""
+    if not meta or meta.get("error"):
+        return ""
+    parts = []
+    if meta.get("duration") is not None:
+        parts.append(f"{meta['duration']:.1f} s")
+    if meta.get("width"):
+        parts.append(f"{meta['width']}×{meta['height']}")
+    codecs = "/".join(c for c in (meta.get("codec"), meta.get("audio_codec")) if c)
+    if codecs:
+        parts.append(codecs)
+    if meta.get("remuxed"):
+        parts.append("remuxed for fast start")
+    elif not meta.get("faststart"):
+        parts.append("moov at end (slow start)")
+    return " · ".join(parts)
+
+if __name__ == "__main__":
+    _worker_loop()
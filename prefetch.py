@@ -0,0 +1,125 @@
+"""
+Background prefetch of URL / Google Drive clips into a bounded on-disk cache.
+
+While the rater watches clip i, the next PREFETCH_AHEAD clips of the playlist
+are downloaded into a VideoSpool (keyed by the URL's hash, LRU-evicted under
+URL_CACHE_QUOTA_MB). Cached clips are read from the local disk instead of the
+network, so Next/Previous doesn't wait on a download; anything not cached yet
+still streams from the original URL.
+
+Downloads resume: a partial file <key>.part is kept and continued with an HTTP
+Range request (a 416 reply means the part is already complete, when its size
+matches the file's, or stale, and then the download starts over). Partial files
+count toward the quota and are evicted like clips once abandoned. The fetcher
+is pluggable -- any callable `fetcher(url, dest_path, offset)` works, e.g. one
+pointed at a local test server.
+"""
+import os, re, time, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app_paths import data_dir
+from video_spool import CHUNK, VideoSpool
+
+URL_CACHE_QUOTA_MB = float(os.getenv("URL_CACHE_QUOTA_MB", "2048"))
+PREFETCH_AHEAD = int(os.getenv("PREFETCH_AHEAD", "3"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+RETRY_AFTER_FAILURE = 60.0  # seconds before a failed URL is tried again
+
+def http_fetch(url, dest, offset=0, timeout=30):
+    """Stream `url` into `dest`, continuing from byte `offset` when the server honours Range."""
+    import urllib.error, urllib.request
+
+    headers = {"User-Agent": "driver-emotion-labeler"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        resp = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # Range not satisfiable: "bytes */<size>" tells whether the part is already the whole file
+        m = re.match(r"bytes \*/(\d+)", e.headers.get("Content-Range") or "")
+        if m and int(m.group(1)) == offset:
+            return
+        return http_fetch(url, dest, 0, timeout)
+    with resp:
+        if offset and resp.status != 206:
+            offset = 0  # Range ignored: start over
+        if "text/html" in resp.headers.get("Content-Type", ""):
+            # e.g. Drive's "can't scan for viruses" page for large files
+            raise ValueError("URL returned an HTML page instead of a video")
+        with open(dest, "ab" if offset else "wb") as out:
+            while True:
+                chunk = resp.read(CHUNK)
+                if not chunk:
+                    break
+                out.write(chunk)
+
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+class Prefetcher:
+    def __init__(self, cache, fetcher=http_fetch, workers=PREFETCH_WORKERS):
+        self.cache = cache
+        self.fetcher = fetcher
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.lock = threading.Lock()
+        self.inflight = {}  # key -> Future
+        self.failed = {}    # key -> (monotonic time, error)
+
+    def cached_path(self, url):
+        """Local path of a fully downloaded clip, or None."""
+        return self.cache.path(url_key(url))
+
+    def status(self, url):
+        key = url_key(url)
+        with self.lock:
+            if key in self.inflight:
+                return "downloading"
+            if key in self.failed:
+                return f"failed: {self.failed[key][1]}"
+        return "cached" if self.cached_path(url) else None
+
+    def prefetch(self, urls):
+        """Queue downloads for any of `urls` not cached or already in flight (in order)."""
+        for url in urls:
+            if not url or self.cached_path(url):
+                continue
+            key = url_key(url)
+            with self.lock:
+                if key in self.inflight:
+                    continue
+                failed = self.failed.get(key)
+                if failed and time.monotonic() - failed[0] < RETRY_AFTER_FAILURE:
+                    continue
+                self.inflight[key] = self.executor.submit(self._download, url, key)
+
+    def _download(self, url, key):
+        part = os.path.join(self.cache.root, key + ".part")
+        try:
+            with self.cache.writing(part):
+                self.cache.evict()  # make room, e.g. by dropping abandoned partial downloads
+                offset = os.path.getsize(part) if os.path.exists(part) else 0
+                self.fetcher(url, part, offset)
+                self.cache.add_file(part, key)
+            with self.lock:
+                self.failed.pop(key, None)
+        except Exception as e:
+            with self.lock:
+                self.failed[key] = (time.monotonic(), f"{type(e).__name__}: {e}")
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+_PREFETCHER = None
+_PREFETCHER_LOCK = threading.Lock()
+
+def get_prefetcher():
+    """Process-wide prefetcher; sessions watching the same URLs share downloads."""
+    global _PREFETCHER
+    with _PREFETCHER_LOCK:
+        if _PREFETCHER is None:
+            cache = VideoSpool(data_dir("url_cache"), URL_CACHE_QUOTA_MB * 1024 * 1024)
+            _PREFETCHER = Prefetcher(cache)
+    return _PREFETCHER
@@ -1,42 +1,52 @@
-import pandas as pd
+import io, os, copy, json, hashlib, threading
 from pathlib import Path
 
-def _parse_features_table(df: pd.DataFrame):
-    choices = {}
+from app_paths import data_dir
+
+# Bump when the compiled format or parsing rules change, to invalidate old cache files.
+SCHEMA_CACHE_VERSION = 1
+
+def _parse_features_table(df):
+    """
+    Column B names a field, column C lists its values; a field's values continue
+    on the following rows until the next field name. Vectorized: forward-fill the
+    field column, then de-duplicate (field, value) pairs in first-seen order.
+    """
+    import pandas as pd
+
     if df.shape[1] < 2:
-        return choices
-    col_field = 1  # Column B
-    col_value = 2 if df.shape[1] > 2 else None  # Column C
-    current_field = None
-    for _, row in df.iterrows():
-        field = str(row.iloc[col_field]).strip() if pd.notna(row.iloc[col_field]) else ""
-        value = str(row.iloc[col_value]).strip() if (col_value is not None and pd.notna(row.iloc[col_value])) else ""
-        if field and field.lower() not in ("nan",):
-            current_field = field
-            if current_field not in choices:
-                choices[current_field] = []
-            if value:
-                choices[current_field].append(value)
-        else:
-            if current_field and value:
-                choices[current_field].append(value)
-    # de-dup and clean
-    for k, vals in list(choices.items()):
-        clean, seen = [], set()
-        for v in vals:
-            if not v or v.lower() == "nan":
-                continue
-            if v not in seen:
-                seen.add(v)
-                clean.append(v)
-        choices[k] = clean
-    return choices
+        return {}
+    field = df.iloc[:, 1].where(df.iloc[:, 1].notna(), "").astype(str).str.strip()
+    field = field.mask(field.str.lower().isin(["", "nan"]))
+    if df.shape[1] > 2:
+        value = df.iloc[:, 2].where(df.iloc[:, 2].notna(), "").astype(str).str.strip()
+    else:
+        value = pd.Series("", index=df.index)
+
+    pairs = pd.DataFrame({"field": field.ffill(), "value": value})
+    pairs = pairs[pairs["field"].notna() & (pairs["value"] != "") & (pairs["value"].str.lower() != "nan")]
+    grouped = pairs.drop_duplicates().groupby("field", sort=False)["value"].agg(list)
+    # Fields with no values still get an (empty) entry, in order of appearance
+    return {f: grouped.get(f, []) for f in field.dropna().unique()}
+
+def _read_excel(src, **kwargs):
+    """`src` is a path or the raw bytes of an uploaded workbook."""
+    import pandas as pd
 
-def load_schema_from_excels(features_path: str, example_path: str):
+    if isinstance(src, (bytes, bytearray)):
+        src = io.BytesIO(src)
+    return pd.read_excel(src, sheet_name=0, **kwargs)
+
+def _exists(src):
+    return isinstance(src, (bytes, bytearray)) and len(src) > 0 or (
+        isinstance(src, (str, Path)) and Path(src).exists()
+    )
+
+def load_schema_from_excels(features_path, example_path):
+    """Parse the two workbooks; each argument may be a file path or the workbook's bytes."""
     schema = {"columns": [], "choices": {}}
-    ex_fp = Path(example_path)
-    if ex_fp.exists():
-        ex = pd.read_excel(ex_fp, sheet_name=0)
+    if _exists(example_path):
+        ex = _read_excel(example_path)
         # Normalize column names on the DataFrame FIRST
         # - drop Video_Name if present
         # - rename 'Video ID' -> 'video_id'
@@ -66,9 +76,8 @@ def load_schema_from_excels(features_path: str, example_path: str):
                 schema["choices"].setdefault(col, vals)
     else:
         schema["columns"] = ["video_id", "timestamp_utc", "rater_id", "notes"]
-    feat_fp = Path(features_path)
-    if feat_fp.exists():
-        feat = pd.read_excel(feat_fp, sheet_name=0, header=None)
+    if _exists(features_path):
+        feat = _read_excel(features_path, header=None)
         parsed = _parse_features_table(feat)
         for field, vals in parsed.items():
             if str(field).strip().lower() in ("video_name",):
@@ -78,3 +87,56 @@ def load_schema_from_excels(features_path: str, example_path: str):
     for col in schema["columns"]:
         schema["choices"].setdefault(col, [])
     return schema
+
+def compile_schema(schema):
+    """
+    Add `option_index`: for each column, value -> position in the dropdown
+    options `[""] + choices[col]` (0 means unset).
+    """
+    schema["columns"] = [str(c) for c in schema["columns"]]
+    schema["option_index"] = {
+        col: {v: i + 1 for i, v in enumerate(vals)} for col, vals in schema["choices"].items()
+    }
+    return schema
+
+# -----------------------------------------------------------------------------
+# Compiled-schema cache (process memory, then <data dir>/schema_cache/*.json)
+# -----------------------------------------------------------------------------
+_COMPILED = {}
+_COMPILED_LOCK = threading.Lock()
+
+def _content_hash(src):
+    h = hashlib.sha256()
+    if isinstance(src, (bytes, bytearray)):
+        h.update(src)
+    elif _exists(src):
+        h.update(Path(src).read_bytes())
+    else:
+        h.update(b"<missing>")
+    return h.hexdigest()
+
+def load_compiled_schema(features, example):
+    """
+    Compiled schema for the two workbooks (paths or bytes), keyed by their
+    content hash. Hits in memory or on disk never import pandas.
+    Returns a private copy the caller may modify.
+    """
+    key = hashlib.sha256(
+        f"{SCHEMA_CACHE_VERSION}:{_content_hash(features)}:{_content_hash(example)}".encode()
+    ).hexdigest()[:32]
+    with _COMPILED_LOCK:
+        schema = _COMPILED.get(key)
+    if schema is None:
+        cache_file = data_dir("schema_cache") / f"{key}.json"
+        try:
+            schema = json.loads(cache_file.read_text())
+        except (OSError, ValueError):
+            schema = compile_schema(load_schema_from_excels(features, example))
+            # own temp name per process and thread: two sessions may compile the same workbooks at once
+            tmp = cache_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(json.dumps(schema))
+            tmp.replace(cache_file)
+        schema["hash"] = key
+        with _COMPILED_LOCK:
+            _COMPILED[key] = schema
+    return copy.deepcopy(schema)
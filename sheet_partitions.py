@@ -0,0 +1,382 @@
+"""
+Worksheet partitioning: one logical label table spread over numbered worksheets.
+
+Appends go to the newest partition. Once it holds PARTITION_ROWS data rows the
+next append rolls over to a new worksheet (labels_log_0001, labels_log_0002,
+...) with the same header row, and the partitions are listed in a small
+manifest worksheet (labels_log_partitions):
+
+    partition | worksheet        | sheet_id   | data_rows
+    0         | labels_log       | 0          | 100000
+    1         | labels_log_0001  | 1873150441 |              <- active, still growing
+
+PartitionedWorksheet offers the worksheet methods the app uses in logical row
+numbers: row 1 is the header and data rows follow partition after partition,
+so the row counter, the label index, upserts, the Analytics snapshot and
+export all see one table. Partition 0 is the original worksheet, so existing
+sheets and stored row numbers keep their meaning; until the first rollover
+every call goes straight to it (no manifest, no extra requests).
+
+Row capacity is added ahead of the appends, PARTITION_GROW_ROWS at a time (a
+rolled-over partition is created at its full size), and a sealed partition is
+trimmed to its data, so empty grid cells do not count against the
+spreadsheet's cell limit.
+
+Writers in other processes find out about a rollover from the manifest, which
+is re-read whenever the active partition is about to fill up. Rows a stale
+writer appended past a partition's seal are moved to the active partition.
+"""
+import os, re, threading
+
+from local_sheet import col_to_letters
+from write_queue import appended_rows
+
+PARTITION_ROWS = int(os.getenv("PARTITION_ROWS", "100000"))
+PARTITION_GROW_ROWS = int(os.getenv("PARTITION_GROW_ROWS", "10000"))
+MANIFEST_HEADERS = ["partition", "worksheet", "sheet_id", "data_rows"]
+
+_A1 = re.compile(r"^([A-Za-z]*)(\d*)(?::([A-Za-z]*)(\d*))?$")
+
+def partition_title(base, n):
+    return f"{base}_{n:04d}"
+
+def manifest_title(base):
+    return f"{base}_partitions"
+
+def _parse(a1):
+    """'A2:I' -> ('A', 2, 'I', None); a missing start row is 1, a missing end row is open."""
+    m = _A1.match(a1.split("!")[-1].replace("$", ""))
+    if not m:
+        raise ValueError(f"Bad A1 range: {a1!r}")
+    c1, r1, c2, r2 = m.groups()
+    if m.group(3) is None and m.group(4) is None:  # single cell "B5"
+        return c1, int(r1 or 1), c1, int(r1) if r1 else None
+    return c1, int(r1 or 1), c2, int(r2) if r2 else None
+
+class PartitionedWorksheet:
+    def __init__(self, spreadsheet, base, rows_per_partition=PARTITION_ROWS):
+        self.spreadsheet = spreadsheet
+        self.base = base
+        self.rows_per_partition = rows_per_partition
+        self.headers = None        # schema columns, set by gsheets_client once the header row is checked
+        self.manifest = None
+        self.parts = [[base, None]]  # [worksheet, data rows when sealed / None for the active one]
+        self.lock = threading.RLock()
+        self._active_rows = None   # data rows in the active partition, when known
+
+    # --- identity: the logical table is keyed like the original worksheet ---
+    @property
+    def id(self):
+        return self.base.id
+
+    @property
+    def spreadsheet_id(self):
+        return self.base.spreadsheet_id
+
+    @property
+    def title(self):
+        return self.base.title
+
+    @property
+    def partitions(self):
+        return [ws for ws, _ in self.parts]
+
+    @property
+    def active(self):
+        return self.parts[-1][0]
+
+    @property
+    def row_count(self):
+        return sum(ws.row_count - 1 for ws in self.partitions) + 1
+
+    @property
+    def col_count(self):
+        return self.active.col_count
+
+    # --- manifest -----------------------------------------------------------
+    def _load_manifest(self, sheets=None):
+        rows = self.manifest.get_all_values()[1:]
+        known = {ws.title: ws for ws in self.partitions}
+        parts = []
+        for row in sorted((r + [""] * 4 for r in rows if r and r[0].strip().isdigit()), key=lambda r: int(r[0])):
+            title, data_rows = row[1], row[3].strip()
+            if int(row[0]) == 0:
+                ws = self.base
+            else:
+                ws = known.get(title) or (sheets or {}).get(title) or self.spreadsheet.worksheet(title)
+            parts.append([ws, int(data_rows) if data_rows else None])
+        if not parts:
+            return
+        if parts[-1][0].title != self.active.title:
+            self._active_rows = None
+        self.parts = parts
+
+    def refresh(self):
+        """Pick up rollovers made by other processes (one read; a listing too while no manifest exists)."""
+        with self.lock:
+            sheets = None
+            if self.manifest is None:
+                sheets = {ws.title: ws for ws in self.spreadsheet.worksheets()}
+                self.manifest = sheets.get(manifest_title(self.title))
+                if self.manifest is None:
+                    return
+            self._load_manifest(sheets)
+
+    def _write_manifest(self):
+        rows = [MANIFEST_HEADERS] + [[str(i), ws.title, str(ws.id), "" if n is None else str(n)]
+                                     for i, (ws, n) in enumerate(self.parts)]
+        if self.manifest is None:
+            self.manifest = self.spreadsheet.add_worksheet(
+                title=manifest_title(self.title), rows=max(100, len(rows) + 10), cols=len(MANIFEST_HEADERS))
+        self.manifest.update(range_name="A1", values=rows)
+
+    # --- logical <-> physical rows -----------------------------------------
+    def _segments(self, r1, r2=None):
+        """
+        Split logical rows r1..r2 (r2=None: to the end) into
+        [(partition index, first physical row, last physical row or None, sealed)].
+        """
+        with self.lock:
+            parts = [list(p) for p in self.parts]
+        out, offset = [], 0
+        for i, (ws, n) in enumerate(parts):
+            lo = 1 if i == 0 else 2
+            hi = None if n is None else n + 1
+            a = max(r1, lo + offset)
+            b = None if hi is None else hi + offset
+            if r2 is not None:
+                b = r2 if b is None else min(b, r2)
+            if b is None or a <= b:
+                out.append((i, a - offset, None if b is None else b - offset, n is not None))
+            if n is None:
+                break
+            offset += n
+        return out
+
+    def _offset(self, i):
+        return sum(n for _, n in self.parts[:i])
+
+    # --- reads --------------------------------------------------------------
+    def batch_get(self, ranges, **kwargs):
+        if len(self.parts) == 1:
+            return self.base.batch_get(ranges, **kwargs)
+        plans, wanted = [], {}
+        for rng in ranges:
+            c1, r1, c2, r2 = _parse(rng)
+            plan = []
+            for i, p1, p2, sealed in self._segments(r1, r2):
+                wanted.setdefault(i, []).append(f"{c1}{p1}:{c2}{p2 or ''}")
+                plan.append((i, len(wanted[i]) - 1, p2 - p1 + 1 if sealed else None))
+            plans.append(plan)
+        got = {i: self.parts[i][0].batch_get(rs, **kwargs) for i, rs in wanted.items()}
+        out = []
+        for plan in plans:
+            rows = []
+            for i, k, expected in plan:
+                block = [list(r) for r in got[i][k]]
+                rows.extend(block + [[] for _ in range(len(block), expected or 0)])
+            while rows and not rows[-1]:
+                rows.pop()
+            out.append(rows)
+        return out
+
+    def get(self, range_name=None, **kwargs):
+        if len(self.parts) == 1:
+            return self.base.get(range_name, **kwargs)
+        if range_name is None:
+            return self.get_all_values()
+        return self.batch_get([range_name], **kwargs)[0]
+
+    def get_all_values(self, **kwargs):
+        if len(self.parts) == 1:
+            return self.base.get_all_values(**kwargs)
+        rows = self.get(f"A1:{col_to_letters(max(self.col_count, 1))}")
+        width = max((len(r) for r in rows), default=0)
+        return [r + [""] * (width - len(r)) for r in rows]
+
+    def row_values(self, row, **kwargs):
+        if len(self.parts) == 1:
+            return self.base.row_values(row, **kwargs)
+        seg = self._segments(row, row)
+        if not seg:
+            return []
+        i, p, _, _ = seg[0]
+        return self.parts[i][0].row_values(p, **kwargs)
+
+    def col_values(self, col, **kwargs):
+        if len(self.parts) == 1:
+            return self.base.col_values(col, **kwargs)
+        letter = col_to_letters(col)
+        values = [r[0] if r else "" for r in self.get(f"{letter}:{letter}")]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def data_rows(self):
+        """Number of data rows in the logical table: sealed partitions from the manifest, plus one column read."""
+        sealed = sum(n for _, n in self.parts[:-1])
+        self._active_rows = max(len(self.active.col_values(1)) - 1, 0)
+        return sealed + self._active_rows
+
+    # --- writes -------------------------------------------------------------
+    def _write_rows(self, r1, c1, values, write):
+        """Route a block of rows starting at logical row r1 to the partitions holding them."""
+        done = 0
+        for i, p1, p2, _ in self._segments(r1, r1 + len(values) - 1):
+            n = len(values) - done if p2 is None else p2 - p1 + 1
+            write(i, f"{c1}{p1}", values[done:done + n])
+            done += n
+        if r1 == 1 and values:
+            for i in range(1, len(self.parts)):  # header row: every partition has its own copy
+                write(i, f"{c1}1", values[:1])
+
+    def update(self, values=None, range_name=None, **kwargs):
+        # gspread 6 accepts (values, range_name) positionally or by keyword
+        if isinstance(values, str) and not isinstance(range_name, str):
+            values, range_name = range_name, values
+        if len(self.parts) == 1:
+            return self.base.update(values=values, range_name=range_name, **kwargs)
+        c1, r1, _, _ = _parse(range_name or "A1")
+        out = []
+        self._write_rows(r1, c1 or "A", values or [],
+                         lambda i, rng, vals: out.append(self.parts[i][0].update(values=vals, range_name=rng, **kwargs)))
+        return out[0] if len(out) == 1 else {"responses": out}
+
+    def update_cell(self, row, col, value):
+        if len(self.parts) == 1:
+            return self.base.update_cell(row, col, value)
+        return self.update(values=[[value]], range_name=f"{col_to_letters(col)}{row}")
+
+    def batch_update(self, data, **kwargs):
+        if len(self.parts) == 1:
+            return self.base.batch_update(data, **kwargs)
+        per = {}
+        for item in data:
+            c1, r1, _, _ = _parse(item["range"])
+            self._write_rows(r1, c1 or "A", item["values"],
+                             lambda i, rng, vals: per.setdefault(i, []).append({"range": rng, "values": vals}))
+        out = [self.parts[i][0].batch_update(items, **kwargs) for i, items in sorted(per.items())]
+        return out[0] if len(out) == 1 else {"responses": out}
+
+    def add_cols(self, cols):
+        for ws in self.partitions:
+            ws.add_cols(cols)
+
+    def delete_columns(self, start_index, end_index=None):
+        for ws in self.partitions:
+            ws.delete_columns(start_index, end_index)
+
+    # --- appends and rollover ----------------------------------------------
+    def _grow(self, n_rows):
+        """Add row capacity ahead of an append, in PARTITION_GROW_ROWS steps."""
+        ws = self.active
+        if self._active_rows is None or self._active_rows + 1 + n_rows <= ws.row_count:
+            return
+        try:
+            ws.add_rows(max(n_rows, PARTITION_GROW_ROWS))
+        except Exception:
+            pass  # resize denied: the append extends the grid itself
+
+    def _roll_over(self):
+        """Seal the active partition and start the next one (or adopt one another process started)."""
+        n_parts = len(self.parts)
+        self.refresh()
+        if len(self.parts) != n_parts:
+            return
+        sealed, n = self.active, self._active_rows
+        title = partition_title(self.title, n_parts)
+        headers = self.headers or self.base.row_values(1)
+        try:
+            new = self.spreadsheet.add_worksheet(title=title, rows=self.rows_per_partition + 1,
+                                                 cols=max(len(headers), 1))
+        except Exception:
+            new = self.spreadsheet.worksheet(title)  # left over by a writer that failed mid-rollover
+        new.update(range_name="A1", values=[headers])
+        self.parts = self.parts[:-1] + [[sealed, n], [new, None]]
+        self._active_rows = 0
+        self._write_manifest()
+        try:
+            sealed.resize(rows=n + 1)  # give the unused grid cells back to the spreadsheet
+        except Exception:
+            pass
+
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        """
+        Append to the active partition, rolling over as it fills. With more
+        than one partition the response is in logical rows: updatedRange when
+        the rows are contiguous, and always appendedRows, the logical row of
+        every appended row (None where the sheet did not say).
+        """
+        values = [list(r) for r in values]
+        with self.lock:
+            written, resp = [], None
+            while values:
+                if self._active_rows is not None and self._active_rows + len(values) > self.rows_per_partition:
+                    if self._active_rows >= self.rows_per_partition:
+                        self._roll_over()
+                    else:
+                        self.refresh()  # close to full: another process may have rolled over already
+                room = len(values) if self._active_rows is None else self.rows_per_partition - self._active_rows
+                chunk, values = values[:room], values[room:]
+                self._grow(len(chunk))
+                i = len(self.parts) - 1
+                resp = self.active.append_rows(chunk, value_input_option=value_input_option, **kwargs)
+                span = appended_rows(resp)
+                if span is None:
+                    self._active_rows = None
+                    written += [None] * len(chunk)
+                    continue
+                self._active_rows = span[1] - 1
+                if self._active_rows > self.rows_per_partition:
+                    written += self._rehome(i, span, chunk, value_input_option, **kwargs)
+                else:
+                    written += [r + self._offset(i) for r in range(span[0], span[1] + 1)]
+            if len(self.parts) == 1 or resp is None:
+                return resp
+            return self._logical_response(written)
+
+    def _rehome(self, i, span, chunk, value_input_option, **kwargs):
+        """
+        Move rows appended to a partition that another process had sealed to the
+        active one. Returns the logical row of every row of `chunk`, wherever it
+        ended up (None for moved rows the sheet did not place).
+        """
+        self.refresh()
+        n = self.parts[i][1]
+        offset = self._offset(i)
+        if n is None or span[1] - 1 <= n:
+            return [r + offset for r in range(span[0], span[1] + 1)]
+        stray = max(span[0], n + 2)
+        kept = [r + offset for r in range(span[0], stray)]
+        rows = chunk[stray - span[0]:]
+        self.parts[i][0].batch_update([{"range": f"A{stray}:{col_to_letters(max(len(r) for r in rows))}{span[1]}",
+                                        "values": [[""] * len(r) for r in rows]}])
+        moved = appended_rows(self.active.append_rows(rows, value_input_option=value_input_option, **kwargs))
+        if moved is None:
+            self._active_rows = None
+            return kept + [None] * len(rows)
+        self._active_rows = moved[1] - 1
+        offset = self._offset(len(self.parts) - 1)
+        return kept + [r + offset for r in range(moved[0], moved[1] + 1)]
+
+    def _logical_response(self, written):
+        updates = {"updatedRows": sum(r is not None for r in written), "appendedRows": written}
+        if written and None not in written and all(b == a + 1 for a, b in zip(written, written[1:])):
+            last_col = col_to_letters(max(len(self.headers or []), 1))
+            updates["updatedRange"] = f"{self.title}!A{written[0]}:{last_col}{written[-1]}"
+        return {"updates": updates}
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        return self.append_rows([values], value_input_option=value_input_option, **kwargs)
+
+def open_partitioned(spreadsheet, title, n_cols):
+    """Logical label table for worksheet `title` (created if missing) and its partitions."""
+    sheets = {ws.title: ws for ws in spreadsheet.worksheets()}
+    base = sheets.get(title)
+    if base is None:
+        base = spreadsheet.add_worksheet(title=title, rows=1000, cols=max(26, n_cols))
+    pws = PartitionedWorksheet(spreadsheet, base)
+    pws.manifest = sheets.get(manifest_title(title))
+    if pws.manifest is not None:
+        pws._load_manifest(sheets)
+    return pws
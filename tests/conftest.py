@@ -0,0 +1,40 @@
+import os, sys, tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LABELER_DATA_DIR", tempfile.mkdtemp(prefix="labeler-tests-"))
+
+from label_store import LabelStore, StoreSpool
+from local_sheet import LocalSpreadsheet
+from write_queue import AppendQueue
+
+@pytest.fixture
+def make_sheet():
+    def make(headers, rows=()):
+        """In-memory worksheet with a header row and optional data rows."""
+        ws = LocalSpreadsheet("test").add_worksheet("labels_log", 100, len(headers))
+        ws.update(range_name="A1", values=[list(headers)])
+        if rows:
+            ws.append_rows([list(r) for r in rows])
+        return ws
+    return make
+
+@pytest.fixture
+def store(tmp_path):
+    return LabelStore(tmp_path / "labels.sqlite3")
+
+@pytest.fixture
+def make_queue(store):
+    queues = []
+
+    def make(ws, **kwargs):
+        kwargs.setdefault("max_delay", 0)
+        kwargs.setdefault("writes_per_minute", 60000)
+        q = AppendQueue(ws, StoreSpool(store, "sheet"), **kwargs)
+        queues.append(q)
+        return q
+
+    yield make
+    for q in queues:
+        q.close(timeout=1)
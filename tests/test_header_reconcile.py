@@ -0,0 +1,61 @@
+import pytest
+
+from header_reconcile import plan_headers
+
+def apply(headers, steps):
+    """Replay plan_headers steps the way the Sheets API applies them."""
+    headers = list(headers)
+    for step in steps:
+        if step[0] == "rename":
+            _, i, old, new = step
+            assert headers[i] == old
+            headers[i] = new
+        elif step[0] == "delete":
+            headers.pop(step[1])
+        elif step[0] == "move":  # moveDimension: dest is the index before the move
+            _, i, dest = step
+            h = headers.pop(i)
+            headers.insert(dest - 1 if dest > i else dest, h)
+        elif step[0] == "insert":
+            headers.insert(step[1], step[2])
+    return headers
+
+TARGET = ["video_id", "rater_id", "emotion", "notes"]
+
+@pytest.mark.parametrize("current", [
+    TARGET,
+    ["video_id", "rater_id", "emotion"],                     # new column at the end
+    ["video_id", "emotion", "notes"],                        # new column in the middle
+    ["Video ID", "rater_id", "emotion", "notes"],            # legacy name
+    ["Video ID", "Video_Name", "rater_id", "emotion"],       # legacy name and dropped column
+    ["notes", "emotion", "rater_id", "video_id"],            # reversed
+    ["rater_id", "video_id", "old_field", "emotion"],        # reordered, plus a column the schema lost
+    [],
+])
+def test_steps_reach_the_final_header_row(current):
+    steps, final = plan_headers(current, TARGET)
+    assert final[: len(TARGET)] == TARGET
+    moved = apply(current, steps)
+    assert moved == final[: len(moved)]  # columns past the end come with the header row write
+
+def test_matching_headers_need_no_steps():
+    assert plan_headers(TARGET, TARGET) == ([], TARGET)
+
+def test_rename_keeps_the_column_in_place():
+    steps, final = plan_headers(["Video ID", "rater_id", "emotion", "notes"], TARGET)
+    assert steps == [("rename", 0, "Video ID", "video_id")]
+    assert final == TARGET
+
+def test_appended_columns_need_no_insert():
+    steps, final = plan_headers(["video_id", "rater_id"], TARGET)
+    assert steps == [] and final == TARGET
+
+def test_insert_in_the_middle_shifts_the_rest():
+    steps, _ = plan_headers(["video_id", "emotion", "notes"], TARGET)
+    assert steps == [("insert", 1, "rater_id")]
+
+def test_columns_the_schema_lost_are_kept_at_the_end():
+    steps, final = plan_headers(["video_id", "old_field", "rater_id", "emotion", "notes"], TARGET)
+    assert final == TARGET + ["old_field"]
+    assert apply(["video_id", "old_field", "rater_id", "emotion", "notes"], steps) == final
+    assert len(steps) == 1  # one move, not one per column
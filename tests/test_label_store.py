@@ -0,0 +1,57 @@
+import time
+
+from label_store import LabelStore
+
+def test_ack_confirms_rows_and_releases_the_claim(store):
+    a, b = store.add("k", [["c1", "happy"], ["c2", "sad"]])
+    batch = store.claim("k", "w1")
+    assert batch == [(a, ["c1", "happy"]), (b, ["c2", "sad"])]
+
+    store.ack("k", batch, [2, None])  # the second row landed somewhere the response didn't say
+    assert store.pending("k") == [] and store.count_unsynced("k") == 0
+    rec = store.get(b)
+    assert rec["sheet_row"] is None and rec["synced_row"] == ["c2", "sad"] and rec["claimed_by"] is None
+    store.locate(b, 3)
+    assert store.get(b)["sheet_row"] == 3
+    store.locate(b, 7)  # a row it already has is kept
+    assert store.get(b)["sheet_row"] == 3
+
+def test_edit_during_append_is_pushed_afterwards(store):
+    [seq] = store.add("k", [["c1", "happy"]])
+    batch = store.claim("k", "w1")
+    store.update(seq, ["c1", "sad"])
+    store.ack("k", batch, [2])
+
+    assert store.pending("k") == []
+    assert store.changed("k") == [(seq, 2, ["c1", "sad"], ["c1", "happy"])]
+    store.ack_changed([(seq, ["c1", "sad"])])
+    assert store.changed("k") == [] and store.count_unsynced("k") == 0
+
+def test_claimed_rows_are_skipped_by_other_engines(store):
+    store.add("k", [["c1"], ["c2"], ["c3"]])
+    first = store.claim("k", "w1", limit=2)
+    assert [r for _, r in first] == [["c1"], ["c2"]]
+    assert [r for _, r in store.claim("k", "w2")] == [["c3"]]
+    assert store.claim("k", "w1") == first  # its own claims come back (e.g. after a failed append)
+    assert store.claim("k", "w3") == []
+
+def test_stale_claim_can_be_taken_over(tmp_path):
+    store = LabelStore(tmp_path / "labels.sqlite3")
+    store.add("k", [["c1"]])
+    store.claim("k", "dead", ttl=60)
+    assert store.claim("k", "w2", ttl=60) == []
+    time.sleep(0.05)
+    assert [r for _, r in store.claim("k", "w2", ttl=0.01)] == [["c1"]]
+
+def test_park_and_retry(store):
+    a, b = store.add("k", [["c1"], ["c2"]])
+    store.claim("k", "w1")
+    store.park([a], "APIError: 403")
+
+    assert store.parked("k") == (1, "APIError: 403")
+    assert store.pending("k") == [(b, ["c2"])] and store.count_unsynced("k") == 1
+    assert store.claim("k", "w2") == []  # b is still w1's; a is on hold
+
+    store.retry_parked("k")
+    assert store.parked("k") == (0, None)
+    assert store.claim("k", "w2") == [(a, ["c1"])]  # released by the retry, unlike b
@@ -0,0 +1,38 @@
+from label_index import LabelIndex
+from label_upsert import find_record, save_label, upsert_possible
+
+def test_upsert_needs_rater_column_with_several_raters_per_clip():
+    assert upsert_possible(["video_id", "emotion"], raters_per_clip=1)
+    assert not upsert_possible(["video_id", "emotion"], raters_per_clip=2)
+    assert upsert_possible(["video_id", "rater_id", "emotion"], raters_per_clip=2)
+
+def test_two_raters_on_one_clip_without_rater_column_keep_their_own_rows(make_sheet, make_queue):
+    columns = ["video_id", "emotion"]
+    ws = make_sheet(columns)
+    q = make_queue(ws)
+    index = LabelIndex(ws)
+    index.load()
+    upsert = upsert_possible(columns, raters_per_clip=2)
+
+    save_label(q, ws, index, columns, ["c1", "happy"], "c1", upsert=upsert)
+    assert q.flush(5)
+    save_label(q, ws, index, columns, ["c1", "sad"], "c1", upsert=upsert)
+    assert q.flush(5)
+
+    assert ws.get_all_values()[1:] == [["c1", "happy"], ["c1", "sad"]]
+
+def test_two_raters_on_one_clip_with_rater_column_upsert_their_own_rows(make_sheet, make_queue):
+    columns = ["video_id", "rater_id", "emotion"]
+    ws = make_sheet(columns)
+    q = make_queue(ws)
+    index = LabelIndex(ws, id_col=1, rater_col=2)
+    index.load()
+
+    save_label(q, ws, index, columns, ["c1", "alice", "happy"], "c1")
+    assert q.flush(5)
+    assert find_record(q.spool, ws, index, columns, "c1", "bob") is None  # bob sees no pre-filled answers
+    save_label(q, ws, index, columns, ["c1", "bob", "sad"], "c1")
+    save_label(q, ws, index, columns, ["c1", "alice", "angry"], "c1")
+    assert q.flush(5)
+
+    assert ws.get_all_values()[1:] == [["c1", "alice", "angry"], ["c1", "bob", "sad"]]
@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+
+import pytest
+
+from write_queue import appended_row_numbers, is_transient, locate_rows
+
+class HTTPError(Exception):
+    """Stand-in for gspread's APIError / requests' HTTPError: carries a response."""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = SimpleNamespace(status_code=status_code, headers={})
+
+class TransportError(Exception):
+    """Same name as google.auth.exceptions.TransportError (token refresh failed)."""
+
+class Reformatting:
+    """Worksheet whose appends answer without a range and store values the way USER_ENTERED parses them."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.appends = 0
+        self.fail = []  # exceptions to raise on the next appends, in order
+
+    def __getattr__(self, name):
+        return getattr(self.ws, name)
+
+    def append_rows(self, values, **kwargs):
+        self.appends += 1
+        if self.fail:
+            raise self.fail.pop(0)
+        self.ws.append_rows([[v.lstrip("0") or "0" if v.isdigit() else v for v in row] for row in values])
+        return {}
+
+@pytest.mark.parametrize("exc, transient", [
+    (HTTPError(429), True),
+    (HTTPError(500), True),
+    (HTTPError(503), True),
+    (HTTPError(400), False),
+    (HTTPError(403), False),
+    (HTTPError(404), False),
+    (ConnectionResetError(), True),
+    (TimeoutError(), True),
+    (TransportError("token refresh failed"), True),
+    (ValueError("bad row"), False),
+])
+def test_is_transient(exc, transient):
+    assert is_transient(exc) is transient
+
+def test_appended_row_numbers():
+    resp = {"updates": {"updatedRange": "labels_log!A5:C7", "updatedRows": 3}}
+    assert appended_row_numbers(resp, 3) == [5, 6, 7]
+    assert appended_row_numbers({"updates": {"appendedRows": [9, 4]}}, 2) == [9, 4]
+    assert appended_row_numbers({}, 2) == [None, None]
+    assert appended_row_numbers(None, 1) == [None]
+
+def test_locate_rows_takes_the_newest_unclaimed_match(make_sheet):
+    ws = make_sheet(["video_id", "rater_id", "emotion"],
+                    [["c1", "alice", "happy"], ["c2", "alice", "sad"], ["c1", "alice", "angry"], ["c1", "bob", "sad"]])
+    rows = [["c1", "alice", "x"], ["c1", "alice", "y"], ["c1", "bob", "z"]]
+    assert locate_rows(ws, rows, [None, None, None], [1, 2]) == [2, 4, 5]
+    assert locate_rows(ws, rows, [None, 4, None], [1, 2]) == [2, 4, 5]
+
+def test_locate_rows_leaves_a_reformatted_row_unknown(make_sheet):
+    ws = make_sheet(["video_id", "emotion"], [["c1", "happy"], ["42", "sad"]])
+    assert locate_rows(ws, [["c1", "happy"], ["0042", "sad"]], [None, None], [1]) == [2, None]
+
+def test_reformatted_append_is_confirmed_once(make_sheet, make_queue, store):
+    ws = Reformatting(make_sheet(["video_id", "emotion"]))
+    q = make_queue(ws)
+    q.submit(["c1", "happy"], video_id="c1")
+    q.submit(["0042", "sad"], video_id="0042")
+    assert q.flush(5)
+
+    assert ws.get_all_values()[1:] == [["c1", "happy"], ["42", "sad"]]
+    assert ws.appends == 1
+    [c1], [odd] = store.records_for("sheet", "c1"), store.records_for("sheet", "0042")
+    assert c1["sheet_row"] == 2
+    assert odd["sheet_row"] is None and odd["synced_row"] == ["0042", "sad"]
+
+def test_permanent_error_parks_the_batch_until_retried(make_sheet, make_queue):
+    ws = Reformatting(make_sheet(["video_id", "emotion"]))
+    ws.fail = [HTTPError(403)]
+    q = make_queue(ws)
+    q.submit(["c1", "happy"], video_id="c1")
+    assert q.flush(5)  # parked rows no longer count as pending
+
+    assert q.stats()["parked"] == 1 and "403" in q.stats()["parked_error"]
+    assert ws.get_all_values()[1:] == []
+    q.retry_parked()
+    assert q.flush(5)
+    assert q.stats()["parked"] == 0
+    assert ws.get_all_values()[1:] == [["c1", "happy"]]
+    assert ws.appends == 2
+
+def test_transient_error_is_retried(make_sheet, make_queue, monkeypatch):
+    monkeypatch.setattr("write_queue.retry_delay", lambda exc, attempt, bucket: 0)
+    ws = Reformatting(make_sheet(["video_id", "emotion"]))
+    ws.fail = [HTTPError(503), ConnectionResetError()]
+    q = make_queue(ws)
+    q.submit(["c1", "happy"], video_id="c1")
+    assert q.flush(5)
+
+    assert ws.get_all_values()[1:] == [["c1", "happy"]]
+    assert q.retries == 2 and q.stats()["parked"] == 0
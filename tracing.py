@@ -0,0 +1,267 @@
+"""
+Lightweight per-rerun tracing: timing spans for the app's hot path and call
+counters for every Sheets API call made through gsheets_client.
+
+Off unless LABELER_TRACE=1. When off, span() hands back one shared no-op
+context manager and traced() returns its argument unchanged, so the cost is a
+flag check per call site.
+
+Each finished rerun becomes one JSONL record in .labeler/traces/trace.jsonl
+(rotated at TRACE_LOG_MAX_MB, TRACE_LOG_BACKUPS files kept):
+
+    {"kind": "rerun", "session": "...", "ts": ..., "wall_ms": 41.2,
+     "spans": {"connect": [1, 0.4, 0], ...},       # name -> [count, total ms, bytes]
+     "api":   {"row_values": [1, 120.3, 812], ...}}  # method -> [count, total ms, bytes]
+
+API calls made outside a rerun (the append queue's writer thread) are
+collected under kind "background" and logged alongside the next rerun.
+
+`python tracing.py [trace.jsonl ...]` prints p50/p95 summaries of a log.
+"""
+import os, sys, json, math, time, threading, contextlib
+from collections import deque
+
+from app_paths import data_dir
+
+ENABLED = os.getenv("LABELER_TRACE", "").strip().lower() in ("1", "true", "yes", "on")
+LOG_MAX_BYTES = int(float(os.getenv("TRACE_LOG_MAX_MB", "5")) * 1024 * 1024)
+LOG_BACKUPS = int(os.getenv("TRACE_LOG_BACKUPS", "3"))
+
+_NULL = contextlib.nullcontext()
+_local = threading.local()
+_LOCK = threading.Lock()
+_RECENT = deque(maxlen=500)   # finished records, newest last, for in-app summaries
+_logger = None
+
+# -----------------------------------------------------------------------------
+# Records
+# -----------------------------------------------------------------------------
+class Trace:
+    """Spans and API calls of one rerun (or of background work between reruns)."""
+
+    def __init__(self, kind, session=None):
+        self.kind = kind
+        self.session = session
+        self.ts = time.time()
+        self.started = self.last = time.perf_counter()
+        self.spans = {}
+        self.api = {}
+        self.lock = threading.Lock()
+
+    def add(self, table, name, ms, nbytes=0):
+        with self.lock:
+            entry = table.setdefault(name, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += ms
+            entry[2] += nbytes
+            self.last = time.perf_counter()
+
+    def record(self):
+        with self.lock:
+            return {
+                "kind": self.kind, "session": self.session, "ts": round(self.ts, 3),
+                "wall_ms": round((self.last - self.started) * 1000, 2),
+                "spans": {k: [n, round(ms, 2), b] for k, (n, ms, b) in self.spans.items()},
+                "api": {k: [n, round(ms, 2), b] for k, (n, ms, b) in self.api.items()},
+            }
+
+_BACKGROUND = Trace("background")
+
+def _current():
+    return getattr(_local, "trace", None)
+
+class _Span:
+    __slots__ = ("name", "bytes", "_t0")
+
+    def __init__(self, name, nbytes):
+        self.name = name
+        self.bytes = nbytes
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        trace = _current()
+        if trace is not None:
+            trace.add(trace.spans, self.name, (time.perf_counter() - self._t0) * 1000, self.bytes)
+        return False
+
+def span(name, nbytes=0):
+    """Time a block of the current rerun. Set `.bytes` on the result to record a payload size."""
+    if not ENABLED:
+        return _NULL
+    return _Span(name, nbytes)
+
+# -----------------------------------------------------------------------------
+# Rerun lifecycle
+# -----------------------------------------------------------------------------
+def begin_rerun(state, session, kind="rerun"):
+    """
+    Start tracing this rerun (kind "fragment" for a fragment-only rerun) and
+    finish the previous one of the same session.
+
+    A rerun can end in st.stop() or st.rerun(), so rather than relying on
+    reaching the end of the script, each rerun is closed by the next one; its
+    wall time runs up to the end of its last span or API call.
+    Returns the finished record of the previous rerun (or None).
+    """
+    if not ENABLED:
+        return None
+    prev = state.get("_trace")
+    finished = _finish(prev, state) if prev is not None else None
+    trace = Trace(kind, session)
+    state["_trace"] = trace
+    _local.trace = trace
+    return finished
+
+def _finish(trace, state):
+    global _BACKGROUND
+    rec = trace.record()
+    totals = state.setdefault("_trace_totals", {"reruns": 0, "spans": {}, "api": {}})
+    totals["reruns"] += 1
+    for table in ("spans", "api"):
+        for name, (n, ms, b) in rec[table].items():
+            t = totals[table].setdefault(name, [0, 0.0, 0])
+            t[0] += n
+            t[1] += ms
+            t[2] += b
+    with _LOCK:
+        background, _BACKGROUND = _BACKGROUND, Trace("background")
+    out = [rec]
+    if background.api:
+        out.append(background.record())
+    for r in out:
+        _RECENT.append(r)
+        _log(r)
+    return rec
+
+def _log(rec):
+    global _logger
+    try:
+        if _logger is None:
+            import logging
+            from logging.handlers import RotatingFileHandler
+
+            logger = logging.getLogger("labeler.trace")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handler = RotatingFileHandler(str(data_dir("traces") / "trace.jsonl"),
+                                          maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            _logger = logger
+        _logger.info(json.dumps(rec))
+    except OSError:
+        pass  # tracing must never break the app
+
+def recent():
+    return list(_RECENT)
+
+# -----------------------------------------------------------------------------
+# Sheets API proxy
+# -----------------------------------------------------------------------------
+def _size(obj):
+    try:
+        return len(json.dumps(obj, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+class _Traced:
+    """Times and sizes every method call on a gspread (or local_sheet) object."""
+
+    _WRAP_RESULTS = {"open_by_key", "open", "worksheet", "add_worksheet", "worksheets"}
+
+    def __init__(self, target):
+        object.__setattr__(self, "_target", target)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            t0 = time.perf_counter()
+            result = None
+            try:
+                result = attr(*args, **kwargs)
+            finally:
+                ms = (time.perf_counter() - t0) * 1000
+                nbytes = _size([args, kwargs]) + (0 if name in self._WRAP_RESULTS else _size(result))
+                trace = _current() or _BACKGROUND
+                trace.add(trace.api, name, ms, nbytes)
+            if name in self._WRAP_RESULTS:
+                return [_Traced(r) for r in result] if isinstance(result, list) else _Traced(result)
+            return result
+
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+def traced(obj):
+    """Wrap a client/spreadsheet/worksheet so its API calls are counted (no-op when disabled)."""
+    return _Traced(obj) if ENABLED else obj
+
+# -----------------------------------------------------------------------------
+# Summaries
+# -----------------------------------------------------------------------------
+def _pct(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]  # nearest rank
+
+def summarize(records):
+    """p50/p95 of full-rerun and fragment-rerun wall time, each span and each API method."""
+    reruns = [r for r in records if r.get("kind") == "rerun"]
+    fragments = [r for r in records if r.get("kind") == "fragment"]
+    out = {"reruns": len(reruns), "fragments": len(fragments), "wall_ms": {}, "fragment_wall_ms": {},
+           "spans": {}, "api": {}}
+    for key, recs in (("wall_ms", reruns), ("fragment_wall_ms", fragments)):
+        if recs:
+            walls = [r["wall_ms"] for r in recs]
+            out[key] = {"p50": _pct(walls, 50), "p95": _pct(walls, 95)}
+    for table in ("spans", "api"):
+        per = {}
+        for r in records:
+            for name, (n, ms, b) in r.get(table, {}).items():
+                per.setdefault(name, []).append((n, ms, b))
+        for name, rows in per.items():
+            ms = [x[1] for x in rows]
+            out[table][name] = {
+                "calls": sum(x[0] for x in rows), "bytes": sum(x[2] for x in rows),
+                "p50_ms": round(_pct(ms, 50), 2), "p95_ms": round(_pct(ms, 95), 2),
+            }
+    return out
+
+def read_log(paths=None):
+    if not paths:
+        base = str(data_dir("traces") / "trace.jsonl")
+        paths = [f"{base}.{i}" for i in range(LOG_BACKUPS, 0, -1)] + [base]
+    records = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+def main(argv=None):
+    s = summarize(read_log((argv if argv is not None else sys.argv[1:]) or None))
+    print(f"{s['reruns']} reruns · wall p50 {s['wall_ms'].get('p50', 0):.1f} ms · p95 {s['wall_ms'].get('p95', 0):.1f} ms")
+    if s["fragments"]:
+        print(f"{s['fragments']} fragment reruns · wall p50 {s['fragment_wall_ms']['p50']:.1f} ms · "
+              f"p95 {s['fragment_wall_ms']['p95']:.1f} ms")
+    for table in ("spans", "api"):
+        print(f"\n{table}:")
+        for name, m in sorted(s[table].items(), key=lambda kv: -kv[1]["p95_ms"]):
+            print(f"  {name:<24} {m['calls']:>7} calls  p50 {m['p50_ms']:>8.1f} ms  p95 {m['p95_ms']:>8.1f} ms  {m['bytes'] / 1024:>9.1f} KB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Content-addressed on-disk spool for video clips.
+
+Uploads are streamed to <data dir>/videos/<sha256[:2]>/<sha256>.mp4 in 1 MiB
+chunks, so session state only holds a small handle ({name, digest, size}) and
+identical clips uploaded by several raters are stored once. The current clip is
+passed to `st.video` as a file path. Streamlit does not serve it from disk:
+each run of the clip view reads the whole file into Streamlit's in-memory media
+store (hashing it for the media URL), which serves it from memory with HTTP
+range support. So each session holds the clip on screen in memory, not the
+whole batch, but a large clip costs a full read and hash per clip-view rerun.
+
+Files are evicted least-recently-used first (mtime is bumped on every access)
+once the spool exceeds VIDEO_SPOOL_QUOTA_MB. Unfinished files (*.part: uploads
+being copied, partial downloads) count toward the quota too, and are evicted
+like clips once abandoned; the ones being written right now are left alone.
+"""
+import os, hashlib, tempfile, threading
+from contextlib import contextmanager
+
+from app_paths import data_dir
+
+VIDEO_SPOOL_QUOTA_MB = float(os.getenv("VIDEO_SPOOL_QUOTA_MB", "4096"))
+CHUNK = 1 << 20
+
+class VideoSpool:
+    def __init__(self, root, quota_bytes):
+        self.root = str(root)
+        self.quota = int(quota_bytes)
+        self.lock = threading.Lock()
+        self.busy = set()  # paths being written (see writing())
+        os.makedirs(self.root, exist_ok=True)
+
+    @contextmanager
+    def writing(self, path):
+        """Keep `path` (an unfinished .part file) from being evicted while it is written."""
+        with self.lock:
+            self.busy.add(path)
+        try:
+            yield path
+        finally:
+            with self.lock:
+                self.busy.discard(path)
+
+    def _final_path(self, digest, suffix=".mp4"):
+        return os.path.join(self.root, digest[:2], digest + suffix)
+
+    def put_stream(self, fp, suffix=".mp4"):
+        """Copy a file-like object into the spool; returns {"digest", "path", "size"}."""
+        h = hashlib.sha256()
+        size = 0
+        if hasattr(fp, "seek"):
+            fp.seek(0)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with self.writing(tmp):
+                with os.fdopen(fd, "wb") as out:
+                    while True:
+                        chunk = fp.read(CHUNK)
+                        if not chunk:
+                            break
+                        h.update(chunk)
+                        out.write(chunk)
+                        size += len(chunk)
+                digest = h.hexdigest()
+                return self.add_file(tmp, digest, suffix) | {"size": size}
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def add_file(self, tmp_path, digest, suffix=".mp4"):
+        """Move a finished file into the spool under `digest` (dropping it if already present)."""
+        final = self._final_path(digest, suffix)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        with self.lock:
+            if os.path.exists(final):
+                os.remove(tmp_path)
+                os.utime(final)
+            else:
+                os.replace(tmp_path, final)
+        self.evict(keep={final})
+        return {"digest": digest, "path": final, "size": os.path.getsize(final)}
+
+    def path(self, digest, suffix=".mp4"):
+        """Path of a spooled clip (marking it recently used), or None if it was evicted."""
+        final = self._final_path(digest, suffix)
+        try:
+            os.utime(final)
+        except FileNotFoundError:
+            return None
+        return final
+
+    def _entries(self):
+        """(mtime, size, path) of the clips in the subdirectories and the .part files at the top."""
+        for e in os.scandir(self.root):
+            files = os.scandir(e.path) if e.is_dir() else [e] if e.name.endswith(".part") else []
+            for f in files:
+                try:
+                    st_ = f.stat()
+                except FileNotFoundError:
+                    continue  # finished or evicted meanwhile
+                if f.is_file():
+                    yield st_.st_mtime, st_.st_size, f.path
+
+    def usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep=()):
+        """Delete least-recently-used clips and abandoned .part files until the spool fits the quota."""
+        with self.lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, p in entries:
+                if total <= self.quota:
+                    break
+                if p in keep or p in self.busy:
+                    continue
+                try:
+                    os.remove(p)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+        return total
+
+_SPOOL = None
+_SPOOL_LOCK = threading.Lock()
+
+def get_video_spool():
+    """Process-wide spool for uploaded clips (shared by every session)."""
+    global _SPOOL
+    with _SPOOL_LOCK:
+        if _SPOOL is None:
+            _SPOOL = VideoSpool(data_dir("videos"), VIDEO_SPOOL_QUOTA_MB * 1024 * 1024)
+    return _SPOOL
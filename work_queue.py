@@ -0,0 +1,177 @@
+"""
+Lease-based work distribution for a playlist shared by several raters.
+
+Clips are handed out one at a time as leases that expire after LEASE_TTL
+seconds unless the rater's session heartbeats (every rerun does). Expired
+leases are reclaimed by the next acquire. Each clip is handed out until it has
+`raters_per_clip` completed ratings (set >1 for agreement studies); a rater
+never gets the same clip twice.
+
+State lives in SQLite (<data dir>/work_queue.sqlite3, or WORK_QUEUE_DB) and
+every acquire is one BEGIN IMMEDIATE transaction, so it is correct across
+Streamlit sessions in one process and across processes sharing the file.
+"""
+import os, time, hashlib, sqlite3, threading
+from contextlib import contextmanager
+
+from app_paths import data_dir
+
+LEASE_TTL = float(os.getenv("LEASE_TTL_SECONDS", "600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    playlist  TEXT NOT NULL,
+    item      TEXT NOT NULL,     -- video_id
+    pos       INTEGER NOT NULL,  -- playlist order
+    completed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (playlist, item)
+);
+CREATE INDEX IF NOT EXISTS items_open ON items (playlist, completed, pos);
+CREATE TABLE IF NOT EXISTS leases (
+    playlist TEXT NOT NULL,
+    item     TEXT NOT NULL,
+    rater    TEXT NOT NULL,
+    expires  REAL NOT NULL,
+    PRIMARY KEY (playlist, item, rater)
+);
+CREATE INDEX IF NOT EXISTS leases_rater ON leases (playlist, rater);
+CREATE TABLE IF NOT EXISTS completions (
+    playlist TEXT NOT NULL,
+    item     TEXT NOT NULL,
+    rater    TEXT NOT NULL,
+    at       REAL NOT NULL,
+    PRIMARY KEY (playlist, item, rater)
+);
+"""
+
+def playlist_key(item_ids):
+    """Stable key for a playlist: raters loading the same clips share one queue."""
+    h = hashlib.sha256()
+    for i in sorted(item_ids):
+        h.update(i.encode() + b"\0")
+    return h.hexdigest()[:16]
+
+class WorkQueue:
+    def __init__(self, path, playlist, raters_per_clip=1, lease_ttl=LEASE_TTL):
+        self.playlist = playlist
+        self.raters_per_clip = raters_per_clip
+        self.lease_ttl = lease_ttl
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _tx(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def load(self, item_ids, completed=None):
+        """Register the playlist's clips (idempotent). `completed` seeds ratings already in the sheet."""
+        completed = completed or {}
+        with self._tx() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO items (playlist, item, pos, completed) VALUES (?, ?, ?, ?)",
+                ((self.playlist, item, pos, completed.get(item, 0)) for pos, item in enumerate(item_ids)),
+            )
+
+    def acquire(self, rater, exclude=()):
+        """
+        Lease the next clip for `rater` (or renew the one they already hold).
+        Returns the clip's id, or None when nothing is left for this rater.
+        """
+        now = time.time()
+        exclude = list(exclude)
+        with self._tx() as db:
+            db.execute("DELETE FROM leases WHERE playlist = ? AND expires <= ?", (self.playlist, now))
+            held = db.execute(
+                "SELECT item FROM leases WHERE playlist = ? AND rater = ? ORDER BY expires DESC LIMIT 1",
+                (self.playlist, rater),
+            ).fetchone()
+            if held and held[0] not in exclude:
+                item = held[0]
+            else:
+                if held:
+                    db.execute("DELETE FROM leases WHERE playlist = ? AND rater = ?", (self.playlist, rater))
+                row = db.execute(
+                    f"""
+                    SELECT i.item FROM items i
+                    WHERE i.playlist = ? AND i.completed < ?
+                      AND i.completed + (SELECT COUNT(*) FROM leases l
+                                         WHERE l.playlist = i.playlist AND l.item = i.item) < ?
+                      AND NOT EXISTS (SELECT 1 FROM completions c
+                                      WHERE c.playlist = i.playlist AND c.item = i.item AND c.rater = ?)
+                      AND i.item NOT IN ({",".join("?" * len(exclude))})
+                    ORDER BY i.pos LIMIT 1
+                    """,
+                    (self.playlist, self.raters_per_clip, self.raters_per_clip, rater, *exclude),
+                ).fetchone()
+                if row is None:
+                    return None
+                item = row[0]
+            db.execute(
+                "INSERT OR REPLACE INTO leases (playlist, item, rater, expires) VALUES (?, ?, ?, ?)",
+                (self.playlist, item, rater, now + self.lease_ttl),
+            )
+        return item
+
+    def heartbeat(self, rater, item):
+        """Extend a held lease; False if it expired and was reclaimed."""
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE leases SET expires = ? WHERE playlist = ? AND item = ? AND rater = ? AND expires > ?",
+                (time.time() + self.lease_ttl, self.playlist, item, rater, time.time()),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, rater, item):
+        """Record a finished rating and drop the lease."""
+        with self._tx() as db:
+            db.execute("DELETE FROM leases WHERE playlist = ? AND item = ? AND rater = ?", (self.playlist, item, rater))
+            cur = db.execute(
+                "INSERT OR IGNORE INTO completions (playlist, item, rater, at) VALUES (?, ?, ?, ?)",
+                (self.playlist, item, rater, time.time()),
+            )
+            if cur.rowcount:
+                db.execute("UPDATE items SET completed = completed + 1 WHERE playlist = ? AND item = ?",
+                           (self.playlist, item))
+
+    def release(self, rater, item):
+        with self._tx() as db:
+            db.execute("DELETE FROM leases WHERE playlist = ? AND item = ? AND rater = ?", (self.playlist, item, rater))
+
+    def progress(self):
+        with self.lock:
+            total, done = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(completed >= ?), 0) FROM items WHERE playlist = ?",
+                (self.raters_per_clip, self.playlist),
+            ).fetchone()
+            active = self.conn.execute(
+                "SELECT COUNT(*) FROM leases WHERE playlist = ? AND expires > ?", (self.playlist, time.time())
+            ).fetchone()[0]
+        return {"total": total, "done": done, "leased": active}
+
+_QUEUES = {}
+_QUEUES_LOCK = threading.Lock()
+
+def get_work_queue(item_ids, raters_per_clip=1, completed=None):
+    """
+    Process-wide WorkQueue for a playlist, registering its clips on first use.
+    `completed` is a callable returning {video_id: ratings already done}; it is
+    only called then.
+    """
+    key = (playlist_key(item_ids), raters_per_clip)
+    with _QUEUES_LOCK:
+        wq = _QUEUES.get(key)
+        if wq is None:
+            path = os.getenv("WORK_QUEUE_DB") or data_dir() / "work_queue.sqlite3"
+            wq = WorkQueue(path, key[0], raters_per_clip)
+            wq.load(item_ids, completed() if completed else None)
+            _QUEUES[key] = wq
+    return wq
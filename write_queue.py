@@ -0,0 +1,333 @@
+"""
+Write-behind append queue for label rows.
+
+Submit returns as soon as the row is on the local spool. One background thread
+per worksheet (shared by all sessions in the process) coalesces pending rows
+into `append_rows` batches, throttled to the Sheets write quota. Quota (429),
+server (5xx) and network errors are retried with exponential backoff + jitter;
+any other error (bad range, no permission, deleted sheet, rejected values)
+would fail the same way every time, so the batch is parked instead: it stays
+in the store, out of the way of later rows, until retry_parked(). Rows stay on
+the spool until Google confirms them, so a crash or restart replays them
+instead of losing them. Each batch is claimed in the store before it is sent,
+so queues of several processes sharing the store never send the same rows.
+
+The spool is label_store.StoreSpool, which keeps rows in the local SQLite
+store; edits to rows already in the sheet are pushed as cell updates via
+`batch_update`.
+
+`ws` only needs `append_rows(values, value_input_option=...)` (plus
+`batch_update` for edits, and `batch_get` to find appended rows when the
+response has no updatedRange), so local_sheet.LocalWorksheet or any in-memory
+stand-in works for tests.
+"""
+import os, re, time, uuid, random, atexit, threading
+
+from label_store import StoreSpool, get_label_store, sheet_key
+from local_sheet import col_to_letters
+
+BATCH_SIZE = int(os.getenv("APPEND_BATCH_SIZE", "50"))
+MAX_DELAY = float(os.getenv("APPEND_MAX_DELAY", "2.0"))          # seconds a row may wait for a batch
+WRITES_PER_MINUTE = float(os.getenv("SHEETS_WRITES_PER_MINUTE", "50"))  # quota is 60/min/user
+MAX_BACKOFF = 64.0
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate_per_minute` tokens, bursting up to `capacity`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate_per_minute / 10.0))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, n=1):
+        """Block until `n` tokens are available, then take them."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """Empty the bucket, e.g. after the server reports the quota is spent."""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+_A1_ROWS = re.compile(r"[A-Z]*(\d+)(?::[A-Z]*(\d+))?$")
+
+def appended_rows(response):
+    """(first_row, last_row) written by an append, from its updatedRange, or None."""
+    try:
+        rng = response["updates"]["updatedRange"]  # e.g. "labels_log!A57:K58"
+    except (KeyError, TypeError):
+        return None
+    m = _A1_ROWS.search(rng.split("!")[-1])
+    if not m:
+        return None
+    first = int(m.group(1))
+    return first, int(m.group(2) or first)
+
+def appended_row_numbers(response, n):
+    """
+    Sheet row of each of the n rows an append wrote (None where unknown), from
+    appendedRows when a sheet_partitions.PartitionedWorksheet split the rows
+    over partitions, else from updatedRange.
+    """
+    try:
+        rows = list(response["updates"]["appendedRows"])[:n]
+    except (KeyError, TypeError):
+        span = appended_rows(response)
+        rows = list(range(span[0], span[1] + 1))[:n] if span else []
+    return rows + [None] * (n - len(rows))
+
+def locate_rows(ws, rows, sheet_rows, key_cols):
+    """
+    Fill in the unknown entries of `sheet_rows` by finding each row's key
+    (the values in the 1-based `key_cols`: video_id, and rater_id when the
+    sheet has one) in the sheet with one read. A row takes the newest match
+    not claimed by another row of the batch; rows not found stay None.
+    """
+    fetched = ws.batch_get([f"{col_to_letters(c)}:{col_to_letters(c)}" for c in key_cols])
+    n = max((len(v) for v in fetched), default=0)
+    columns = [[r[0] if r else "" for r in v] + [""] * (n - len(v)) for v in fetched]
+    found = {}
+    for r in range(2, n + 1):
+        found.setdefault(tuple(col[r - 1] for col in columns), []).append(r)
+    claimed = {r for r in sheet_rows if r}
+    out = list(sheet_rows)
+    for k in reversed(range(len(rows))):
+        if out[k] is not None:
+            continue
+        key = tuple(str(rows[k][c - 1]) if c <= len(rows[k]) else "" for c in key_cols)
+        candidates = [r for r in found.get(key, ()) if r not in claimed]
+        if candidates:
+            out[k] = candidates[-1]
+            claimed.add(out[k])
+    return out
+
+def cell_updates(sheet_row, old, new):
+    """batch_update entries covering only the cells of `new` that differ from `old`, one per contiguous run."""
+    data, run = [], None
+    for j in range(len(new) + 1):
+        differs = j < len(new) and (old[j] if j < len(old) else "") != new[j]
+        if differs and run is None:
+            run = j
+        elif not differs and run is not None:
+            rng = f"{col_to_letters(run + 1)}{sheet_row}:{col_to_letters(j)}{sheet_row}"
+            data.append({"range": rng, "values": [new[run:j]]})
+            run = None
+    return data
+
+def _status_code(exc):
+    resp = getattr(exc, "response", None)
+    return getattr(resp, "status_code", None)
+
+def _retry_after(exc):
+    resp = getattr(exc, "response", None)
+    try:
+        return float(resp.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def is_transient(exc):
+    """True for errors worth retrying: 429, 5xx, and failures to reach the server at all."""
+    code = _status_code(exc)
+    if code is not None:
+        return code == 429 or code >= 500
+    # requests' ConnectionError/Timeout are OSErrors; google-auth wraps token refresh failures
+    return isinstance(exc, OSError) or type(exc).__name__ == "TransportError"
+
+def retry_delay(exc, attempt, bucket):
+    """
+    Seconds to wait before retry number `attempt` (1-based): full-jitter
+    exponential backoff, and on 429 at least Retry-After (or one quota token),
+    with the bucket drained so other writers back off too.
+    """
+    delay = random.uniform(0, min(MAX_BACKOFF, 2 ** attempt))
+    if _status_code(exc) == 429:
+        bucket.drain()
+        delay = max(delay, _retry_after(exc) or 1.0 / bucket.rate)
+    return delay
+
+class AppendQueue:
+    """
+    Background writer draining a spool into a worksheet with append_rows.
+    `on_flushed(batch, sheet_rows, response)` is called after every confirmed
+    append, with the sheet row of each (seq, row) in the batch (None where it
+    is unknown; the row is confirmed all the same and never appended twice).
+    """
+
+    def __init__(self, ws, spool, batch_size=BATCH_SIZE, max_delay=MAX_DELAY,
+                 writes_per_minute=WRITES_PER_MINUTE, on_flushed=None, key_cols=(1,)):
+        self.ws = ws
+        self.spool = spool
+        self.key_cols = list(key_cols)  # columns identifying a row, to find it when an append doesn't say where
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(writes_per_minute)
+        self.on_flushed = on_flushed
+        self.owner = uuid.uuid4().hex  # claims this queue's batches in a store shared with other processes
+        self.flushed = 0
+        self.retries = 0
+        self.last_error = None
+        self._oldest = time.monotonic() if len(spool) else None  # replayed rows go out right away
+        self._wake = threading.Event()
+        self._idle = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="sheets-append-queue", daemon=True)
+        self._thread.start()
+
+    def submit(self, row, video_id=None, session_id=None):
+        """Spool a row for writing; returns its sequence number without touching the network."""
+        seq = self.spool.add([row], video_id=video_id, session_id=session_id)[0]
+        self.notify()
+        return seq
+
+    def notify(self):
+        """Tell the writer the spool changed (new row, or an edit made directly in the store)."""
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if len(self.spool) >= self.batch_size:
+            self._wake.set()
+
+    def stats(self):
+        parked, parked_error = self.spool.parked()
+        return {"pending": len(self.spool), "flushed": self.flushed, "retries": self.retries,
+                "last_error": self.last_error, "parked": parked, "parked_error": parked_error}
+
+    def retry_parked(self):
+        """Queue the parked rows again (e.g. after sharing the sheet with the service account)."""
+        self.spool.retry_parked()
+        self.notify()
+        self._wake.set()
+
+    def flush(self, timeout=None):
+        """Ask for an immediate write and wait until the spool is empty. Returns True if it is."""
+        self._oldest = time.monotonic() - self.max_delay
+        self._wake.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while len(self.spool):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining if remaining is not None else 1.0)
+        return True
+
+    def close(self, timeout=5.0):
+        self.flush(timeout)
+        self._stop = True
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _due(self):
+        n = len(self.spool)
+        if n == 0:
+            return False
+        if n >= self.batch_size:
+            return True
+        return self._oldest is not None and time.monotonic() - self._oldest >= self.max_delay
+
+    def _run(self):
+        attempt = 0
+        while not self._stop:
+            if not self._due():
+                self._wake.wait(0.25)
+                self._wake.clear()
+                continue
+            batch = self.spool.claim(self.owner, self.batch_size)
+            edits = [] if batch else self.spool.changed(self.batch_size)
+            if not batch and not edits:  # what is left is being appended by another process
+                self._wake.wait(0.25)
+                self._wake.clear()
+                continue
+            self.bucket.acquire()
+            try:
+                if batch:
+                    resp = self.ws.append_rows([r for _, r in batch], value_input_option="USER_ENTERED")
+                else:
+                    data = [u for _, sheet_row, row, old in edits for u in cell_updates(sheet_row, old, row)]
+                    resp = self.ws.batch_update(data, value_input_option="USER_ENTERED") if data else None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if not is_transient(e):
+                    self.spool.park([seq for seq, _ in batch] or [seq for seq, _, _, _ in edits], error)
+                    attempt, self.last_error = 0, None
+                    self._oldest = time.monotonic() if len(self.spool) else None
+                    with self._idle:
+                        self._idle.notify_all()
+                    continue
+                attempt += 1
+                self.retries += 1
+                self.last_error = error
+                time.sleep(retry_delay(e, attempt, self.bucket))
+                continue
+            attempt = 0
+            self.last_error = None
+            if not batch:
+                self.spool.ack_changed([(seq, row) for seq, _, row, _ in edits])
+                self.flushed += len(edits)
+                self._oldest = time.monotonic() if len(self.spool) else None
+                with self._idle:
+                    self._idle.notify_all()
+                continue
+            sheet_rows = self._sheet_rows(batch, resp)
+            self.spool.ack(batch, sheet_rows)
+            self.flushed += len(batch)
+            self._oldest = time.monotonic() if len(self.spool) else None
+            if self.on_flushed:
+                try:
+                    self.on_flushed(batch, sheet_rows, resp)
+                except Exception:
+                    pass
+            with self._idle:
+                self._idle.notify_all()
+
+    def _sheet_rows(self, batch, resp):
+        """Where each appended row landed; looked up by key when the response doesn't say (one read)."""
+        sheet_rows = appended_row_numbers(resp, len(batch))
+        attempt = 0
+        while None in sheet_rows and not self._stop:
+            try:
+                return locate_rows(self.ws, [r for _, r in batch], sheet_rows, self.key_cols)
+            except Exception as e:
+                if not is_transient(e):
+                    break
+                attempt += 1
+                time.sleep(retry_delay(e, attempt, self.bucket))
+        return sheet_rows
+
+_QUEUES = {}  # (spreadsheet_id, worksheet id) -> AppendQueue
+_QUEUES_LOCK = threading.Lock()
+
+def get_append_queue(ws, on_flushed=None):
+    """Process-wide AppendQueue (sync engine) for a worksheet, backed by the local label store."""
+    key = (ws.spreadsheet_id, ws.id)
+    with _QUEUES_LOCK:
+        q = _QUEUES.get(key)
+        if q is None:
+            headers = getattr(ws, "headers", None) or []
+            key_cols = [headers.index(c) + 1 for c in ("video_id", "rater_id") if c in headers] or [1]
+            q = _QUEUES[key] = AppendQueue(ws, StoreSpool(get_label_store(), sheet_key(ws)),
+                                           on_flushed=on_flushed, key_cols=key_cols)
+        else:
+            # Pool may have reconnected: write through the live worksheet object
+            q.ws = ws
+            if on_flushed is not None:
+                q.on_flushed = on_flushed
+    return q
+
+@atexit.register
+def _flush_all_on_exit():
+    for q in list(_QUEUES.values()):
+        q.flush(timeout=5.0)